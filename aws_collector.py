@@ -1,7 +1,8 @@
 import boto3
-import json
 from botocore.exceptions import ClientError
 
+from modules.compact_renderer import render_aws_data
+
 def get_iam_info():
     iam = boto3.client('iam')
     data = {}
@@ -161,8 +162,5 @@ def collect_selected_services(selected_services):
     return aws_data
 
 def format_data_for_llm(aws_data):
-    documents = []
-    for service, content in aws_data.items():
-        doc = f"AWS {service} Information:\n" + json.dumps(content, indent=2)
-        documents.append(doc)
-    return documents
+    # Compact per-type tables instead of indented JSON, which cost several times the tokens
+    return render_aws_data(aws_data)
@@ -0,0 +1,142 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+
+
+def normalize_query(query: str) -> str:
+    """Case, punctuation and whitespace insensitive form of a question"""
+    return ' '.join(re.sub(r'[^\w\s.-]', ' ', query.lower()).split()).strip(' .')
+
+
+def compute_inventory_version(documents: List[Any]) -> str:
+    """Fingerprint of the documents an answer was generated from (strings or resource chunks)"""
+    hasher = hashlib.sha256()
+    for doc in documents:
+        hasher.update(b'\0')
+        hasher.update((doc['text'] if isinstance(doc, dict) else str(doc)).encode('utf-8'))
+    return hasher.hexdigest()[:16]
+
+
+# Words that flip or scope a question's meaning; the embedding alone can't be trusted to tell them apart
+_GUARD_TERMS = {
+    'not', 'no', 't', 'none', 'never', 'without', 'except', 'excluding', 'all', 'any', 'every', 'each', 'only',
+    'most', 'least', 'more', 'less', 'fewer', 'many', 'much', 'few', 'first', 'last', 'top'
+}
+
+
+def query_terms(normalized_query: str) -> tuple:
+    """Keyword, resource ID and negation/quantifier term sets a similar question must share exactly"""
+    from modules.hybrid_retriever import keyword_terms, find_resource_ids
+    return (frozenset(keyword_terms(normalized_query)), frozenset(find_resource_ids(normalized_query)),
+            frozenset(term for term in normalized_query.split() if term in _GUARD_TERMS))
+
+
+class AnswerCache:
+    """LRU + TTL cache of LLM answers keyed by normalized query, provider, model and inventory version.
+
+    With ``similarity_threshold`` set and ``allow_similar`` passed to get, a question that is not an exact
+    repeat can still be served from an earlier answer for the same provider/model/inventory whose query
+    embedding is close enough and whose keyword, resource ID and negation/quantifier terms are identical.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 3600, embeddings=None,
+                 similarity_threshold: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'similar_hits': 0, 'misses': 0}
+
+    def _embed(self, normalized_query: str) -> Optional[np.ndarray]:
+        if self.embeddings is None or self.similarity_threshold is None:
+            return None
+        # Compare meaningful terms only, so "do I have" style filler doesn't affect similarity
+        from modules.hybrid_retriever import keyword_terms
+        text = ' '.join(keyword_terms(normalized_query)) or normalized_query
+        vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _evict_expired(self, now: float):
+        expired = [key for key, entry in self._entries.items() if now - entry['created_at'] > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+
+    def get(self, query: str, provider: str, model: str, inventory_version: str,
+            allow_similar: bool = False) -> Optional[Dict[str, Any]]:
+        """Return the cached entry (with 'answer', 'match' and 'age_seconds') or None"""
+        normalized = normalize_query(query)
+        key = (normalized, provider, model, inventory_version)
+        now = time.time()
+        with self._lock:
+            self._evict_expired(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return dict(entry, match='exact', similarity=1.0, age_seconds=now - entry['created_at'])
+            if allow_similar:
+                terms = query_terms(normalized)
+                candidates = [(k, e) for k, e in self._entries.items()
+                              if k[1:] == key[1:] and e.get('embedding') is not None and e.get('terms') == terms]
+            else:
+                candidates = []
+
+        if candidates:
+            query_vector = self._embed(normalized)
+            if query_vector is not None:
+                best_key, best_entry, best_score = None, None, -1.0
+                for candidate_key, candidate in candidates:
+                    score = float(np.dot(query_vector, candidate['embedding']))
+                    if score > best_score:
+                        best_key, best_entry, best_score = candidate_key, candidate, score
+                if best_score >= self.similarity_threshold:
+                    with self._lock:
+                        if best_key in self._entries:
+                            self._entries.move_to_end(best_key)
+                        self.stats['similar_hits'] += 1
+                    return dict(best_entry, match='similar', similarity=best_score,
+                                age_seconds=now - best_entry['created_at'])
+
+        with self._lock:
+            self.stats['misses'] += 1
+        return None
+
+    def put(self, query: str, provider: str, model: str, inventory_version: str, answer: str):
+        normalized = normalize_query(query)
+        entry = {
+            'answer': answer,
+            'query': query,
+            'created_at': time.time(),
+            'embedding': self._embed(normalized),
+            'terms': query_terms(normalized)
+        }
+        with self._lock:
+            self._entries[(normalized, provider, model, inventory_version)] = entry
+            self._entries.move_to_end((normalized, provider, model, inventory_version))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _default_embeddings():
+    # In-process embeddings keep similarity lookups free of model-server round-trips
+    from modules.hashing_embeddings import HashingEmbeddings
+    return HashingEmbeddings(use_bigrams=False)
+
+
+# Global instance, shared by all sessions of the app
+answer_cache = AnswerCache(embeddings=_default_embeddings(), similarity_threshold=0.9)
@@ -2,6 +2,9 @@ import datetime
 import json
 import streamlit as st
 from aws_collector import collect_selected_services
+from modules.resource_chunker import chunk_aws_data
+from modules.inventory_summary import get_inventory_summary
+from modules.compact_renderer import measure_token_savings
 
 
 def serialize(obj):
@@ -18,6 +21,9 @@ def collect_aws_data(selected_services):
             aws_data = collect_selected_services(selected_services)
             aws_data = json.loads(json.dumps(aws_data, default=serialize))
             st.session_state["aws_raw_data"] = aws_data
+            # Rollups are built once per snapshot and reused by every query against it
+            st.session_state["aws_inventory_summary"] = get_inventory_summary(chunk_aws_data(aws_data))
+            st.session_state["aws_context_savings"] = measure_token_savings(aws_data)
         st.success("AWS data collected for: " + ", ".join(selected_services))
         return True
     except Exception as e:
@@ -0,0 +1,274 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Callable, Dict, List, Any, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+from modules.bedrock_models import get_model_adapter
+from modules.bedrock_query_engine import (
+    context_token_budget, invoke_bedrock_body, prepare_optimal_context, truncate_context_aggressively
+)
+from modules.token_counter import get_token_counter
+
+
+BATCH_CONCURRENCY = int(os.environ.get("BEDROCK_BATCH_CONCURRENCY", "4"))  # Questions answered at once
+BATCH_INFERENCE_MIN_RECORDS = 100  # Bedrock batch inference jobs need at least this many records
+
+# Questions asked by the "Generate Report" button when no question list is given
+DEFAULT_REPORT_QUESTIONS = [
+    "Summarize the AWS resources in this account by service and region.",
+    "Which EC2 instances are stopped, and how long have they been stopped?",
+    "Which EC2 instance types are in use, and how many instances of each?",
+    "Which security groups allow inbound traffic from 0.0.0.0/0, and on which ports?",
+    "Which S3 buckets exist, and do any of them look publicly accessible?",
+    "Which IAM roles and users exist, and do any have overly broad permissions?",
+    "Which RDS databases exist, with their engines, instance classes and status?",
+    "Which VPCs and subnets exist, and how are resources spread across them?",
+    "Which load balancers exist, and which targets do they serve?",
+    "Which CloudFormation stacks exist, and are any in a failed or rollback state?",
+    "Which resources are missing Name or environment tags?",
+    "What are the top cost optimization opportunities in this inventory?",
+    "What are the top security risks in this inventory?",
+]
+
+
+def load_questions(path: str) -> List[str]:
+    """Questions from a JSON list, or from a text file with one question per line ('#' starts a comment)"""
+    with open(path) as f:
+        content = f.read()
+    if path.endswith('.json'):
+        return [str(question).strip() for question in json.loads(content) if str(question).strip()]
+    return [line.strip() for line in content.splitlines() if line.strip() and not line.strip().startswith('#')]
+
+
+def prepare_question_bodies(questions: List[str], text_documents: List[str], model_id: str,
+                            inventory_summary: Optional[Dict[str, Any]] = None,
+                            prompt_caching: bool = True) -> List[str]:
+    """Request body for every question against one prepared inventory.
+
+    The BM25 index and token counts are built once and shared by every question. When the whole
+    inventory fits, every question gets the same context prefix for prompt caching to reuse.
+    """
+    adapter = get_model_adapter(model_id)
+    counter = get_token_counter(model_id)
+    bodies = []
+    for question in questions:
+        available_tokens = context_token_budget(adapter, question, model_id=model_id)
+        context = prepare_optimal_context(text_documents, question, adapter.input_token_budget, model_id,
+                                          adapter.input_token_budget - available_tokens, inventory_summary)
+        if counter.count(context) > available_tokens:
+            context = truncate_context_aggressively(context, available_tokens, model_id)
+        if prompt_caching:
+            bodies.append(json.dumps(adapter.build_cached_body(context, question)))
+        else:
+            bodies.append(json.dumps(adapter.build_body(adapter.format_prompt(context, question))))
+    return bodies
+
+
+def _new_result(question: str) -> Dict[str, Any]:
+    return {'question': question, 'answer': None, 'error': None, 'seconds': 0.0, 'usage': None}
+
+
+def run_question_batch(questions: List[str], text_documents: List[str], model_id: str, bedrock_runtime,
+                       max_workers: Optional[int] = None, inventory_summary: Optional[Dict[str, Any]] = None,
+                       progress_callback: Optional[Callable[[int, int], None]] = None) -> List[Dict[str, Any]]:
+    """Answer the questions concurrently, at most max_workers at a time.
+
+    Returns one result per question, in question order, with the answer or error, latency and token usage.
+    """
+    bodies = prepare_question_bodies(questions, text_documents, model_id, inventory_summary)
+    results = [_new_result(question) for question in questions]
+
+    def answer(question_id):
+        start_time = time.time()
+        result = results[question_id]
+        try:
+            result['answer'], result['usage'] = invoke_bedrock_body(bedrock_runtime, model_id, bodies[question_id],
+                                                                    'batch', questions[question_id])
+        except ClientError as e:
+            result['error'] = e.response.get('Error', {}).get('Message', str(e))
+        except Exception as e:
+            result['error'] = str(e)
+        result['seconds'] = time.time() - start_time
+
+    pending = list(range(len(questions)))
+    done = 0
+    if get_model_adapter(model_id).prompt_caching and len(pending) > 1:
+        # The first answer writes the shared context to the prompt cache, so the rest can read it
+        answer(pending.pop(0))
+        done = 1
+        if progress_callback:
+            progress_callback(done, len(questions))
+
+    workers = max(1, min(max_workers or BATCH_CONCURRENCY, len(pending) or 1))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in as_completed([executor.submit(answer, question_id) for question_id in pending]):
+            done += 1
+            if progress_callback:
+                progress_callback(done, len(questions))
+    return results
+
+
+def _split_s3_uri(uri: str) -> Tuple[str, str]:
+    """Bucket and key prefix (ending in '/' unless empty) of an s3:// URI"""
+    bucket, _, prefix = uri.replace('s3://', '', 1).partition('/')
+    if prefix and not prefix.endswith('/'):
+        prefix += '/'
+    return bucket, prefix
+
+
+def submit_batch_inference_job(questions: List[str], text_documents: List[str], model_id: str, s3_uri: str,
+                               role_arn: str, bedrock_client, s3_client,
+                               inventory_summary: Optional[Dict[str, Any]] = None,
+                               job_name: Optional[str] = None) -> str:
+    """Upload the questions as a JSONL file under s3_uri and start a Bedrock batch inference job; returns its ARN"""
+    bodies = prepare_question_bodies(questions, text_documents, model_id, inventory_summary, prompt_caching=False)
+    bucket, prefix = _split_s3_uri(s3_uri)
+    job_name = job_name or f"aws-explainer-report-{datetime.now():%Y%m%d-%H%M%S}"
+    input_key = f"{prefix}{job_name}/questions.jsonl"
+    records = "\n".join(
+        json.dumps({'recordId': f"{question_id:05d}", 'modelInput': json.loads(body)})
+        for question_id, body in enumerate(bodies)
+    )
+    s3_client.put_object(Bucket=bucket, Key=input_key, Body=records.encode('utf-8'))
+
+    response = bedrock_client.create_model_invocation_job(
+        jobName=job_name,
+        roleArn=role_arn,
+        modelId=model_id,
+        inputDataConfig={'s3InputDataConfig': {'s3Uri': f"s3://{bucket}/{input_key}", 's3InputFormat': 'JSONL'}},
+        outputDataConfig={'s3OutputDataConfig': {'s3Uri': f"s3://{bucket}/{prefix}{job_name}/output/"}}
+    )
+    return response['jobArn']
+
+
+def wait_for_batch_inference_job(job_arn: str, bedrock_client, poll_seconds: int = 60) -> Dict[str, Any]:
+    """Poll a batch inference job until it finishes; returns the final job description"""
+    while True:
+        job = bedrock_client.get_model_invocation_job(jobIdentifier=job_arn)
+        if job['status'] in ('Completed', 'PartiallyCompleted', 'Failed', 'Stopped', 'Expired'):
+            return job
+        time.sleep(poll_seconds)
+
+
+def collect_batch_inference_results(job: Dict[str, Any], questions: List[str], model_id: str,
+                                    s3_client) -> List[Dict[str, Any]]:
+    """Answers of a finished batch inference job, in question order"""
+    adapter = get_model_adapter(model_id)
+    results = [_new_result(question) for question in questions]
+    if job['status'] not in ('Completed', 'PartiallyCompleted'):
+        for result in results:
+            result['error'] = f"Batch inference job {job['status'].lower()}: {job.get('message', '')}".strip()
+        return results
+
+    # Output records are written to <output prefix>/<job id>/<input file name>.out
+    bucket, prefix = _split_s3_uri(job['outputDataConfig']['s3OutputDataConfig']['s3Uri'])
+    input_name = job['inputDataConfig']['s3InputDataConfig']['s3Uri'].rsplit('/', 1)[-1]
+    output_key = f"{prefix}{job['jobArn'].rsplit('/', 1)[-1]}/{input_name}.out"
+    output = s3_client.get_object(Bucket=bucket, Key=output_key)['Body'].read().decode('utf-8')
+
+    answered = set()
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        result = results[int(record['recordId'])]
+        answered.add(int(record['recordId']))
+        if 'modelOutput' in record:
+            result['answer'] = adapter.parse_response(record['modelOutput'])
+            result['usage'] = adapter.parse_usage(record['modelOutput'])
+        else:
+            result['error'] = record.get('error', {}).get('errorMessage', 'No output for this question')
+    for question_id, result in enumerate(results):
+        if question_id not in answered:
+            result['error'] = 'No output for this question'
+    return results
+
+
+def format_report(results: List[Dict[str, Any]], model_id: str, title: str = "AWS Infrastructure Report") -> str:
+    """Markdown report with one section per question"""
+    answered = sum(1 for result in results if result['answer'])
+    lines = [
+        f"# {title}",
+        "",
+        f"Generated {datetime.now():%Y-%m-%d %H:%M} with `{model_id}` · {answered} of {len(results)} questions answered",
+        ""
+    ]
+    for number, result in enumerate(results, 1):
+        lines.extend([f"## {number}. {result['question']}", ""])
+        lines.append(result['answer'].strip() if result['answer'] else f"_Not answered: {result['error']}_")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def write_report(results: List[Dict[str, Any]], path: str, model_id: str,
+                 title: str = "AWS Infrastructure Report") -> str:
+    """Write the report to path as Markdown, or as JSON when path ends in .json; returns the written text"""
+    if path.endswith('.json'):
+        text = json.dumps({'title': title, 'model_id': model_id, 'generated': datetime.now().isoformat(),
+                           'results': results}, indent=2, default=str)
+    else:
+        text = format_report(results, model_id, title)
+    with open(path, 'w') as f:
+        f.write(text)
+    return text
+
+
+if __name__ == '__main__':
+    import argparse
+    import boto3
+    from aws_collector import format_data_for_llm
+    from modules.bedrock_query_engine import create_bedrock_runtime
+    from modules.inventory_summary import get_inventory_summary
+    from modules.resource_chunker import chunk_aws_data
+
+    parser = argparse.ArgumentParser(description="Answer a list of questions about a collected AWS inventory and write a report")
+    parser.add_argument('questions', nargs='?', help="Question file: one question per line, or a JSON list "
+                                                     "(default: the built-in report questions)")
+    parser.add_argument('--inventory', required=True, help="Collected AWS data (JSON)")
+    parser.add_argument('--model', required=True, help="Bedrock model ID")
+    parser.add_argument('--output', default='report.md', help="Report file (.md or .json)")
+    parser.add_argument('--concurrency', type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument('--region', default=None)
+    parser.add_argument('--profile', default=None)
+    parser.add_argument('--batch-inference', action='store_true',
+                        help=f"Use a Bedrock batch inference job (needs at least {BATCH_INFERENCE_MIN_RECORDS} questions)")
+    parser.add_argument('--s3-uri', help="S3 location for batch inference input and output")
+    parser.add_argument('--role-arn', help="IAM role Bedrock assumes to read and write --s3-uri")
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions) if args.questions else DEFAULT_REPORT_QUESTIONS
+    with open(args.inventory) as f:
+        inventory = json.load(f)
+    text_documents = format_data_for_llm(inventory)
+    inventory_summary = get_inventory_summary(chunk_aws_data(inventory))
+    region = args.region or 'us-east-1'
+
+    if args.batch_inference:
+        if not args.s3_uri or not args.role_arn:
+            parser.error("--batch-inference needs --s3-uri and --role-arn")
+        if len(questions) < BATCH_INFERENCE_MIN_RECORDS:
+            parser.error(f"Bedrock batch inference needs at least {BATCH_INFERENCE_MIN_RECORDS} questions; "
+                         f"got {len(questions)}")
+        session = boto3.Session(profile_name=args.profile, region_name=region)
+        bedrock_client, s3_client = session.client('bedrock'), session.client('s3')
+        job_arn = submit_batch_inference_job(questions, text_documents, args.model, args.s3_uri, args.role_arn,
+                                             bedrock_client, s3_client, inventory_summary)
+        print(f"Started batch inference job {job_arn}; waiting for it to finish...")
+        job = wait_for_batch_inference_job(job_arn, bedrock_client)
+        results = collect_batch_inference_results(job, questions, args.model, s3_client)
+    else:
+        bedrock_runtime = create_bedrock_runtime(aws_region=region, use_cli_creds=True, aws_profile=args.profile)
+        start_time = time.time()
+        results = run_question_batch(
+            questions, text_documents, args.model, bedrock_runtime, args.concurrency, inventory_summary,
+            progress_callback=lambda done, total: print(f"   answered {done}/{total}", end='\r')
+        )
+        print(f"Answered {len(questions)} questions in {time.time() - start_time:.1f}s")
+
+    write_report(results, args.output, args.model)
+    failed = sum(1 for result in results if result['error'])
+    print(f"Wrote {args.output} ({len(results) - failed} answered, {failed} failed)")
@@ -0,0 +1,199 @@
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, Any, Iterator, Optional
+
+from botocore.exceptions import (
+    ClientError, ConnectionClosedError, ConnectTimeoutError, EndpointConnectionError, ReadTimeoutError
+)
+
+
+BEDROCK_MAX_CONCURRENCY = int(os.environ.get("BEDROCK_MAX_CONCURRENCY", "8"))  # Requests in flight per model, across sessions
+# Requeues of a throttled or transiently failed request; runtime clients have botocore's retries turned off
+BEDROCK_THROTTLE_RETRIES = int(os.environ.get("BEDROCK_THROTTLE_RETRIES", "3"))
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 20.0
+
+THROTTLING_ERROR_CODES = (
+    'ThrottlingException', 'TooManyRequestsException', 'ServiceUnavailableException', 'ModelNotReadyException'
+)
+RETRYABLE_ERROR_CODES = THROTTLING_ERROR_CODES + ('InternalServerException',)
+TRANSIENT_CONNECTION_ERRORS = (ConnectionClosedError, ConnectTimeoutError, EndpointConnectionError, ReadTimeoutError)
+# Only these mean the model's quota was exceeded and lower the concurrency limit; the rest are just requeued
+RATE_LIMIT_ERROR_CODES = ('ThrottlingException', 'throttlingException', 'TooManyRequestsException')
+
+
+def is_throttling_error(error: Exception) -> bool:
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+
+def is_retryable_error(error: Exception) -> bool:
+    return isinstance(error, TRANSIENT_CONNECTION_ERRORS) or (
+        isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in RETRYABLE_ERROR_CODES)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    # Errors raised mid-stream use the lowercase event name (throttlingException)
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in RATE_LIMIT_ERROR_CODES
+
+
+class ModelLimiter:
+    """Concurrency limit for one model that adapts to throttling.
+
+    The limit is halved whenever Bedrock throttles a request and raised by one after `limit`
+    requests in a row succeed, up to max_concurrency, so it settles at what the account's quota allows.
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.in_flight = 0
+        self.waiting = 0
+        self.requests = 0
+        self.throttled = 0
+        self.requeued = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> float:
+        """Wait for a free slot; returns the seconds spent waiting"""
+        start_time = time.monotonic()
+        with self._condition:
+            self.waiting += 1
+            while self.in_flight >= self.limit:
+                self._condition.wait()
+            self.waiting -= 1
+            self.in_flight += 1
+            wait = time.monotonic() - start_time
+            self.requests += 1
+            self.queue_wait_total += wait
+            self.queue_wait_max = max(self.queue_wait_max, wait)
+        return wait
+
+    def release(self, throttled: bool = False):
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.throttled += 1
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self._successes = 0
+            self._condition.notify_all()
+
+    def record_requeue(self):
+        with self._condition:
+            self.requeued += 1
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            return {
+                'limit': self.limit,
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'requests': self.requests,
+                'throttled': self.throttled,
+                'requeued': self.requeued,
+                'avg_queue_wait': self.queue_wait_total / self.requests if self.requests else 0.0,
+                'max_queue_wait': self.queue_wait_max
+            }
+
+
+class SlotReleasingStream:
+    """Event stream of a streaming response that keeps its model slot until it is exhausted, fails or is closed"""
+
+    def __init__(self, stream, limiter: ModelLimiter):
+        self._stream = stream
+        self._limiter = limiter
+        self._released = False
+        self._lock = threading.Lock()
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        try:
+            for event in self._stream:
+                yield event
+        except ClientError as e:
+            self.close(throttled=is_rate_limit_error(e))
+            raise
+        finally:
+            self.close()
+
+    def close(self, throttled: bool = False):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        if hasattr(self._stream, 'close'):
+            self._stream.close()
+        self._limiter.release(throttled)
+
+    def __del__(self):
+        self.close()
+
+
+class BedrockInvoker:
+    """Process-wide gate for Bedrock calls: per-model adaptive concurrency limits shared by every
+    session, with throttled requests put back in the queue after a jittered backoff."""
+
+    def __init__(self, max_concurrency: int = BEDROCK_MAX_CONCURRENCY, throttle_retries: int = BEDROCK_THROTTLE_RETRIES):
+        self.max_concurrency = max_concurrency
+        self.throttle_retries = throttle_retries
+        self._limiters: Dict[str, ModelLimiter] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def limiter(self, model_id: str) -> ModelLimiter:
+        with self._lock:
+            if model_id not in self._limiters:
+                self._limiters[model_id] = ModelLimiter(self.max_concurrency)
+            return self._limiters[model_id]
+
+    def invoke(self, model_id: str, request: Callable[[], Dict[str, Any]],
+               throttle_retries: Optional[int] = None, stream: bool = False) -> Dict[str, Any]:
+        """Run request() (one Bedrock runtime call) in one of the model's slots and return its response.
+
+        With stream=True the response 'body' is an event stream and the slot is held until it is consumed or closed.
+        """
+        limiter = self.limiter(model_id)
+        throttle_retries = self.throttle_retries if throttle_retries is None else throttle_retries
+        self._local.queue_wait = 0.0
+        for attempt in range(throttle_retries + 1):
+            self._local.queue_wait += limiter.acquire()
+            try:
+                response = request()
+            except Exception as e:
+                limiter.release(is_rate_limit_error(e))
+                if not is_retryable_error(e) or attempt == throttle_retries:
+                    raise
+            except BaseException:
+                limiter.release()
+                raise
+            else:
+                if stream:
+                    response['body'] = SlotReleasingStream(response['body'], limiter)
+                else:
+                    limiter.release()
+                return response
+            limiter.record_requeue()
+            time.sleep(min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt) * random.uniform(0.5, 1.0))
+
+    def last_queue_wait(self) -> float:
+        """Seconds the calling thread's last request spent waiting for a slot"""
+        return getattr(self._local, 'queue_wait', 0.0)
+
+    @property
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {model_id: limiter.stats for model_id, limiter in limiters.items()}
+
+
+# Global instance shared by every session in the process
+bedrock_invoker = BedrockInvoker()
@@ -4,6 +4,8 @@ import subprocess
 import streamlit as st
 from botocore.exceptions import ClientError
 
+from modules.bedrock_models import get_model_adapter, is_known_model
+
 
 def get_available_bedrock_models(aws_access_key=None, aws_secret_key=None, aws_region=None, use_cli_creds=False, skip_access_verification=False, aws_profile=None):
     """Fetch available Bedrock models and inference profiles with access granted based on AWS credentials"""
@@ -158,28 +160,7 @@ def get_available_bedrock_models(aws_access_key=None, aws_secret_key=None, aws_r
                         )
                     
                     # Test with a minimal request to verify access
-                    if "anthropic.claude" in model_id:
-                        test_body = {
-                            "anthropic_version": "bedrock-2023-05-31",
-                            "max_tokens": 10,
-                            "messages": [{"role": "user", "content": "Hi"}]
-                        }
-                    elif "amazon.titan" in model_id:
-                        test_body = {
-                            "inputText": "Hi",
-                            "textGenerationConfig": {"maxTokenCount": 10}
-                        }
-                    elif "ai21.j2" in model_id:
-                        test_body = {
-                            "prompt": "Hi",
-                            "maxTokens": 10
-                        }
-                    elif "cohere.command" in model_id:
-                        test_body = {
-                            "prompt": "Hi",
-                            "max_tokens": 10
-                        }
-                    else:
+                    if not is_known_model(model_id):
                         # For unknown models, don't test access - just include them
                         accessible_models.append({
                             'id': model_id,
@@ -189,6 +170,7 @@ def get_available_bedrock_models(aws_access_key=None, aws_secret_key=None, aws_r
                             'type': 'foundation_model'
                         })
                         continue
+                    test_body = get_model_adapter(model_id).build_body("Hi", max_tokens=10)
                     
                     # Try to invoke the model
                     bedrock_runtime.invoke_model(
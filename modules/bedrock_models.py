@@ -0,0 +1,415 @@
+from typing import Dict, Any, Optional, Tuple
+
+
+DEFAULT_RESPONSE_TOKENS = 2000  # Tokens requested for an answer, capped by the model's output limit
+
+DETAILED_PROMPT = """You are an AWS infrastructure expert analyzing actual AWS infrastructure data. You have been provided with real AWS infrastructure data below.
+
+IMPORTANT: The AWS infrastructure data provided below is real and current. Please analyze this data carefully to answer the user's question.
+
+AWS Infrastructure Data:
+{context}
+
+User Question: {query}
+
+Instructions:
+1. Look carefully at the AWS infrastructure data provided above
+2. If you see EC2 instances in the data, list their details including Instance IDs, states, and types
+3. If you see other AWS resources, analyze them as requested
+4. If the data contains information relevant to the question, use it to provide a comprehensive answer
+5. If you truly cannot find relevant information in the provided data, then explain what data would be needed
+
+Please provide a detailed and helpful response based on the actual AWS infrastructure data provided."""
+
+SHORT_PROMPT = """You are an AWS infrastructure expert. Based on the following AWS infrastructure data, please answer the user's question.
+
+AWS Infrastructure Data:
+{context}
+
+User Question: {query}
+
+Please provide a detailed and helpful response about the AWS infrastructure."""
+
+# Map-reduce: each batch of the inventory is answered on its own, then the partial answers are merged
+MAP_PROMPT = """You are an AWS infrastructure expert. The AWS infrastructure data below is one batch of a larger inventory; other batches are analyzed separately.
+
+AWS Infrastructure Data (one batch):
+{context}
+
+User Question: {query}
+
+Extract everything in this batch that is relevant to the question: matching resources with their IDs, names, states and key settings, and counts. Be concise and factual, and don't draw conclusions about resources outside this batch. If nothing in this batch is relevant, reply only with: NO RELEVANT DATA"""
+
+REDUCE_PROMPT = """You are an AWS infrastructure expert. The question below was answered separately for each batch of an AWS inventory. Combine the partial answers into one complete answer for the whole inventory.
+
+{context}
+
+User Question: {query}
+
+Instructions:
+1. Merge the partial answers; add up counts across batches instead of repeating them
+2. Keep the resource IDs and details from the partial answers that answer the question
+3. Don't mention batches or partial answers in your response
+
+Please provide a detailed and helpful response about the AWS infrastructure."""
+
+
+class BedrockModelAdapter:
+    """Request format, response parsing, limits and pricing for a Bedrock model family.
+
+    This base class speaks the generic ``{"prompt": ..., "max_tokens": ...}`` format; subclasses
+    override the builders and parsers for their provider's native API.
+    """
+
+    family = 'generic'
+    prompt_template = SHORT_PROMPT
+    supports_streaming = True
+    # Prompt caching pricing relative to regular input tokens
+    cache_read_discount = 0.0
+    cache_write_premium = 0.0
+
+    def __init__(self, pattern: str, context_window: int, max_output_tokens: int,
+                 input_price_per_1k: float = 0.0, output_price_per_1k: float = 0.0,
+                 prompt_caching: bool = False):
+        self.pattern = pattern
+        self.context_window = context_window
+        self.max_output_tokens = max_output_tokens
+        self.input_price_per_1k = input_price_per_1k
+        self.output_price_per_1k = output_price_per_1k
+        self.prompt_caching = prompt_caching
+
+    def matches(self, model_id: str) -> bool:
+        return self.pattern in model_id
+
+    @property
+    def response_tokens(self) -> int:
+        return min(DEFAULT_RESPONSE_TOKENS, self.max_output_tokens)
+
+    @property
+    def input_token_budget(self) -> int:
+        """Tokens available for prompt + context once the answer's share of the window is reserved"""
+        return self.context_window - self.response_tokens
+
+    def format_prompt(self, context: str, query: str, template: Optional[str] = None) -> str:
+        return (template or self.prompt_template).format(context=context, query=query)
+
+    def split_prompt(self, context: str, query: str, template: Optional[str] = None) -> Tuple[str, str]:
+        """The prompt as a prefix ending with the context, which is the same for every question, and the question suffix"""
+        head, tail = (template or self.prompt_template).split("{context}", 1)
+        return head + context, tail.format(query=query)
+
+    def build_body(self, prompt: str, max_tokens: Optional[int] = None) -> Dict[str, Any]:
+        return {
+            "prompt": prompt,
+            "max_tokens": max_tokens or self.response_tokens,
+            "temperature": 0.1
+        }
+
+    def build_stream_body(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Request body for invoke_model_with_response_stream, from the body built for invoke_model"""
+        return body
+
+    def build_cached_body(self, context: str, query: str, max_tokens: Optional[int] = None,
+                          template: Optional[str] = None) -> Dict[str, Any]:
+        """Request body with the context prefix marked for prompt caching where the model supports it"""
+        return self.build_body(self.format_prompt(context, query, template), max_tokens)
+
+    def parse_response(self, response_body: Dict[str, Any]) -> str:
+        # Try to extract text from common response formats
+        for key in ('completion', 'text', 'generated_text', 'generation'):
+            if key in response_body:
+                return response_body[key]
+        if response_body.get('outputs'):
+            return response_body['outputs'][0]['text']
+        return str(response_body)
+
+    def parse_stream_chunk(self, chunk: Dict[str, Any]) -> str:
+        """Text fragment carried by one response-stream chunk ('' if none)"""
+        for key in ('completion', 'generation', 'text', 'outputText'):
+            if key in chunk:
+                return chunk[key] or ''
+        if chunk.get('outputs'):
+            return chunk['outputs'][0].get('text', '')
+        return ''
+
+    def parse_usage(self, response_body: Dict[str, Any]) -> Optional[Dict[str, int]]:
+        """Token usage of a response (input, output, cache read and cache write tokens), if reported"""
+        return None
+
+    def parse_stream_usage(self, chunk: Dict[str, Any]) -> Optional[Dict[str, int]]:
+        """Token usage carried by one response-stream chunk, if any; later chunks update earlier ones"""
+        return None
+
+    def estimate_cost(self, input_tokens: int, output_tokens: int) -> float:
+        """Estimated on-demand price in USD"""
+        return (input_tokens * self.input_price_per_1k + output_tokens * self.output_price_per_1k) / 1000
+
+    def estimate_usage_cost(self, usage: Dict[str, int]) -> float:
+        """Price in USD of a response's token usage, with cache reads and writes at their own rates"""
+        cache_tokens = (usage.get('cache_read_tokens', 0) * (1 - self.cache_read_discount)
+                        + usage.get('cache_write_tokens', 0) * (1 + self.cache_write_premium))
+        return self.estimate_cost(usage.get('input_tokens', 0) + cache_tokens, usage.get('output_tokens', 0))
+
+    def estimate_cache_savings(self, cache_read_tokens: int, cache_write_tokens: int) -> float:
+        """USD saved by prompt caching: discounted cache reads less the premium paid for cache writes"""
+        return (cache_read_tokens * self.cache_read_discount
+                - cache_write_tokens * self.cache_write_premium) * self.input_price_per_1k / 1000
+
+
+def _usage(input_tokens=None, output_tokens=None, cache_read_tokens=None, cache_write_tokens=None) -> Dict[str, int]:
+    values = {'input_tokens': input_tokens, 'output_tokens': output_tokens,
+              'cache_read_tokens': cache_read_tokens, 'cache_write_tokens': cache_write_tokens}
+    return {key: value or 0 for key, value in values.items() if value is not None}
+
+
+class AnthropicAdapter(BedrockModelAdapter):
+    family = 'anthropic'
+    prompt_template = "Human: " + DETAILED_PROMPT + "\nAssistant:"
+    cache_read_discount = 0.9   # Cache reads cost 10% of input tokens
+    cache_write_premium = 0.25  # Cache writes cost 125%
+
+    def build_body(self, prompt, max_tokens=None):
+        return {
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": max_tokens or self.response_tokens,
+            "messages": [{"role": "user", "content": prompt}]
+        }
+
+    def build_cached_body(self, context, query, max_tokens=None, template=None):
+        if not self.prompt_caching:
+            return super().build_cached_body(context, query, max_tokens, template)
+        prefix, suffix = self.split_prompt(context, query, template)
+        body = self.build_body(prefix, max_tokens)
+        body["messages"][0]["content"] = [
+            {"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": suffix}
+        ]
+        return body
+
+    def parse_response(self, response_body):
+        return response_body['content'][0]['text']
+
+    def parse_stream_chunk(self, chunk):
+        if chunk.get('type') == 'content_block_delta':
+            return chunk.get('delta', {}).get('text', '')
+        return ''
+
+    @staticmethod
+    def _parse_usage(usage):
+        return _usage(usage.get('input_tokens'), usage.get('output_tokens'),
+                      usage.get('cache_read_input_tokens'), usage.get('cache_creation_input_tokens'))
+
+    def parse_usage(self, response_body):
+        return self._parse_usage(response_body['usage']) if 'usage' in response_body else None
+
+    def parse_stream_usage(self, chunk):
+        if chunk.get('type') == 'message_start':
+            return self._parse_usage(chunk.get('message', {}).get('usage', {}))
+        if chunk.get('type') == 'message_delta' and 'usage' in chunk:
+            return _usage(output_tokens=chunk['usage'].get('output_tokens'))
+        return None
+
+
+class TitanAdapter(BedrockModelAdapter):
+    family = 'amazon-titan'
+    prompt_template = DETAILED_PROMPT
+
+    def build_body(self, prompt, max_tokens=None):
+        return {
+            "inputText": prompt,
+            "textGenerationConfig": {
+                "maxTokenCount": max_tokens or self.response_tokens,
+                "temperature": 0.1,
+                "topP": 0.9
+            }
+        }
+
+    def parse_response(self, response_body):
+        return response_body['results'][0]['outputText']
+
+    def parse_stream_chunk(self, chunk):
+        return chunk.get('outputText', '')
+
+
+class NovaAdapter(BedrockModelAdapter):
+    family = 'amazon-nova'
+    prompt_template = DETAILED_PROMPT
+    cache_read_discount = 0.75  # Cache reads cost 25% of input tokens; writes cost nothing extra
+
+    def build_body(self, prompt, max_tokens=None):
+        return {
+            "schemaVersion": "messages-v1",
+            "messages": [{"role": "user", "content": [{"text": prompt}]}],
+            "inferenceConfig": {"maxTokens": max_tokens or self.response_tokens, "temperature": 0.1}
+        }
+
+    def build_cached_body(self, context, query, max_tokens=None, template=None):
+        if not self.prompt_caching:
+            return super().build_cached_body(context, query, max_tokens, template)
+        prefix, suffix = self.split_prompt(context, query, template)
+        body = self.build_body(prefix, max_tokens)
+        body["messages"][0]["content"] = [{"text": prefix}, {"cachePoint": {"type": "default"}}, {"text": suffix}]
+        return body
+
+    def parse_response(self, response_body):
+        return response_body['output']['message']['content'][0]['text']
+
+    def parse_stream_chunk(self, chunk):
+        return chunk.get('contentBlockDelta', {}).get('delta', {}).get('text', '')
+
+    @staticmethod
+    def _parse_usage(usage):
+        return _usage(usage.get('inputTokens'), usage.get('outputTokens'),
+                      usage.get('cacheReadInputTokenCount'), usage.get('cacheWriteInputTokenCount'))
+
+    def parse_usage(self, response_body):
+        return self._parse_usage(response_body['usage']) if 'usage' in response_body else None
+
+    def parse_stream_usage(self, chunk):
+        if 'usage' in chunk.get('metadata', {}):
+            return self._parse_usage(chunk['metadata']['usage'])
+        return None
+
+
+class AI21Adapter(BedrockModelAdapter):
+    family = 'ai21-jurassic'
+    supports_streaming = False  # Jurassic-2 models have no streaming API
+
+    def build_body(self, prompt, max_tokens=None):
+        return {
+            "prompt": prompt,
+            "maxTokens": max_tokens or self.response_tokens,
+            "temperature": 0.1
+        }
+
+    def parse_response(self, response_body):
+        return response_body['completions'][0]['data']['text']
+
+
+class CohereAdapter(BedrockModelAdapter):
+    family = 'cohere-command'
+
+    def build_stream_body(self, body):
+        # Command (legacy) only emits incremental chunks when asked to
+        return dict(body, stream=True)
+
+    def parse_response(self, response_body):
+        return response_body['generations'][0]['text']
+
+    def parse_stream_chunk(self, chunk):
+        if 'generations' in chunk:
+            return chunk['generations'][0].get('text', '')
+        return chunk.get('text', '')
+
+
+class CohereChatAdapter(BedrockModelAdapter):
+    family = 'cohere-command-r'
+
+    def build_body(self, prompt, max_tokens=None):
+        return {
+            "message": prompt,
+            "max_tokens": max_tokens or self.response_tokens,
+            "temperature": 0.1
+        }
+
+    def parse_response(self, response_body):
+        return response_body['text']
+
+    def parse_stream_chunk(self, chunk):
+        if chunk.get('event_type', 'text-generation') == 'text-generation':
+            return chunk.get('text', '')
+        return ''
+
+
+class LlamaAdapter(BedrockModelAdapter):
+    family = 'meta-llama'
+
+    def format_prompt(self, context, query, template=None):
+        prompt = super().format_prompt(context, query, template)
+        return ("<|begin_of_text|><|start_header_id|>user<|end_header_id|>\n\n"
+                f"{prompt}<|eot_id|><|start_header_id|>assistant<|end_header_id|>\n\n")
+
+    def build_body(self, prompt, max_tokens=None):
+        return {
+            "prompt": prompt,
+            "max_gen_len": max_tokens or self.response_tokens,
+            "temperature": 0.1
+        }
+
+    def parse_response(self, response_body):
+        return response_body['generation']
+
+    def parse_stream_chunk(self, chunk):
+        return chunk.get('generation', '')
+
+
+class MistralAdapter(BedrockModelAdapter):
+    family = 'mistral'
+
+    def format_prompt(self, context, query, template=None):
+        return f"<s>[INST] {super().format_prompt(context, query, template)} [/INST]"
+
+    def parse_response(self, response_body):
+        return response_body['outputs'][0]['text']
+
+    def parse_stream_chunk(self, chunk):
+        if chunk.get('outputs'):
+            return chunk['outputs'][0].get('text', '')
+        return ''
+
+
+# Checked in order, so specific model patterns come before their family's catch-all.
+# Prices are on-demand USD per 1,000 input / output tokens; prompt_caching marks models with Bedrock prompt caching.
+MODEL_REGISTRY = [
+    AnthropicAdapter('claude-opus-4', 200_000, 32_000, 0.015, 0.075, prompt_caching=True),
+    AnthropicAdapter('claude-sonnet-4', 200_000, 64_000, 0.003, 0.015, prompt_caching=True),
+    AnthropicAdapter('claude-3-7-sonnet', 200_000, 64_000, 0.003, 0.015, prompt_caching=True),
+    AnthropicAdapter('claude-3-5-sonnet', 200_000, 8_192, 0.003, 0.015),
+    AnthropicAdapter('claude-3-5-haiku', 200_000, 8_192, 0.0008, 0.004, prompt_caching=True),
+    AnthropicAdapter('claude-3-opus', 200_000, 4_096, 0.015, 0.075),
+    AnthropicAdapter('claude-3-sonnet', 200_000, 4_096, 0.003, 0.015),
+    AnthropicAdapter('claude-3-haiku', 200_000, 4_096, 0.00025, 0.00125),
+    AnthropicAdapter('claude-instant', 100_000, 4_096, 0.0008, 0.0024),
+    AnthropicAdapter('claude-v2', 100_000, 4_096, 0.008, 0.024),
+    AnthropicAdapter('anthropic.claude', 200_000, 4_096, 0.003, 0.015),
+    NovaAdapter('nova-micro', 128_000, 5_000, 0.000035, 0.00014, prompt_caching=True),
+    NovaAdapter('nova-lite', 300_000, 5_000, 0.00006, 0.00024, prompt_caching=True),
+    NovaAdapter('nova-pro', 300_000, 5_000, 0.0008, 0.0032, prompt_caching=True),
+    NovaAdapter('amazon.nova', 300_000, 5_000, 0.0008, 0.0032, prompt_caching=True),
+    TitanAdapter('titan-text-premier', 32_000, 3_072, 0.0005, 0.0015),
+    TitanAdapter('titan-text-lite', 4_096, 4_096, 0.00015, 0.0002),
+    TitanAdapter('amazon.titan', 8_192, 8_192, 0.0002, 0.0006),
+    AI21Adapter('j2-ultra', 8_191, 8_191, 0.0188, 0.0188),
+    AI21Adapter('ai21.j2', 8_191, 8_191, 0.0125, 0.0125),
+    CohereChatAdapter('command-r-plus', 128_000, 4_000, 0.003, 0.015),
+    CohereChatAdapter('command-r', 128_000, 4_000, 0.0005, 0.0015),
+    CohereAdapter('command-light', 4_000, 4_000, 0.0003, 0.0006),
+    CohereAdapter('cohere.command', 4_000, 4_000, 0.0015, 0.002),
+    LlamaAdapter('llama3-1-405b', 128_000, 2_048, 0.0024, 0.0024),
+    LlamaAdapter('llama3-1-70b', 128_000, 2_048, 0.00072, 0.00072),
+    LlamaAdapter('llama3-1', 128_000, 2_048, 0.00022, 0.00022),
+    LlamaAdapter('llama3-2', 128_000, 2_048, 0.00016, 0.00016),
+    LlamaAdapter('llama3-3', 128_000, 2_048, 0.00072, 0.00072),
+    LlamaAdapter('llama3-70b', 8_192, 2_048, 0.00265, 0.0035),
+    LlamaAdapter('meta.llama', 8_192, 2_048, 0.0003, 0.0006),
+    MistralAdapter('mistral-large', 128_000, 8_192, 0.004, 0.012),
+    MistralAdapter('mixtral', 32_000, 4_096, 0.00045, 0.0007),
+    MistralAdapter('mistral.', 32_000, 8_192, 0.00015, 0.0002),
+    # Inference profiles that don't name their model were Claude-only when they were introduced
+    AnthropicAdapter('inference-profile', 200_000, 4_096, 0.003, 0.015),
+]
+
+# Unknown models get a conservative window
+GENERIC_ADAPTER = BedrockModelAdapter('', 8_000, 2_000)
+
+
+def get_model_adapter(model_id: str) -> BedrockModelAdapter:
+    """Registry entry for a model ID, inference profile ID or ARN"""
+    for adapter in MODEL_REGISTRY:
+        if adapter.matches(model_id):
+            return adapter
+    return GENERIC_ADAPTER
+
+
+def is_known_model(model_id: str) -> bool:
+    return get_model_adapter(model_id) is not GENERIC_ADAPTER
@@ -1,245 +1,507 @@
 import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 import streamlit as st
 
+from modules.bedrock_models import get_model_adapter, MAP_PROMPT, REDUCE_PROMPT
+from modules.bedrock_invoker import bedrock_invoker, is_throttling_error
+from modules.bedrock_router import RoutedBedrockRuntime
+from modules.query_metrics import query_metrics
+from modules.token_counter import get_token_counter
+from modules.context_packer import get_token_counts, pack_documents, rank_documents
+from modules.inventory_summary import summary_levels
 
-def query_bedrock_model(query, text_documents, model_id, aws_access_key=None, aws_secret_key=None, aws_region=None, use_cli_creds=False, debug=False, aws_profile=None):
-    """Query AWS Bedrock model with the provided documents and query"""
-    try:
-        # Create Bedrock Runtime client
+
+SAFETY_MARGIN = 0.02  # Share of the input budget kept free for token-count error
+SUMMARY_BUDGET_SHARE = 0.3  # Most of the context budget an inventory summary may take
+MAP_CONCURRENCY = int(os.environ.get("BEDROCK_MAP_CONCURRENCY", "4"))  # Inventory batches queried at once in map-reduce mode
+MAP_RESPONSE_TOKENS = 1000  # Partial answers stay short so many of them fit in one reduce call
+NO_RELEVANT_DATA = "NO RELEVANT DATA"
+# Every call goes through bedrock_invoker, which owns retries; botocore retrying inside a limiter slot
+# would multiply the attempts (and hold the slot through them)
+RUNTIME_CLIENT_CONFIG = Config(retries={'mode': 'standard', 'total_max_attempts': 1})
+
+# Runtime clients are shared per credentials and region, so their connection pools are reused
+_runtime_clients = {}
+_runtime_clients_lock = threading.Lock()
+
+
+def create_bedrock_runtime(aws_access_key=None, aws_secret_key=None, aws_region=None, use_cli_creds=False, aws_profile=None,
+                           regions=None):
+    """Bedrock Runtime client from explicit keys or an AWS CLI profile, without botocore retries.
+
+    Clients are reused for the same credentials and region; throttling and retries are handled by
+    bedrock_invoker for all of them. With regions (region names or inference profile IDs/ARNs),
+    returns a RoutedBedrockRuntime that balances calls across aws_region and those targets.
+    """
+    if regions:
+        default_region = aws_region or 'us-east-1'
+        targets = list(dict.fromkeys([default_region] + list(regions)))
+        return RoutedBedrockRuntime(targets, lambda region: create_bedrock_runtime(
+            aws_access_key, aws_secret_key, region, use_cli_creds, aws_profile
+        ), default_region)
+
+    key = (use_cli_creds, aws_profile, aws_region, aws_access_key, aws_secret_key)
+    with _runtime_clients_lock:
+        if key in _runtime_clients:
+            return _runtime_clients[key]
+        config = RUNTIME_CLIENT_CONFIG
         if use_cli_creds:
             if aws_profile and aws_profile != "default":
                 session = boto3.Session(profile_name=aws_profile)
-                bedrock_runtime = session.client('bedrock-runtime', region_name=aws_region or 'us-east-1')
+                client = session.client('bedrock-runtime', region_name=aws_region or 'us-east-1', config=config)
             else:
-                bedrock_runtime = boto3.client('bedrock-runtime', region_name=aws_region or 'us-east-1')
+                client = boto3.client('bedrock-runtime', region_name=aws_region or 'us-east-1', config=config)
         else:
-            bedrock_runtime = boto3.client(
+            client = boto3.client(
                 'bedrock-runtime',
                 aws_access_key_id=aws_access_key,
                 aws_secret_access_key=aws_secret_key,
-                region_name=aws_region
+                region_name=aws_region,
+                config=config
             )
+        _runtime_clients[key] = client
+        return client
+
+def prepare_bedrock_context(text_documents, query, adapter, debug=False, model_id=None, inventory_summary=None):
+    """Fit the documents into the model's input budget; returns None when even a minimal context is too long"""
+    # Size the context from the model's real window, less the tokens reserved for the answer
+    max_input_tokens = adapter.input_token_budget
+    counter = get_token_counter(model_id)
+    # Measure the prompt around the context instead of guessing, and keep a small margin for counting error
+    prompt_tokens = counter.count(adapter.format_prompt("", query))
+    reserved_tokens = prompt_tokens + int(max_input_tokens * SAFETY_MARGIN)
+    available_tokens = max_input_tokens - reserved_tokens
+    context = prepare_optimal_context(text_documents, query, max_input_tokens, model_id, reserved_tokens, inventory_summary)
+    
+    if debug:
+        st.info(f"Model family: {adapter.family}, context window: {adapter.context_window:,} tokens, "
+                f"input budget: {max_input_tokens:,} tokens ({counter.mode} token counts)")
+        st.info(f"Context length: {len(context)} characters (~{counter.count(context)} tokens)")
+        st.info(f"Prompt and query: ~{prompt_tokens} tokens")
+        st.info(f"Estimated total input tokens: {counter.count(context) + prompt_tokens}")
         
-        # Prepare optimized context based on model token limits
-        # Be more conservative with token limits to avoid "Input is too long" errors
-        max_input_tokens = 8000  # Very conservative limit for input
-        context = prepare_optimal_context(text_documents, query, max_input_tokens)
-        
+    # Double-check context length and truncate if necessary
+    if counter.count(context) > available_tokens:
+        context = truncate_context_aggressively(context, available_tokens, model_id)
         if debug:
-            st.info(f"Context length: {len(context)} characters (~{estimate_tokens(context)} tokens)")
-            st.info(f"Query length: {len(query)} characters (~{estimate_tokens(query)} tokens)")
-            estimated_total = estimate_tokens(context) + estimate_tokens(query) + 500  # 500 for prompt structure
-            st.info(f"Estimated total input tokens: {estimated_total}")
-            
-        # Double-check context length and truncate if necessary
-        if estimate_tokens(context) > max_input_tokens - 1000:
-            context = truncate_context_aggressively(context, max_input_tokens - 1000)
-            if debug:
-                st.warning(f"Context was too long, truncated to {len(context)} characters (~{estimate_tokens(context)} tokens)")
+            st.warning(f"Context was too long, truncated to {len(context)} characters (~{counter.count(context)} tokens)")
+    
+    # Pre-flight check to prevent "Input is too long" errors
+    total_estimated_tokens = counter.count(context) + reserved_tokens
+    if total_estimated_tokens > max_input_tokens:
+        st.error(f"🚨 **Input Too Long - Pre-flight Check**")
+        st.error(f"Estimated total tokens: {total_estimated_tokens}, limit: {max_input_tokens}")
+        st.info("**Suggestions:**")
+        st.info("1. Try asking a more specific question")
+        st.info("2. Use fewer AWS resources or regions")
+        st.info("3. Enable debug mode to see exact token counts")
         
-        # Pre-flight check to prevent "Input is too long" errors
-        total_estimated_tokens = estimate_tokens(context) + estimate_tokens(query) + 1000
-        if total_estimated_tokens > max_input_tokens:
-            st.error(f"🚨 **Input Too Long - Pre-flight Check**")
-            st.error(f"Estimated total tokens: {total_estimated_tokens}, limit: {max_input_tokens}")
-            st.info("**Suggestions:**")
-            st.info("1. Try asking a more specific question")
-            st.info("2. Use fewer AWS resources or regions")
-            st.info("3. Enable debug mode to see exact token counts")
-            
-            # Offer to try with an even smaller context
-            if len(context) > 1000:
-                st.info("💡 **Auto-recovery attempt**: Trying with minimal context...")
-                context = create_minimal_context(text_documents, query)
-                total_estimated_tokens = estimate_tokens(context) + estimate_tokens(query) + 1000
-                if total_estimated_tokens <= max_input_tokens:
-                    st.success(f"✅ Reduced context to {estimate_tokens(context)} tokens, proceeding...")
-                else:
-                    return None
+        # Offer to try with an even smaller context
+        if len(context) > 1000:
+            st.info("💡 **Auto-recovery attempt**: Trying with minimal context...")
+            context = create_minimal_context(text_documents, query)
+            total_estimated_tokens = counter.count(context) + reserved_tokens
+            if total_estimated_tokens <= max_input_tokens:
+                st.success(f"✅ Reduced context to {counter.count(context)} tokens, proceeding...")
             else:
                 return None
-        
-        # Prepare the prompt based on model type
-        if "anthropic.claude" in model_id or "inference-profile" in model_id or model_id.startswith("us."):
-            prompt = f"""Human: You are an AWS infrastructure expert analyzing actual AWS infrastructure data. You have been provided with real AWS infrastructure data below.
-
-IMPORTANT: The AWS infrastructure data provided below is real and current. Please analyze this data carefully to answer the user's question.
-
-AWS Infrastructure Data:
-{context}
-
-User Question: {query}
-
-Instructions:
-1. Look carefully at the AWS infrastructure data provided above
-2. If you see EC2 instances in the data, list their details including Instance IDs, states, and types
-3. If you see other AWS resources, analyze them as requested
-4. If the data contains information relevant to the question, use it to provide a comprehensive answer
-5. If you truly cannot find relevant information in the provided data, then explain what data would be needed
-
-Please provide a detailed and helpful response based on the actual AWS infrastructure data provided.
-Assistant:"""
-            
-            body = json.dumps({
-                "anthropic_version": "bedrock-2023-05-31",
-                "max_tokens": 2000,  # Reduced to leave more room for input
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ]
-            })
-            
-        elif "amazon.titan" in model_id:
-            prompt = f"""You are an AWS infrastructure expert analyzing actual AWS infrastructure data. You have been provided with real AWS infrastructure data below.
-
-IMPORTANT: The AWS infrastructure data provided below is real and current. Please analyze this data carefully to answer the user's question.
-
-AWS Infrastructure Data:
-{context}
-
-User Question: {query}
-
-Instructions:
-1. Look carefully at the AWS infrastructure data provided above
-2. If you see EC2 instances in the data, list their details including Instance IDs, states, and types
-3. If you see other AWS resources, analyze them as requested
-4. If the data contains information relevant to the question, use it to provide a comprehensive answer
-5. If you truly cannot find relevant information in the provided data, then explain what data would be needed
-
-Please provide a detailed and helpful response based on the actual AWS infrastructure data provided."""
-            
-            body = json.dumps({
-                "inputText": prompt,
-                "textGenerationConfig": {
-                    "maxTokenCount": 2000,  # Reduced to leave more room for input
-                    "temperature": 0.1,
-                    "topP": 0.9
-                }
-            })
-            
-        elif "ai21.j2" in model_id:
-            prompt = f"""You are an AWS infrastructure expert. Based on the following AWS infrastructure data, please answer the user's question.
-
-AWS Infrastructure Data:
-{context}
-
-User Question: {query}
-
-Please provide a detailed and helpful response about the AWS infrastructure."""
-            
-            body = json.dumps({
-                "prompt": prompt,
-                "maxTokens": 2000,  # Reduced to leave more room for input
-                "temperature": 0.1
-            })
-            
-        elif "cohere.command" in model_id:
-            prompt = f"""You are an AWS infrastructure expert. Based on the following AWS infrastructure data, please answer the user's question.
-
-AWS Infrastructure Data:
-{context}
-
-User Question: {query}
-
-Please provide a detailed and helpful response about the AWS infrastructure."""
-            
-            body = json.dumps({
-                "prompt": prompt,
-                "max_tokens": 2000,  # Reduced to leave more room for input
-                "temperature": 0.1
-            })
-            
         else:
-            # Generic fallback for unknown models
-            prompt = f"""You are an AWS infrastructure expert. Based on the following AWS infrastructure data, please answer the user's question.
+            return None
+    
+    return context
+
+def prepare_request_body(bedrock_runtime, query, text_documents, model_id, debug=False, inventory_summary=None, map_reduce=False):
+    """JSON request body for the answer: a single-call context, or the reduce step of map-reduce"""
+    adapter = get_model_adapter(model_id)
+    if map_reduce and exceeds_context_window(text_documents, query, adapter, model_id):
+        prompt = run_map_reduce(bedrock_runtime, query, text_documents, model_id, debug, inventory_summary)
+        return json.dumps(adapter.build_body(prompt))
+    context = prepare_bedrock_context(text_documents, query, adapter, debug, model_id, inventory_summary)
+    if context is None:
+        return None
+    return build_request_body(model_id, context, query)
+
+def invoke_runtime(bedrock_runtime, model_id, operation, **kwargs):
+    """Run a runtime operation ('invoke_model' or 'invoke_model_with_response_stream') through the
+    invoker's per-model queue, or across regions for a RoutedBedrockRuntime"""
+    if isinstance(bedrock_runtime, RoutedBedrockRuntime):
+        return bedrock_runtime.invoke(model_id, operation, **kwargs)
+    return bedrock_invoker.invoke(model_id, lambda: getattr(bedrock_runtime, operation)(modelId=model_id, **kwargs),
+                                  stream=operation == 'invoke_model_with_response_stream')
+
+def response_usage(adapter, response, response_body):
+    """Token usage reported in the response body, or else in Bedrock's token-count response headers"""
+    usage = adapter.parse_usage(response_body)
+    headers = response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+    if not usage and 'x-amzn-bedrock-input-token-count' in headers:
+        usage = {
+            'input_tokens': int(headers['x-amzn-bedrock-input-token-count']),
+            'output_tokens': int(headers.get('x-amzn-bedrock-output-token-count', 0))
+        }
+    return usage
+
+def record_bedrock_call(model_id, operation, start_time, body=None, answer=None, usage=None, query=None,
+                        prepare_seconds=None, first_token_seconds=None, error=None):
+    """Store a Bedrock call's latency, tokens and cost in the query metrics store; returns the recorded metrics"""
+    adapter = get_model_adapter(model_id)
+    token_source = 'reported' if usage else 'estimated'
+    if not usage:
+        usage = {'input_tokens': estimate_tokens(body or '', model_id), 'output_tokens': estimate_tokens(answer or '', model_id)}
+    metrics = dict(
+        usage,
+        query=query,
+        prepare_seconds=prepare_seconds,
+        first_token_seconds=first_token_seconds,
+        latency_seconds=time.time() - start_time,
+        token_source=token_source,
+        cost_usd=adapter.estimate_usage_cost(usage),
+        success=error is None,
+        error=error
+    )
+    query_metrics.record('Bedrock', model_id, operation, **metrics)
+    return metrics
+
+def invoke_bedrock_body(bedrock_runtime, model_id, body, operation='invoke', query=None):
+    """Generated text and token usage for a JSON request body; raises on errors, so it is safe to run in worker threads"""
+    adapter = get_model_adapter(model_id)
+    start_time = time.time()
+    try:
+        response = invoke_runtime(
+            bedrock_runtime, model_id, 'invoke_model',
+            body=body,
+            accept='application/json',
+            contentType='application/json'
+        )
+        response_body = json.loads(response.get('body').read())
+        answer, usage = adapter.parse_response(response_body), response_usage(adapter, response, response_body)
+    except Exception as e:
+        record_bedrock_call(model_id, operation, start_time, body, query=query, error=str(e))
+        raise
+    record_bedrock_call(model_id, operation, start_time, body, answer, usage, query)
+    return answer, usage
+
+def invoke_bedrock_prompt(bedrock_runtime, model_id, prompt, max_tokens=None, operation='invoke', query=None):
+    """Generated text for a ready-made prompt; raises on errors, so it is safe to run in worker threads"""
+    body = json.dumps(get_model_adapter(model_id).build_body(prompt, max_tokens))
+    return invoke_bedrock_body(bedrock_runtime, model_id, body, operation, query)[0]
+
+def context_token_budget(adapter, query, template=None, model_id=None):
+    """Context tokens left in the input budget once the prompt template, query and safety margin are counted"""
+    max_input_tokens = adapter.input_token_budget
+    prompt_tokens = get_token_counter(model_id).count(adapter.format_prompt("", query, template))
+    return max_input_tokens - prompt_tokens - int(max_input_tokens * SAFETY_MARGIN)
+
+def exceeds_context_window(text_documents, query, adapter, model_id=None):
+    """Whether the whole inventory is too large to send to the model in one call"""
+    document_tokens = get_token_counts(text_documents, model_id) if text_documents else []
+    separator_tokens = get_token_counter(model_id).count("\n\n")
+    total_tokens = sum(document_tokens) + separator_tokens * max(len(document_tokens) - 1, 0)
+    return total_tokens > context_token_budget(adapter, query, model_id=model_id)
+
+def shard_documents(text_documents, max_tokens, model_id=None, token_counts=None):
+    """Split document indexes, in order, into batches of at most max_tokens; an oversized document is a batch of its own"""
+    if token_counts is None:
+        token_counts = get_token_counts(text_documents, model_id) if text_documents else []
+    separator_tokens = get_token_counter(model_id).count("\n\n")
+    shards, current, used_tokens = [], [], 0
+    for doc_id, tokens in enumerate(token_counts):
+        if current and used_tokens + separator_tokens + tokens > max_tokens:
+            shards.append(current)
+            current, used_tokens = [], 0
+        used_tokens += tokens + (separator_tokens if current else 0)
+        current.append(doc_id)
+    if current:
+        shards.append(current)
+    return shards
+
+def invoke_concurrently(bedrock_runtime, model_id, prompts, max_tokens=None, max_workers=None, label="batches",
+                        operation='invoke', query=None):
+    """Invoke the model for every prompt with at most max_workers requests in flight.
+
+    Returns the answers in prompt order (None where a request failed) and the exceptions raised.
+    """
+    workers = max(1, min(max_workers or MAP_CONCURRENCY, len(prompts)))
+    answers = [None] * len(prompts)
+    errors = []
+    progress = st.progress(0.0, text=f"Analyzing {len(prompts)} {label} ({workers} at a time)...")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(invoke_bedrock_prompt, bedrock_runtime, model_id, prompt, max_tokens, operation, query): prompt_id
+            for prompt_id, prompt in enumerate(prompts)
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                answers[futures[future]] = future.result()
+            except Exception as e:
+                errors.append(e)
+            progress.progress(done / len(prompts), text=f"Analyzed {done} of {len(prompts)} {label}")
+    progress.empty()
+    return answers, errors
+
+def run_map_reduce(bedrock_runtime, query, text_documents, model_id, debug=False, inventory_summary=None, max_workers=None):
+    """Answer the query for every window-sized batch of the documents concurrently (map), and return
+    the prompt that merges the partial answers into one (reduce).
+
+    Partial answers that don't fit in one reduce call are merged in groups first. Raises the first
+    error when every batch fails.
+    """
+    adapter = get_model_adapter(model_id)
+    counter = get_token_counter(model_id)
+    map_tokens = min(MAP_RESPONSE_TOKENS, adapter.response_tokens)
+    start_time = time.time()
 
-AWS Infrastructure Data:
-{context}
+    # Map: every batch of the inventory is answered on its own
+    map_budget = context_token_budget(adapter, query, MAP_PROMPT, model_id)
+    prompts = []
+    for shard in shard_documents(text_documents, map_budget, model_id):
+        context = "\n\n".join(text_documents[doc_id] for doc_id in shard)
+        if len(shard) == 1 and counter.count(context) > map_budget:
+            context = truncate_context_aggressively(context, map_budget, model_id)
+        prompts.append(adapter.format_prompt(context, query, MAP_PROMPT))
+    answers, errors = invoke_concurrently(bedrock_runtime, model_id, prompts, map_tokens, max_workers, "inventory batches",
+                                          'map', query)
+    if len(errors) == len(prompts):
+        raise errors[0]
+    if errors:
+        st.warning(f"⚠️ {len(errors)} of {len(prompts)} inventory batches failed; the answer may be incomplete")
+    partials = [answer.strip() for answer in answers
+                if answer and not answer.strip().upper().startswith(NO_RELEVANT_DATA)]
+    if debug:
+        st.info(f"Map-reduce: {len(prompts)} batches of up to {map_budget:,} tokens, {len(partials)} with relevant data, "
+                f"map step took {time.time() - start_time:.1f}s")
 
-User Question: {query}
+    # Reduce: merge groups of partial answers until they fit in a single call
+    overview = f"Inventory overview:\n{inventory_summary['overview']}\n\n" if inventory_summary else ""
+    reduce_budget = context_token_budget(adapter, query, REDUCE_PROMPT, model_id) - counter.count(overview)
 
-Please provide a detailed and helpful response about the AWS infrastructure."""
-            
-            body = json.dumps({
-                "prompt": prompt,
-                "max_tokens": 2000,  # Reduced to leave more room for input
-                "temperature": 0.1
-            })
+    header = (f"Partial answers from {len(prompts)} inventory batches "
+              f"({len(prompts) - len(errors) - len(partials)} had no relevant data):")
+
+    def reduce_context(texts):
+        if not texts:
+            return overview + "No batch of the inventory had data relevant to the question."
+        return overview + "\n\n".join([header] + texts)
+
+    while len(partials) > 1 and counter.count(reduce_context(partials)) > reduce_budget:
+        groups = shard_documents(partials, reduce_budget, model_id, [counter.count(text) for text in partials])
+        if len(groups) == len(partials):
+            break  # Every partial answer fills the budget on its own; the final context is truncated instead
+        group_prompts = [adapter.format_prompt("\n\n".join(partials[i] for i in group), query, REDUCE_PROMPT) for group in groups]
+        answers, errors = invoke_concurrently(bedrock_runtime, model_id, group_prompts, map_tokens, max_workers,
+                                              "partial answer groups", 'reduce', query)
+        if len(errors) == len(group_prompts):
+            raise errors[0]
+        if errors:
+            st.warning(f"⚠️ {len(errors)} of {len(group_prompts)} partial answer groups failed; the answer may be incomplete")
+        partials = [answer.strip() for answer in answers if answer]
+
+    context = reduce_context(partials)
+    if counter.count(context) > reduce_budget + counter.count(overview):
+        context = truncate_context_aggressively(context, reduce_budget + counter.count(overview), model_id)
+    return adapter.format_prompt(context, query, REDUCE_PROMPT)
+
+def build_request_body(model_id, context, query):
+    """JSON request body for model_id, built by its registry adapter.
+
+    The context leads the prompt, so models with prompt caching can reuse it for follow-up questions.
+    """
+    adapter = get_model_adapter(model_id)
+    return json.dumps(adapter.build_cached_body(context, query))
+
+def record_prompt_cache_usage(adapter, usage):
+    """Add a response's prompt-cache reads and writes to this session's statistics"""
+    if not adapter.prompt_caching or not usage:
+        return
+    stats = st.session_state.setdefault("prompt_cache_stats", {
+        'requests': 0, 'hits': 0, 'misses': 0, 'cache_read_tokens': 0, 'cache_write_tokens': 0, 'saved_usd': 0.0
+    })
+    cache_read_tokens = usage.get('cache_read_tokens', 0)
+    cache_write_tokens = usage.get('cache_write_tokens', 0)
+    stats['requests'] += 1
+    stats['hits' if cache_read_tokens else 'misses'] += 1
+    stats['cache_read_tokens'] += cache_read_tokens
+    stats['cache_write_tokens'] += cache_write_tokens
+    stats['saved_usd'] += adapter.estimate_cache_savings(cache_read_tokens, cache_write_tokens)
+
+def parse_response_body(model_id, response_body):
+    """Extract the generated text from an invoke_model response body"""
+    return get_model_adapter(model_id).parse_response(response_body)
+
+def parse_stream_chunk(model_id, chunk):
+    """Extract the text fragment from one invoke_model_with_response_stream chunk ('' if it carries none)"""
+    return get_model_adapter(model_id).parse_stream_chunk(chunk)
+
+def report_bedrock_error(e, model_id, debug=False):
+    """Show a user-facing explanation of a Bedrock ClientError"""
+    error_code = e.response.get('Error', {}).get('Code', 'Unknown')
+    error_message = e.response.get('Error', {}).get('Message', str(e))
+    
+    if error_code == 'AccessDenied':
+        st.error(f"Access denied to Bedrock model '{model_id}'. Please check your permissions.")
+    elif error_code == 'ValidationException':
+        if "Input is too long" in error_message or "exceeds the maximum allowed length" in error_message:
+            st.error(f"🚨 **Input Too Long Error**")
+            st.error(f"The AWS infrastructure data is too large for the model '{model_id}'.")
+            st.info("**Suggestions:**")
+            st.info("1. Try enabling 'Debug Mode' in Advanced Options to see token counts")
+            st.info("2. Use a more specific question to reduce context needed")
+            st.info("3. Consider using a different model with larger context window")
+            st.info("4. Try splitting your question into smaller parts")
+            if debug:
+                st.error(f"Full error message: {error_message}")
+        else:
+            st.error(f"Invalid request to Bedrock model '{model_id}': {error_message}")
+    elif is_throttling_error(e):
+        st.error(f"⏳ Bedrock is throttling requests to model '{model_id}' and retries didn't get through.")
+        st.info("Try again in a moment, lower BEDROCK_MAX_CONCURRENCY, or request a higher quota for this model.")
+    elif error_code == 'ResourceNotFoundException':
+        st.error(f"Bedrock model '{model_id}' not found. Please check the model ID.")
+    else:
+        st.error(f"Error querying Bedrock model '{model_id}': {error_message}")
+
+def query_bedrock_model(query, text_documents, model_id, aws_access_key=None, aws_secret_key=None, aws_region=None, use_cli_creds=False, debug=False, aws_profile=None, inventory_summary=None, map_reduce=False, regions=None):
+    """Query AWS Bedrock model with the provided documents and query.
+
+    With map_reduce, an inventory larger than the model's window is answered batch by batch and
+    the partial answers are merged, instead of being cut down to the most relevant documents.
+    With regions (extra region names or inference profiles), requests are balanced across them
+    and fail over when one is throttled or unavailable.
+    """
+    start_time = time.time()
+    invoke_time = prepare_seconds = body = None
+    try:
+        bedrock_runtime = create_bedrock_runtime(aws_access_key, aws_secret_key, aws_region, use_cli_creds, aws_profile, regions)
         
-        # Invoke the model
-        response = bedrock_runtime.invoke_model(
+        adapter = get_model_adapter(model_id)
+        body = prepare_request_body(bedrock_runtime, query, text_documents, model_id, debug, inventory_summary, map_reduce)
+        if body is None:
+            return None
+        
+        # Invoke the model (queued behind other sessions' requests when the model is at its concurrency limit)
+        invoke_time = time.time()
+        prepare_seconds = invoke_time - start_time
+        response = invoke_runtime(
+            bedrock_runtime, model_id, 'invoke_model',
             body=body,
-            modelId=model_id,
             accept='application/json',
             contentType='application/json'
         )
         
         # Parse the response
         response_body = json.loads(response.get('body').read())
-        
-        # Debug information
-        if debug:
-            st.write("**Debug - Model Response:**")
-            st.json(response_body)
+        usage = response_usage(adapter, response, response_body)
+        record_prompt_cache_usage(adapter, usage)
         
         try:
-            if "anthropic.claude" in model_id or "inference-profile" in model_id or model_id.startswith("us."):
-                result = response_body['content'][0]['text']
-            elif "amazon.titan" in model_id:
-                result = response_body['results'][0]['outputText']
-            elif "ai21.j2" in model_id:
-                result = response_body['completions'][0]['data']['text']
-            elif "cohere.command" in model_id:
-                result = response_body['generations'][0]['text']
-            else:
-                # Try to extract text from common response formats
-                if 'completion' in response_body:
-                    result = response_body['completion']
-                elif 'text' in response_body:
-                    result = response_body['text']
-                elif 'generated_text' in response_body:
-                    result = response_body['generated_text']
-                else:
-                    result = str(response_body)
+            answer = parse_response_body(model_id, response_body)
         except (KeyError, IndexError, TypeError) as e:
+            record_bedrock_call(model_id, 'query', invoke_time, body, usage=usage, query=query,
+                                prepare_seconds=prepare_seconds, error=f"Unparseable response: {e}")
             st.error(f"Error parsing response from model '{model_id}': {str(e)}")
             st.error(f"Response structure: {json.dumps(response_body, indent=2)}")
             return None
+        metrics = record_bedrock_call(model_id, 'query', invoke_time, body, answer, usage, query, prepare_seconds)
+        
+        # Debug information
+        if debug:
+            st.write("**Debug - Model Response:**")
+            st.json(response_body)
+            if usage and usage.get('cache_read_tokens'):
+                st.info(f"Prompt cache hit: {usage['cache_read_tokens']:,} context tokens read from cache")
+            st.info(f"Cost: ${metrics['cost_usd']:.4f} ({metrics['input_tokens']:,} input / {metrics['output_tokens']:,} "
+                    f"output tokens, {metrics['token_source']}) · context {prepare_seconds:.1f}s, "
+                    f"model {metrics['latency_seconds']:.1f}s")
         
-        return result
+        return answer
         
     except ClientError as e:
-        error_code = e.response.get('Error', {}).get('Code', 'Unknown')
-        error_message = e.response.get('Error', {}).get('Message', str(e))
-        
-        if error_code == 'AccessDenied':
-            st.error(f"Access denied to Bedrock model '{model_id}'. Please check your permissions.")
-        elif error_code == 'ValidationException':
-            if "Input is too long" in error_message or "exceeds the maximum allowed length" in error_message:
-                st.error(f"🚨 **Input Too Long Error**")
-                st.error(f"The AWS infrastructure data is too large for the model '{model_id}'.")
-                st.info("**Suggestions:**")
-                st.info("1. Try enabling 'Debug Mode' in Advanced Options to see token counts")
-                st.info("2. Use a more specific question to reduce context needed")
-                st.info("3. Consider using a different model with larger context window")
-                st.info("4. Try splitting your question into smaller parts")
-                if debug:
-                    st.error(f"Full error message: {error_message}")
-            else:
-                st.error(f"Invalid request to Bedrock model '{model_id}': {error_message}")
-        elif error_code == 'ResourceNotFoundException':
-            st.error(f"Bedrock model '{model_id}' not found. Please check the model ID.")
-        else:
-            st.error(f"Error querying Bedrock model '{model_id}': {error_message}")
+        if invoke_time:
+            record_bedrock_call(model_id, 'query', invoke_time, body, query=query, prepare_seconds=prepare_seconds,
+                                error=e.response.get('Error', {}).get('Code', str(e)))
+        report_bedrock_error(e, model_id, debug)
         return None
     except Exception as e:
+        if invoke_time:
+            record_bedrock_call(model_id, 'query', invoke_time, body, query=query, prepare_seconds=prepare_seconds, error=str(e))
         st.error(f"Unexpected error during Bedrock query with model '{model_id}': {str(e)}")
         return None
 
+def stream_bedrock_model(query, text_documents, model_id, aws_access_key=None, aws_secret_key=None, aws_region=None, use_cli_creds=False, debug=False, aws_profile=None, inventory_summary=None, map_reduce=False, regions=None):
+    """Same as query_bedrock_model, but yields the answer in text fragments as the model generates it"""
+    start_time = time.time()
+    invoke_time = prepare_seconds = body = None
+    try:
+        bedrock_runtime = create_bedrock_runtime(aws_access_key, aws_secret_key, aws_region, use_cli_creds, aws_profile, regions)
+        
+        adapter = get_model_adapter(model_id)
+        body = prepare_request_body(bedrock_runtime, query, text_documents, model_id, debug, inventory_summary, map_reduce)
+        if body is None:
+            return
+        invoke_time = time.time()
+        prepare_seconds = invoke_time - start_time
+        
+        if not adapter.supports_streaming:
+            response = invoke_runtime(
+                bedrock_runtime, model_id, 'invoke_model',
+                body=body,
+                accept='application/json',
+                contentType='application/json'
+            )
+            response_body = json.loads(response.get('body').read())
+            usage = response_usage(adapter, response, response_body)
+            record_prompt_cache_usage(adapter, usage)
+            answer = parse_response_body(model_id, response_body)
+            record_bedrock_call(model_id, 'stream', invoke_time, body, answer, usage, query, prepare_seconds)
+            yield answer
+            return
+        
+        body = json.dumps(adapter.build_stream_body(json.loads(body)))
+        response = invoke_runtime(
+            bedrock_runtime, model_id, 'invoke_model_with_response_stream',
+            body=body,
+            accept='application/json',
+            contentType='application/json'
+        )
+        usage = {}
+        answer_parts = []
+        first_token_seconds = None
+        for event in response.get('body'):
+            chunk = event.get('chunk')
+            if not chunk:
+                continue
+            chunk_data = json.loads(chunk['bytes'])
+            usage.update(adapter.parse_stream_usage(chunk_data) or {})
+            # Bedrock appends token counts for every model family to the last chunk
+            invocation_metrics = chunk_data.get('amazon-bedrock-invocationMetrics')
+            if invocation_metrics:
+                usage.setdefault('input_tokens', invocation_metrics.get('inputTokenCount', 0))
+                usage.setdefault('output_tokens', invocation_metrics.get('outputTokenCount', 0))
+            text = parse_stream_chunk(model_id, chunk_data)
+            if text:
+                if first_token_seconds is None:
+                    first_token_seconds = time.time() - invoke_time
+                answer_parts.append(text)
+                yield text
+        record_prompt_cache_usage(adapter, usage)
+        record_bedrock_call(model_id, 'stream', invoke_time, body, ''.join(answer_parts), usage, query,
+                            prepare_seconds, first_token_seconds)
+        
+    except ClientError as e:
+        if invoke_time:
+            record_bedrock_call(model_id, 'stream', invoke_time, body, query=query, prepare_seconds=prepare_seconds,
+                                error=e.response.get('Error', {}).get('Code', str(e)))
+        report_bedrock_error(e, model_id, debug)
+    except Exception as e:
+        if invoke_time:
+            record_bedrock_call(model_id, 'stream', invoke_time, body, query=query, prepare_seconds=prepare_seconds, error=str(e))
+        st.error(f"Unexpected error during Bedrock query with model '{model_id}': {str(e)}")
+
 def test_bedrock_connection(model_id, aws_access_key=None, aws_secret_key=None, aws_region=None, use_cli_creds=False, aws_profile=None):
     """Test Bedrock connection with a simple query"""
     try:
@@ -258,23 +520,8 @@ def test_bedrock_connection(model_id, aws_access_key=None, aws_secret_key=None,
                 region_name=aws_region
             )
         
-        # Simple test query - use Claude format for most models and inference profiles
-        if "anthropic.claude" in model_id or "inference-profile" in model_id or model_id.startswith("us."):
-            body = json.dumps({
-                "anthropic_version": "bedrock-2023-05-31",
-                "max_tokens": 20,
-                "messages": [{"role": "user", "content": "Hello, just say 'Test successful'"}]
-            })
-        elif "amazon.titan" in model_id:
-            body = json.dumps({
-                "inputText": "Hello, just say 'Test successful'",
-                "textGenerationConfig": {"maxTokenCount": 20}
-            })
-        else:
-            body = json.dumps({
-                "prompt": "Hello, just say 'Test successful'",
-                "max_tokens": 20
-            })
+        # Simple test query in the model's own request format
+        body = json.dumps(get_model_adapter(model_id).build_body("Hello, just say 'Test successful'", max_tokens=20))
         
         # Test the model
         response = bedrock_runtime.invoke_model(
@@ -290,120 +537,88 @@ def test_bedrock_connection(model_id, aws_access_key=None, aws_secret_key=None,
     except Exception as e:
         return False, str(e)
 
-def create_minimal_context(text_documents, query):
-    """Create an extremely minimal context focusing only on query-relevant information"""
-    # Keywords from the query to focus on
-    query_keywords = [word.lower() for word in query.split() if len(word) > 3]
+def create_minimal_context(text_documents, query, max_lines=10):
+    """Create an extremely minimal context: the lines across all documents that best match the query"""
+    lines = [line.strip() for doc in text_documents for line in doc.split('\n') if line.strip()]
+    if not lines:
+        return ""
     
-    minimal_info = []
+    ranked = [line_id for line_id, score in rank_documents(lines, query) if score > 0][:max_lines]
+    if ranked:
+        # Keep the document order, which keeps related lines together
+        return '\n'.join(lines[line_id] for line_id in sorted(ranked))
     
-    for doc in text_documents[:3]:  # Only first 3 documents
-        lines = doc.split('\n')
-        relevant_lines = []
-        
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-                
-            # Only include lines that contain query keywords
-            if any(keyword in line.lower() for keyword in query_keywords):
-                relevant_lines.append(line)
-                
-            # Stop if we have enough relevant lines
-            if len(relevant_lines) >= 5:
-                break
-        
-        if relevant_lines:
-            minimal_info.extend(relevant_lines[:5])
-        
-        # Limit total information
-        if len(minimal_info) >= 10:
-            break
-    
-    if minimal_info:
-        return '\n'.join(minimal_info[:10])
-    else:
-        # If no keyword matches, return first few lines of each document
-        fallback_info = []
-        for doc in text_documents[:2]:
-            lines = doc.split('\n')[:3]
-            fallback_info.extend([line.strip() for line in lines if line.strip()])
-        return '\n'.join(fallback_info[:8])
-
-def truncate_context_aggressively(context, max_tokens):
+    # If no keyword matches, return first few lines of each document
+    fallback_info = []
+    for doc in text_documents[:2]:
+        doc_lines = doc.split('\n')[:3]
+        fallback_info.extend([line.strip() for line in doc_lines if line.strip()])
+    return '\n'.join(fallback_info[:8])
+
+def truncate_context_aggressively(context, max_tokens, model_id=None):
     """Aggressively truncate context to fit within token limits"""
-    max_chars = max_tokens * 4  # Convert tokens to characters
-    
-    if len(context) <= max_chars:
+    counter = get_token_counter(model_id)
+    if counter.count(context) <= max_tokens:
         return context
     
+    notice = "\n\n[... AWS infrastructure data truncated due to length limits. Please ask more specific questions for detailed information ...]"
     # Take the first portion and add a clear truncation message
-    truncated = context[:max_chars - 200]
+    truncated = counter.truncate(context, max_tokens - counter.count(notice))
     
     # Try to cut at a reasonable point (end of line)
     last_newline = truncated.rfind('\n')
-    if last_newline > max_chars * 0.8:  # If we can cut at a line break without losing too much
+    if last_newline > len(truncated) * 0.8:  # If we can cut at a line break without losing too much
         truncated = truncated[:last_newline]
     
-    return truncated + "\n\n[... AWS infrastructure data truncated due to length limits. Please ask more specific questions for detailed information ...]"
+    return truncated + notice
 
-def create_aws_summary(text_documents):
-    """Create a concise summary of AWS infrastructure data"""
-    summary_parts = []
-    
-    for doc in text_documents[:5]:  # Process fewer documents for better summarization
-        lines = doc.split('\n')
-        
-        # Extract key information from each document
-        key_info = []
-        
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-                
-            # Focus on the most important information
-            if any(keyword in line.lower() for keyword in ['instances', 'security', 'vpc', 'subnet', 'volume', 'bucket', 'function', 'table', 'cluster', 'database']):
-                key_info.append(line)
-        
-        if key_info:
-            summary_parts.append('\n'.join(key_info[:3]))  # Top 3 items per service
-    
-    return '\n\n'.join(summary_parts[:3])  # Top 3 services
+def estimate_tokens(text, model_id=None):
+    """Token count for the model's family (tokenizer-based when available, otherwise a fast approximation)"""
+    return get_token_counter(model_id).count(text)
 
-def estimate_tokens(text):
-    """Rough estimation of token count (1 token ≈ 4 characters for most models)"""
-    return len(text) // 4
+def prepare_optimal_context(text_documents, query, max_tokens=8000, model_id=None, reserved_tokens=None, inventory_summary=None):
+    """Prepare context that fits within token limits.
 
-def prepare_optimal_context(text_documents, query, max_tokens=8000):
-    """Prepare context that fits within token limits"""
-    # Reserve tokens for query, prompt structure, and response
-    reserved_tokens = estimate_tokens(query) + 1500  # Increased buffer for prompt structure
+    When the inventory doesn't fit, the most detailed level of inventory_summary (see
+    modules.inventory_summary) that fits leads the context, followed by the most relevant documents.
+    """
+    counter = get_token_counter(model_id)
+    # Reserve tokens for query and prompt structure
+    if reserved_tokens is None:
+        reserved_tokens = counter.count(query) + 1500
     available_tokens = max_tokens - reserved_tokens
-    available_chars = available_tokens * 4  # Convert back to characters
     
     # Try different strategies
     if available_tokens <= 500:  # Need minimum space for context
         return "Error: Query too long for available context"
     
-    # Strategy 1: Use summary if we have a lot of documents
-    if len(text_documents) > 3:
-        summary = create_aws_summary(text_documents)
-        if len(summary) <= available_chars:
-            return summary
+    # Strategy 0: Large-context models get the whole inventory in one call
+    document_tokens = get_token_counts(text_documents, model_id)
+    separator_tokens = counter.count("\n\n")
+    if text_documents and sum(document_tokens) + separator_tokens * (len(text_documents) - 1) <= available_tokens:
+        return "\n\n".join(text_documents)
     
-    # Strategy 2: Use first few documents
-    context = ""
-    for i, doc in enumerate(text_documents[:5]):  # Reduced from 10 to 5
-        potential_context = context + "\n\n" + doc if context else doc
-        if len(potential_context) <= available_chars:
-            context = potential_context
-        else:
-            break
+    # Strategy 1: Precomputed rollups keep counts and distributions right for the whole inventory
+    summary_text = ""
+    if inventory_summary:
+        for level in summary_levels(inventory_summary):
+            if counter.count(level) <= available_tokens * SUMMARY_BUDGET_SHARE:
+                summary_text = level
+                break
+        if summary_text:
+            summary_text += "\n\nMost relevant resources:"
+            available_tokens -= counter.count(summary_text) + separator_tokens
+    
+    # Strategy 2: Pack the documents most relevant to the query into the remaining budget
+    packed = pack_documents(text_documents, query, available_tokens, model_id)
+    # Inventory order rather than rank order, so questions that select the same documents share a cacheable prefix
+    context = "\n\n".join(text_documents[doc_id] for doc_id in sorted(packed['selected']))
+    if summary_text:
+        context = f"{summary_text}\n\n{context}" if context else summary_text
     
-    # Strategy 3: Truncate if still too long
-    if len(context) > available_chars:
-        context = context[:available_chars - 200] + "\n\n[... content truncated due to length limits ...]"
+    # Strategy 3: Truncate the most relevant document if not even one fits
+    if not context and text_documents:
+        top_doc_id = rank_documents(text_documents, query)[0][0]
+        context = truncate_context_aggressively(text_documents[top_doc_id], available_tokens, model_id)
     
-    return context if context else "No AWS data available"
\ No newline at end of file
+    return context if context else "No AWS data available"
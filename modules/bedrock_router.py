@@ -0,0 +1,159 @@
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from botocore.exceptions import ClientError, ConnectTimeoutError, EndpointConnectionError, ReadTimeoutError
+
+from modules.bedrock_invoker import bedrock_invoker, THROTTLING_ERROR_CODES
+
+
+REGION_PATTERN = re.compile(r'^[a-z]{2}(-gov)?-[a-z]+-\d+$')
+
+# Errors that say this region is busy or unhealthy right now; the request is tried in another region
+FAILOVER_ERROR_CODES = THROTTLING_ERROR_CODES + (
+    'InternalServerException', 'ModelTimeoutException', 'ServiceQuotaExceededException'
+)
+# Errors that say the model can't be used in this region (not enabled, no access)
+UNAVAILABLE_ERROR_CODES = ('AccessDeniedException', 'ResourceNotFoundException')
+
+COOLDOWN_SECONDS = 5.0              # First cooldown after a failure, doubled on consecutive failures
+MAX_COOLDOWN_SECONDS = 60.0
+UNAVAILABLE_COOLDOWN_SECONDS = 300.0
+LATENCY_SMOOTHING = 0.3             # Weight of the newest latency sample in the moving average
+
+
+class RegionTarget:
+    """One place a model can be invoked: a region, with the model ID or an inference profile"""
+
+    def __init__(self, region: str, model_id: str):
+        self.region = region
+        self.model_id = model_id
+        self.key = f"{region}/{model_id}"
+        self.latency: Optional[float] = None
+        self.failures = 0
+        self.cooldown_until = 0.0
+
+
+class RegionBalancer:
+    """Measured latency and health of every target, shared by all sessions in the process"""
+
+    def __init__(self):
+        self._targets: Dict[str, RegionTarget] = {}
+        self._lock = threading.Lock()
+
+    def target(self, region: str, model_id: str) -> RegionTarget:
+        key = f"{region}/{model_id}"
+        with self._lock:
+            if key not in self._targets:
+                self._targets[key] = RegionTarget(region, model_id)
+            return self._targets[key]
+
+    def rank(self, targets: List[RegionTarget]) -> List[RegionTarget]:
+        """Targets in the order to try them.
+
+        Healthy targets come first, by smoothed latency scaled by how full their concurrency limit
+        is (unmeasured targets first, so each gets a latency sample); targets cooling down after
+        failures follow, soonest-available first.
+        """
+        now = time.monotonic()
+        with self._lock:
+            def expected_latency(target):
+                if target.latency is None:
+                    return 0.0
+                load = bedrock_invoker.limiter(target.key).stats
+                return target.latency * (load['in_flight'] + load['waiting'] + 1) / load['limit']
+
+            healthy = sorted([t for t in targets if t.cooldown_until <= now], key=expected_latency)
+            cooling = sorted([t for t in targets if t.cooldown_until > now], key=lambda t: t.cooldown_until)
+        return healthy + cooling
+
+    def record_success(self, target: RegionTarget, seconds: float):
+        with self._lock:
+            if target.latency is None:
+                target.latency = seconds
+            else:
+                target.latency += LATENCY_SMOOTHING * (seconds - target.latency)
+            target.failures = 0
+            target.cooldown_until = 0.0
+
+    def record_failure(self, target: RegionTarget, cooldown: Optional[float] = None):
+        with self._lock:
+            target.failures += 1
+            if cooldown is None:
+                cooldown = min(MAX_COOLDOWN_SECONDS, COOLDOWN_SECONDS * 2 ** (target.failures - 1))
+            target.cooldown_until = time.monotonic() + cooldown
+
+    @property
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                key: {
+                    'latency': target.latency,
+                    'failures': target.failures,
+                    'cooldown_seconds': max(0.0, target.cooldown_until - now)
+                }
+                for key, target in self._targets.items()
+            }
+
+
+# Global instance shared by every session in the process
+region_balancer = RegionBalancer()
+
+
+class RoutedBedrockRuntime:
+    """Stands in for a bedrock-runtime client and spreads each call over several regions or
+    inference profiles, failing over to the next target on throttling and regional errors."""
+
+    def __init__(self, targets: List[str], client_factory: Callable[[str], Any], default_region: str):
+        self.targets = targets
+        self.client_factory = client_factory
+        self.default_region = default_region
+
+    def resolve(self, model_id: str) -> List[RegionTarget]:
+        """Targets for model_id: region names use the model itself, profile IDs and ARNs are used as given"""
+        resolved: Dict[str, RegionTarget] = {}
+        for entry in self.targets:
+            if REGION_PATTERN.match(entry):
+                target = region_balancer.target(entry, model_id)
+            elif entry.startswith('arn:'):
+                target = region_balancer.target(entry.split(':')[3], entry)
+            else:
+                target = region_balancer.target(self.default_region, entry)
+            resolved[target.key] = target
+        return list(resolved.values())
+
+    def invoke(self, model_id: str, operation: str, **kwargs) -> Dict[str, Any]:
+        """Run a runtime operation (e.g. 'invoke_model') on the best target, failing over until one succeeds"""
+        ranked = region_balancer.rank(self.resolve(model_id))
+        last_error: Optional[Exception] = None
+        for position, target in enumerate(ranked):
+            client = self.client_factory(target.region)
+            start_time = time.monotonic()
+            try:
+                response = bedrock_invoker.invoke(
+                    target.key,
+                    lambda: getattr(client, operation)(modelId=target.model_id, **kwargs),
+                    # Fail over right away while other targets remain, rather than waiting out backoffs
+                    throttle_retries=None if position == len(ranked) - 1 else 0,
+                    stream=operation == 'invoke_model_with_response_stream'
+                )
+            except ClientError as e:
+                error_code = e.response.get('Error', {}).get('Code')
+                status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+                if error_code in UNAVAILABLE_ERROR_CODES:
+                    region_balancer.record_failure(target, UNAVAILABLE_COOLDOWN_SECONDS)
+                elif error_code in FAILOVER_ERROR_CODES or status >= 500:
+                    region_balancer.record_failure(target)
+                else:
+                    raise
+                last_error = e
+                continue
+            except (EndpointConnectionError, ConnectTimeoutError, ReadTimeoutError) as e:
+                region_balancer.record_failure(target)
+                last_error = e
+                continue
+            region_balancer.record_success(target, time.monotonic() - start_time - bedrock_invoker.last_queue_wait())
+            return response
+        raise last_error
@@ -0,0 +1,176 @@
+import json
+import re
+from collections import Counter, OrderedDict
+from typing import Dict, List, Any, Optional
+
+from modules.resource_chunker import KEY_FIELDS, RESOURCE_ID_FIELDS, iter_resources
+
+
+ROWS_PER_DOCUMENT = 25  # Table rows per document, so context packing can still pick parts of large types
+MAX_FLATTEN_DEPTH = 2   # Deeper structures become compact JSON cells
+
+_ACCOUNT_ID_PATTERN = re.compile(r'(?<!\d)\d{12}(?!\d)')
+
+
+def _compact_json(value: Any) -> str:
+    return json.dumps(value, separators=(',', ':'), default=str)
+
+
+def _is_empty(value: Any) -> bool:
+    return value is None or value == '' or value == [] or value == {}
+
+
+def flatten_resource(resource: Any, prefix: str = '', depth: int = 0,
+                     out: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Flatten a resource into dotted-key scalar cells, dropping null and empty fields"""
+    if out is None:
+        out = OrderedDict()
+    if _is_empty(resource):
+        return out
+    if isinstance(resource, dict):
+        if depth >= MAX_FLATTEN_DEPTH and prefix:
+            out[prefix] = _compact_json(resource)
+            return out
+        for key, value in resource.items():
+            flatten_resource(value, f"{prefix}.{key}" if prefix else str(key), depth + 1, out)
+    elif isinstance(resource, list):
+        items = [item for item in resource if not _is_empty(item)]
+        if all(isinstance(item, (str, int, float, bool)) for item in items):
+            out[prefix or 'value'] = ';'.join(str(item) for item in items)
+        elif all(isinstance(item, dict) and set(item) == {'Key', 'Value'} for item in items):
+            # Tags become one column per tag key
+            for item in items:
+                out[f"{prefix}.{item['Key']}"] = item['Value']
+        else:
+            out[prefix or 'value'] = _compact_json(items)
+    else:
+        out[prefix or 'value'] = resource
+    return out
+
+
+def _column_order(columns: List[str]) -> List[str]:
+    """Identifier first, then key fields, then everything else in first-seen order"""
+    id_column = next((field for field in RESOURCE_ID_FIELDS if field in columns), None)
+
+    def rank(column):
+        if column == id_column:
+            return (0, 0)
+        root = column.split('.', 1)[0]
+        if root in KEY_FIELDS:
+            return (1, KEY_FIELDS.index(root))
+        return (2, 0)
+    return sorted(columns, key=rank)  # Stable, so first-seen order holds within a rank
+
+
+def _cell(value: Any) -> str:
+    text = value if isinstance(value, str) else _compact_json(value) if isinstance(value, (dict, list)) else str(value)
+    return text.replace('\n', ' ').replace('|', '\\|')
+
+
+def render_table(title: str, resources: List[Any], rows_per_document: int = ROWS_PER_DOCUMENT) -> List[str]:
+    """Render resources of one type as header + rows tables.
+
+    Columns that hold the same value in every row are stated once above the table, and
+    12-digit account IDs that repeat are replaced by short aliases.
+    """
+    rows = [flatten_resource(resource) for resource in resources]
+    rows = [row for row in rows if row]
+    if not rows:
+        return [f"{title}: none"]
+
+    columns: List[str] = list(OrderedDict.fromkeys(column for row in rows for column in row))
+    shared = OrderedDict()
+    if len(rows) > 1:
+        for column in columns:
+            values = [row.get(column) for row in rows]
+            if all(value == values[0] for value in values) and values[0] is not None:
+                shared[column] = values[0]
+    columns = _column_order([column for column in columns if column not in shared])
+
+    # Alias account IDs that repeat across cells (ARNs, OwnerId, ...)
+    account_counts = Counter(
+        match for row in rows for value in row.values() if isinstance(value, str)
+        for match in _ACCOUNT_ID_PATTERN.findall(value)
+    )
+    aliases = {account: f"<acct{i + 1}>" for i, (account, count) in enumerate(account_counts.most_common()) if count > 1}
+
+    def dedupe(text: str) -> str:
+        if aliases:
+            text = _ACCOUNT_ID_PATTERN.sub(lambda match: aliases.get(match.group(0), match.group(0)), text)
+        return text
+
+    preamble = []
+    if aliases:
+        preamble.append("Accounts: " + ", ".join(f"{alias}={account}" for account, alias in aliases.items()))
+    if shared:
+        preamble.append("Same for all rows: " + "; ".join(f"{column}={dedupe(_cell(value))}" for column, value in shared.items()))
+    header = '|'.join(columns)
+    rendered_rows = ['|'.join(dedupe(_cell(row[column])) if column in row else '' for column in columns) for row in rows]
+
+    documents = []
+    for start in range(0, len(rendered_rows), rows_per_document):
+        part = rendered_rows[start:start + rows_per_document]
+        label = f"{title} ({len(rendered_rows)} rows)" if len(rendered_rows) <= rows_per_document else \
+            f"{title} (rows {start + 1}-{start + len(part)} of {len(rendered_rows)})"
+        documents.append('\n'.join([label] + preamble + [header] + part))
+    return documents
+
+
+def _group_resources(aws_data: Dict) -> "OrderedDict[tuple, List[Any]]":
+    groups: "OrderedDict[tuple, List[Any]]" = OrderedDict()
+    for record in iter_resources(aws_data):
+        groups.setdefault((record['service'], record['resource_type']), []).append(record['resource'])
+    return groups
+
+
+def render_aws_data(aws_data: Dict, rows_per_document: int = ROWS_PER_DOCUMENT) -> List[str]:
+    """Compact LLM documents: one table (split every rows_per_document rows) per resource type"""
+    documents = []
+    for (service, resource_type), resources in _group_resources(aws_data).items():
+        documents.extend(render_table(f"AWS {service} {resource_type}", resources, rows_per_document))
+    for service, service_data in aws_data.items():
+        if isinstance(service_data, dict) and 'error' in service_data:
+            documents.append(f"AWS {service} collection error: {service_data['error']}")
+    return documents
+
+
+def render_resource(resource: Any) -> str:
+    """One resource as 'key: value' lines, with null and empty fields dropped"""
+    return '\n'.join(f"{key}: {_cell(value)}" for key, value in flatten_resource(resource).items())
+
+
+def measure_token_savings(aws_data: Dict, model_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Tokens per resource type as indented JSON versus compact tables"""
+    from modules.token_counter import get_token_counter
+    counter = get_token_counter(model_id)
+    results = []
+    for (service, resource_type), resources in _group_resources(aws_data).items():
+        json_tokens = counter.count(json.dumps(resources, indent=2, default=str))
+        table_tokens = sum(counter.count(doc) for doc in render_table(f"AWS {service} {resource_type}", resources))
+        results.append({
+            'resource_type': f"{service} {resource_type}",
+            'resources': len(resources),
+            'json_tokens': json_tokens,
+            'table_tokens': table_tokens,
+            'ratio': json_tokens / table_tokens if table_tokens else 0.0
+        })
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Measure token savings of compact table rendering")
+    parser.add_argument('inventory', help="Collected AWS data (JSON)")
+    parser.add_argument('--model', default=None, help="Bedrock model ID whose token counter to use")
+    args = parser.parse_args()
+
+    with open(args.inventory) as f:
+        inventory = json.load(f)
+    rows = measure_token_savings(inventory, args.model)
+    for row in rows:
+        print(f"   {row['resource_type']:<40} {row['resources']:>6} resources  "
+              f"{row['json_tokens']:>9,} -> {row['table_tokens']:>8,} tokens  ({row['ratio']:.1f}x)")
+    total_json = sum(row['json_tokens'] for row in rows)
+    total_table = sum(row['table_tokens'] for row in rows)
+    if total_table:
+        print(f"   {'total':<40} {'':>16}  {total_json:>9,} -> {total_table:>8,} tokens  ({total_json / total_table:.1f}x)")
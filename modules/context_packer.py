@@ -0,0 +1,116 @@
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Tuple
+
+from langchain.docstore.document import Document
+
+from modules.answer_cache import compute_inventory_version
+from modules.hybrid_retriever import BM25Index, find_resource_ids
+from modules.token_counter import get_token_counter
+
+
+SEPARATOR = "\n\n"
+
+# BM25 index and per-counter token counts of recently packed inventories, keyed by inventory version
+_inventories: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_MAX_CACHED_INVENTORIES = 4
+
+
+def _document_text(doc: Any) -> str:
+    return doc['text'] if isinstance(doc, dict) else str(doc)
+
+
+def _document_group(doc: Any, text: str) -> str:
+    """Service a document belongs to, used to spread unscored documents across services"""
+    if isinstance(doc, dict):
+        return doc.get('metadata', {}).get('service', '')
+    return text.split(None, 1)[0] if text.strip() else ''
+
+
+def _get_inventory(documents: List[Any]) -> Dict[str, Any]:
+    version = compute_inventory_version(documents)
+    inventory = _inventories.get(version)
+    if inventory is None:
+        inventory = {
+            'index': BM25Index([Document(page_content=_document_text(doc)) for doc in documents]),
+            'token_counts': {}
+        }
+        _inventories[version] = inventory
+        while len(_inventories) > _MAX_CACHED_INVENTORIES:
+            _inventories.popitem(last=False)
+    else:
+        _inventories.move_to_end(version)
+    return inventory
+
+
+def get_lexical_index(documents: List[Any]) -> BM25Index:
+    """BM25 index over the documents, reused while the inventory is unchanged"""
+    return _get_inventory(documents)['index']
+
+
+def get_token_counts(documents: List[Any], model_id: Optional[str] = None) -> List[int]:
+    """Token count of every document for the model's counter, reused while the inventory is unchanged"""
+    counter = get_token_counter(model_id)
+    token_counts = _get_inventory(documents)['token_counts']
+    key = (counter.mode, counter.scale)
+    if key not in token_counts:
+        token_counts[key] = [counter.count(_document_text(doc)) for doc in documents]
+    return token_counts[key]
+
+
+def rank_documents(documents: List[Any], query: str) -> List[Tuple[int, float]]:
+    """All document indexes ordered by relevance to the query; exact resource-ID matches come first"""
+    index = get_lexical_index(documents)
+    scores: Dict[int, float] = dict(index.search(query, k=len(documents)))
+
+    resource_ids = find_resource_ids(query)
+    if resource_ids:
+        top = max(scores.values(), default=0.0) + 1.0
+        for doc_id in list(scores):
+            if any(index.contains(doc_id, rid) for rid in resource_ids):
+                scores[doc_id] += top
+
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+    # Documents with no query terms follow, interleaved across services so coverage stays broad
+    by_group: "OrderedDict[str, List[int]]" = OrderedDict()
+    for doc_id, doc in enumerate(documents):
+        if doc_id not in scores:
+            by_group.setdefault(_document_group(doc, _document_text(doc)), []).append(doc_id)
+    groups = list(by_group.values())
+    for position in range(max((len(group) for group in groups), default=0)):
+        for group in groups:
+            if position < len(group):
+                ranked.append((group[position], 0.0))
+    return ranked
+
+
+def pack_documents(documents: List[Any], query: str, max_tokens: int,
+                   model_id: Optional[str] = None) -> Dict[str, Any]:
+    """Greedily pick the highest-ranked documents that fit in max_tokens.
+
+    Returns the selected indexes (in rank order) with token usage; documents that don't fit are
+    skipped so smaller relevant ones can still fill the remaining budget.
+    """
+    separator_tokens = get_token_counter(model_id).count(SEPARATOR)
+    token_counts = get_token_counts(documents, model_id) if documents else []
+    selected: List[int] = []
+    used_tokens = 0
+    ranked = rank_documents(documents, query) if documents else []
+    for doc_id, _ in ranked:
+        needed = token_counts[doc_id] + (separator_tokens if selected else 0)
+        if used_tokens + needed <= max_tokens:
+            selected.append(doc_id)
+            used_tokens += needed
+    return {
+        'selected': selected,
+        'used_tokens': used_tokens,
+        'matched': sum(1 for _, score in ranked if score > 0),
+        'total': len(documents)
+    }
+
+
+def pack_context(documents: List[Any], query: str, max_tokens: int, model_id: Optional[str] = None) -> str:
+    """Most relevant documents for the query joined into a context of at most max_tokens"""
+    texts = [_document_text(doc) for doc in documents]
+    packed = pack_documents(documents, query, max_tokens, model_id)
+    return SEPARATOR.join(texts[doc_id] for doc_id in packed['selected'])
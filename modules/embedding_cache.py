@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+
+# Cached vectors live here, one folder per embedding model
+EMBEDDING_CACHE_DIR = os.environ.get(
+    "EMBEDDING_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".embedding_cache")
+)
+
+
+def hash_text(text: str) -> str:
+    """Content address of a chunk of text"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """On-disk store of embedding vectors keyed by chunk text hash for a single model.
+
+    Vectors are appended to a flat float32 file (``vectors.f32``) and their text hashes, one per line in the
+    same order, to ``hashes.txt``, so a write costs only the size of the batch. ``index.json`` holds the dimension.
+    """
+
+    def __init__(self, model_name: str, cache_dir: str = EMBEDDING_CACHE_DIR):
+        self.model_name = model_name
+        self.cache_dir = os.path.join(cache_dir, re.sub(r'[^A-Za-z0-9_.-]', '_', model_name))
+        self.vectors_path = os.path.join(self.cache_dir, 'vectors.f32')
+        self.hashes_path = os.path.join(self.cache_dir, 'hashes.txt')
+        self.index_path = os.path.join(self.cache_dir, 'index.json')
+        self.dim = None
+        self.rows: Dict[str, int] = {}
+        # Grown by doubling, so appends don't copy every cached vector; rows past len(self.rows) are unused
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+            self.dim = index['dim']
+            if os.path.exists(self.hashes_path):
+                with open(self.hashes_path) as f:
+                    hashes = f.read().split()
+            else:
+                # Caches written before hashes.txt kept every row in index.json
+                hashes = sorted(index.get('rows', {}), key=index.get('rows', {}).get)
+            vector_rows = os.path.getsize(self.vectors_path) // (4 * self.dim) if os.path.exists(self.vectors_path) else 0
+            # A write interrupted between the two files leaves one longer than the other; drop the unmatched rows
+            count = min(len(hashes), vector_rows)
+            if os.path.exists(self.vectors_path) and os.path.getsize(self.vectors_path) != count * 4 * self.dim:
+                os.truncate(self.vectors_path, count * 4 * self.dim)
+            if len(hashes) != count or not os.path.exists(self.hashes_path):
+                self._write_hashes(hashes[:count])
+            if 'rows' in index:
+                self._write_index()
+            self._vectors = np.fromfile(self.vectors_path, dtype=np.float32).reshape(-1, self.dim) if count \
+                else np.zeros((0, self.dim), dtype=np.float32)
+            self.rows = {h: row for row, h in enumerate(hashes[:count])}
+        except (OSError, ValueError, KeyError):
+            self.dim, self.rows = None, {}
+            self._vectors = np.zeros((0, 0), dtype=np.float32)
+
+    def _write_index(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'model': self.model_name, 'dim': self.dim}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _write_hashes(self, hashes: List[str]):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self.hashes_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(''.join(f"{h}\n" for h in hashes))
+        os.replace(tmp_path, self.hashes_path)
+
+    def get_many(self, text_hashes: List[str]) -> Dict[str, np.ndarray]:
+        """Return the cached vectors for whichever hashes are present"""
+        with self._lock:
+            return {h: self._vectors[self.rows[h]] for h in text_hashes if h in self.rows}
+
+    def put_many(self, items: Dict[str, List[float]]):
+        """Append new vectors and their hashes"""
+        if not items:
+            return
+        with self._lock:
+            new_hashes = [h for h in items if h not in self.rows]
+            if not new_hashes:
+                return
+            new_vectors = np.asarray([items[h] for h in new_hashes], dtype=np.float32)
+            if self.dim is None:
+                self.dim = new_vectors.shape[1]
+                self._vectors = np.zeros((0, self.dim), dtype=np.float32)
+                self._write_index()
+            elif new_vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension changed for model '{self.model_name}': "
+                                 f"{new_vectors.shape[1]} != {self.dim}")
+
+            os.makedirs(self.cache_dir, exist_ok=True)
+            start_row = len(self.rows)
+            with open(self.vectors_path, 'ab') as f:
+                f.write(new_vectors.tobytes())
+            with open(self.hashes_path, 'a') as f:
+                f.write(''.join(f"{h}\n" for h in new_hashes))
+
+            if start_row + len(new_hashes) > len(self._vectors):
+                grown = np.zeros((max(2 * len(self._vectors), start_row + len(new_hashes)), self.dim), dtype=np.float32)
+                grown[:start_row] = self._vectors[:start_row]
+                self._vectors = grown
+            self._vectors[start_row:start_row + len(new_hashes)] = new_vectors
+            for offset, h in enumerate(new_hashes):
+                self.rows[h] = start_row + offset
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends chunks it has never seen to the underlying model"""
+
+    def __init__(self, embeddings: Embeddings, model_name: str, cache_dir: str = EMBEDDING_CACHE_DIR,
+                 cache_key: Optional[str] = None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        # cache_key separates vectors of the same model that differ in format (e.g. normalisation)
+        self.cache = EmbeddingCache(cache_key or model_name, cache_dir)
+        self.stats = {'hits': 0, 'misses': 0, 'embed_seconds': 0.0}
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        text_hashes = [hash_text(text) for text in texts]
+        cached = self.cache.get_many(text_hashes)
+
+        # Embed each unseen chunk once, even if it occurs several times in this batch
+        missing = {}
+        for text, h in zip(texts, text_hashes):
+            if h not in cached and h not in missing:
+                missing[h] = text
+
+        if missing:
+            start = time.perf_counter()
+            new_vectors = self.embeddings.embed_documents(list(missing.values()))
+            self.stats['embed_seconds'] += time.perf_counter() - start
+            fresh = dict(zip(missing.keys(), new_vectors))
+            self.cache.put_many(fresh)
+            cached.update({h: np.asarray(v, dtype=np.float32) for h, v in fresh.items()})
+
+        self.stats['hits'] += len(texts) - len(missing)
+        self.stats['misses'] += len(missing)
+        return [cached[h].tolist() for h in text_hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit rate and estimated embedding time saved by the cache"""
+        hits, misses = self.stats['hits'], self.stats['misses']
+        total = hits + misses
+        seconds_per_chunk = self.stats['embed_seconds'] / misses if misses else 0.0
+        return {
+            'model': self.model_name,
+            'cached_vectors': len(self.cache),
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else 0.0,
+            'embed_seconds': self.stats['embed_seconds'],
+            'estimated_seconds_saved': hits * seconds_per_chunk
+        }
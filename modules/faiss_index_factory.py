@@ -0,0 +1,106 @@
+import math
+import os
+from typing import Optional
+
+import faiss
+import numpy as np
+
+
+# Corpora up to this many vectors use an exact flat index
+FLAT_INDEX_MAX_VECTORS = int(os.environ.get("FAISS_FLAT_MAX_VECTORS", "50000"))
+# 'auto' (IVF above the threshold), 'ivf', 'hnsw' or 'flat'
+DEFAULT_INDEX_TYPE = os.environ.get("FAISS_INDEX_TYPE", "auto")
+# 'none', 'sq8' (scalar, 4x smaller) or 'pq' (product, ~16-32x smaller)
+DEFAULT_QUANTIZATION = os.environ.get("FAISS_QUANTIZATION", "sq8")
+
+MIN_TRAINING_POINTS_PER_LIST = 39  # FAISS warns below this many training points per IVF list or PQ centroid
+PQ_CENTROIDS = 256  # 8-bit codes per sub-quantizer
+
+
+def _pq_subquantizers(dim: int) -> int:
+    """Largest sub-quantizer count that divides the dimension and keeps >= 4 dims per sub-vector"""
+    for m in (64, 48, 32, 24, 16, 12, 8, 4, 2):
+        if dim % m == 0 and dim // m >= 4:
+            return m
+    return 1
+
+
+def choose_index_spec(n_vectors: int, dim: int, index_type: str = DEFAULT_INDEX_TYPE,
+                      quantization: str = DEFAULT_QUANTIZATION,
+                      flat_max_vectors: int = FLAT_INDEX_MAX_VECTORS) -> str:
+    """Pick a FAISS index_factory string for a corpus of this size"""
+    if index_type == 'flat' or (index_type == 'auto' and n_vectors <= flat_max_vectors):
+        return 'Flat'
+
+    if index_type == 'hnsw':
+        return 'HNSW32_SQ8' if quantization == 'sq8' else 'HNSW32'
+
+    # IVF: ~4*sqrt(N) lists, capped so every list gets enough training points
+    nlist = int(4 * math.sqrt(max(n_vectors, 1)))
+    nlist = min(nlist, 65536, n_vectors // MIN_TRAINING_POINTS_PER_LIST)
+    # Too few vectors to train the coarse quantizer or the PQ codebooks: use an index that needs no clustering
+    if nlist < 2:
+        return 'Flat' if quantization == 'none' else 'SQ8'
+    if quantization == 'pq':
+        if n_vectors < PQ_CENTROIDS * MIN_TRAINING_POINTS_PER_LIST:
+            return f'IVF{nlist},SQ8'
+        return f'IVF{nlist},PQ{_pq_subquantizers(dim)}'
+    if quantization == 'sq8':
+        return f'IVF{nlist},SQ8'
+    return f'IVF{nlist},Flat'
+
+
+def build_faiss_index(vectors: np.ndarray, spec: str):
+    """Create, train and fill an index; IVF probes and HNSW search depth are set for ~95% recall"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    index = faiss.index_factory(vectors.shape[1], spec, faiss.METRIC_L2)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    configure_search(index)
+    return index
+
+
+def configure_search(index):
+    """Apply search-time parameters, which are not stored in the index file"""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = max(1, min(ivf.nlist, ivf.nlist // 16 or 1, 256))
+    if hasattr(index, 'hnsw'):
+        index.hnsw.efSearch = 64
+
+
+def is_flat_index(index) -> bool:
+    return isinstance(index, faiss.IndexFlat)
+
+
+def is_ivf_index(index) -> bool:
+    return faiss.try_extract_index_ivf(index) is not None
+
+
+def write_index(index, path: str):
+    """Write atomically, so a memory-mapped copy of the old file stays valid"""
+    tmp_path = path + '.tmp'
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def read_index(path: str, mmap: bool = True):
+    """Load an index, memory-mapping its data when the index type supports it"""
+    if mmap:
+        try:
+            index = faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            configure_search(index)
+            return index, True
+        except RuntimeError:
+            pass
+    index = faiss.read_index(path)
+    configure_search(index)
+    return index, False
+
+
+def describe_index(index) -> Optional[str]:
+    """Short human-readable description, e.g. 'IndexIVFScalarQuantizer (1,234,567 vectors)'"""
+    if index is None:
+        return None
+    return f"{type(index).__name__} ({index.ntotal:,} vectors)"
@@ -0,0 +1,67 @@
+import zlib
+from typing import Dict, List, Tuple
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from modules.hybrid_retriever import tokenize
+
+
+# Model name used to select the in-process backend instead of an Ollama embed model
+HASHING_EMBED_MODEL = 'local-hashing'
+
+
+class HashingEmbeddings(Embeddings):
+    """In-process embeddings from signed feature hashing of terms and term bigrams.
+
+    Vectors use sublinear term frequency and are L2-normalised, so they need no model
+    server and no fitted vocabulary; corpus-level IDF weighting is left to the BM25 side
+    of the hybrid retriever.
+    """
+
+    def __init__(self, n_features: int = 1024, use_bigrams: bool = True):
+        self.n_features = n_features
+        self.use_bigrams = use_bigrams
+        self._feature_cache: Dict[str, Tuple[int, float]] = {}
+
+    def _feature(self, term: str) -> Tuple[int, float]:
+        feature = self._feature_cache.get(term)
+        if feature is None:
+            h = zlib.crc32(term.encode('utf-8'))
+            # Low bits pick the column, the top bit picks the sign to cancel collisions on average
+            feature = (h % self.n_features, 1.0 if h & 0x80000000 else -1.0)
+            if len(self._feature_cache) < 1_000_000:
+                self._feature_cache[term] = feature
+        return feature
+
+    def _terms(self, text: str) -> List[str]:
+        terms = tokenize(text)
+        if self.use_bigrams:
+            terms += [f"{a} {b}" for a, b in zip(terms, terms[1:])]
+        return terms
+
+    def embed_array(self, texts: List[str]) -> np.ndarray:
+        """Embed a batch of texts into a (len(texts), n_features) float32 matrix"""
+        rows, cols, signs = [], [], []
+        for row, text in enumerate(texts):
+            for term in self._terms(text):
+                col, sign = self._feature(term)
+                rows.append(row)
+                cols.append(col)
+                signs.append(sign)
+
+        flat_index = np.asarray(rows, dtype=np.int64) * self.n_features + np.asarray(cols, dtype=np.int64)
+        matrix = np.bincount(flat_index, weights=np.asarray(signs, dtype=np.float32),
+                             minlength=len(texts) * self.n_features)
+        matrix = matrix.reshape(len(texts), self.n_features).astype(np.float32)
+        # Sublinear term frequency keeps long resource documents from dominating
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_array([text])[0].tolist()
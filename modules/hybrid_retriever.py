@@ -0,0 +1,153 @@
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Any, Tuple
+
+from langchain.callbacks.manager import CallbackManagerForRetrieverRun
+from langchain.docstore.document import Document
+from langchain.schema import BaseRetriever
+
+
+# Compound tokens keep AWS identifiers (sg-0abc123, arn:aws:iam::123456789012:role/x, 10.0.0.0/16) intact,
+# including the empty fields (::) of ARNs
+_TOKEN_PATTERN = re.compile(r'[a-z0-9]+(?:[-_.:/]+[a-z0-9]+)*')
+_PART_PATTERN = re.compile(r'[a-z0-9]+')
+# Resource IDs such as i-0abc..., sg-..., vpc-..., subnet-..., and ARNs
+_RESOURCE_ID_PATTERN = re.compile(r'^(?:[a-z]+-[0-9a-f]{6,}|arn:aws[a-z-]*:.+)$')
+_STOPWORDS = {
+    'a', 'all', 'an', 'and', 'are', 'can', 'do', 'does', 'for', 'have', 'i', 'in', 'is', 'it', 'me', 'my',
+    'of', 'on', 'our', 'please', 'show', 'list', 'the', 'there', 'to', 'used', 'we', 'what', 'which', 'with'
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase terms; compound identifiers are kept whole and also split into their parts"""
+    terms = []
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        terms.append(token)
+        parts = _PART_PATTERN.findall(token)
+        if len(parts) > 1:
+            terms.extend(parts)
+    return terms
+
+
+def keyword_terms(query: str) -> List[str]:
+    """Whole query tokens that carry meaning (stopwords dropped)"""
+    return [token for token in _TOKEN_PATTERN.findall(query.lower()) if token not in _STOPWORDS]
+
+
+def find_resource_ids(query: str) -> List[str]:
+    """Exact resource identifiers mentioned in a query"""
+    return [token for token in _TOKEN_PATTERN.findall(query.lower()) if _RESOURCE_ID_PATTERN.match(token)]
+
+
+class BM25Index:
+    """Inverted index with Okapi BM25 scoring over a fixed list of documents"""
+
+    def __init__(self, documents: List[Document], k1: float = 1.5, b: float = 0.75):
+        self.documents = documents
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self.doc_lengths: List[int] = []
+
+        for doc_id, doc in enumerate(documents):
+            terms = tokenize(doc.page_content)
+            self.doc_lengths.append(len(terms))
+            for term, count in Counter(terms).items():
+                self.postings[term][doc_id] = count
+
+        self.avg_doc_length = sum(self.doc_lengths) / len(self.doc_lengths) if self.doc_lengths else 0.0
+        doc_count = len(documents)
+        self.idf = {
+            term: math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def search(self, query: str, k: int = 4) -> List[Tuple[int, float]]:
+        """Return (document index, score) pairs for the best matching documents"""
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf[term]
+            for doc_id, tf in postings.items():
+                length_norm = 1 - self.b + self.b * self.doc_lengths[doc_id] / (self.avg_doc_length or 1)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + self.k1 * length_norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def contains(self, doc_id: int, term: str) -> bool:
+        return doc_id in self.postings.get(term, {})
+
+    def __len__(self):
+        return len(self.documents)
+
+
+def _normalize(scores: Dict[Any, float]) -> Dict[Any, float]:
+    if not scores:
+        return {}
+    low, high = min(scores.values()), max(scores.values())
+    if high == low:
+        return {key: 1.0 for key in scores}
+    return {key: (score - low) / (high - low) for key, score in scores.items()}
+
+
+class HybridRetriever(BaseRetriever):
+    """Fuses BM25 and FAISS scores.
+
+    Queries naming exact resource IDs, or whose keywords all appear in the top lexical hit,
+    are served by the BM25 index alone and skip the query embedding round-trip.
+    """
+
+    vectorstore: Any
+    lexical_index: BM25Index
+    k: int = 4
+    vector_weight: float = 0.5  # Share of the fused score that comes from the vector search
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        lexical_hits = self.lexical_index.search(query, self.k * 2)
+
+        # Exact-ID lookups don't need the embedding round-trip
+        resource_ids = find_resource_ids(query)
+        if resource_ids:
+            id_hits = [(doc_id, score) for doc_id, score in lexical_hits
+                       if any(self.lexical_index.contains(doc_id, rid) for rid in resource_ids)]
+            if id_hits:
+                return [self.lexical_index.documents[doc_id] for doc_id, _ in id_hits[:self.k]]
+
+        terms = keyword_terms(query)
+        if terms and lexical_hits and all(self.lexical_index.contains(lexical_hits[0][0], term) for term in terms):
+            return [self.lexical_index.documents[doc_id] for doc_id, _ in lexical_hits[:self.k]]
+
+        documents: Dict[str, Document] = {}
+        lexical_scores: Dict[str, float] = {}
+        for doc_id, score in lexical_hits:
+            doc = self.lexical_index.documents[doc_id]
+            documents[doc.page_content] = doc
+            lexical_scores[doc.page_content] = score
+
+        vector_scores: Dict[str, float] = {}
+        if self.vectorstore is not None:
+            for doc, distance in self.vectorstore.similarity_search_with_score(query, k=self.k * 2):
+                documents.setdefault(doc.page_content, doc)
+                vector_scores[doc.page_content] = 1.0 / (1.0 + float(distance))
+
+        lexical_scores = _normalize(lexical_scores)
+        vector_scores = _normalize(vector_scores)
+        fused = {
+            key: self.vector_weight * vector_scores.get(key, 0.0) + (1 - self.vector_weight) * lexical_scores.get(key, 0.0)
+            for key in documents
+        }
+        ranked = sorted(fused, key=fused.get, reverse=True)
+        return [documents[key] for key in ranked[:self.k]]
+
+
+def get_vectorstore_documents(vectorstore) -> List[Document]:
+    """Documents held by a langchain FAISS vectorstore, in index order"""
+    if vectorstore is None:
+        return []
+    return [vectorstore.docstore.search(doc_id) for _, doc_id in sorted(vectorstore.index_to_docstore_id.items())]
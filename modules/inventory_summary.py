@@ -0,0 +1,130 @@
+from collections import Counter, OrderedDict
+from typing import Dict, List, Any
+
+from modules.answer_cache import compute_inventory_version
+
+
+# Metadata fields rolled up per resource type (from resource_chunker.KEY_FIELDS)
+STATE_FIELDS = ['State', 'Status', 'StackStatus', 'DBInstanceStatus']
+TYPE_FIELDS = ['InstanceType', 'DBInstanceClass', 'Engine', 'Runtime', 'VolumeType', 'Type', 'Scheme']
+MAX_ROLLUP_VALUES = 10  # Values listed per rollup before the rest are folded into "other"
+
+_summaries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_MAX_CACHED_SUMMARIES = 4
+
+
+def _format_counts(counts: Counter) -> str:
+    items = counts.most_common(MAX_ROLLUP_VALUES)
+    text = ", ".join(f"{value} {count}" for value, count in items)
+    other = sum(counts.values()) - sum(count for _, count in items)
+    if other:
+        text += f", other {other}"
+    return text
+
+
+def _resource_vpc(metadata: Dict[str, Any]) -> Any:
+    if metadata.get('VpcId'):
+        return metadata['VpcId']
+    # VPC resources are their own VPC
+    if str(metadata.get('name', '')).startswith('vpc-'):
+        return metadata['name']
+    return None
+
+
+def build_inventory_summary(chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Roll resource chunks (from chunk_aws_data) up into per-type, per-VPC and account-level summaries"""
+    type_rollups: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+    vpc_rollups: "OrderedDict[str, Dict[str, Counter]]" = OrderedDict()
+    services, regions, errors = Counter(), Counter(), []
+
+    for chunk in chunks:
+        metadata = chunk.get('metadata', {})
+        if metadata.get('resource_type') == 'error':
+            errors.append(chunk['text'])
+            continue
+        type_key = f"{metadata.get('service')} {metadata.get('resource_type')}"
+        rollup = type_rollups.setdefault(type_key, {'count': 0, 'state': Counter(), 'type': Counter(),
+                                                    'vpc': Counter(), 'region': Counter()})
+        rollup['count'] += 1
+        services[metadata.get('service')] += 1
+        state = next((metadata[f] for f in STATE_FIELDS if metadata.get(f) not in (None, '')), None)
+        kind = next((metadata[f] for f in TYPE_FIELDS if metadata.get(f) not in (None, '')), None)
+        vpc = _resource_vpc(metadata)
+        for name, value in (('state', state), ('type', kind), ('vpc', vpc), ('region', metadata.get('region'))):
+            if value is not None:
+                rollup[name][str(value)] += 1
+        if metadata.get('region'):
+            regions[metadata['region']] += 1
+
+        if vpc:
+            vpc_rollup = vpc_rollups.setdefault(vpc, {})
+            vpc_rollup.setdefault(type_key, Counter())[str(state) if state is not None else ''] += 1
+
+    resource_types = OrderedDict()
+    for type_key, rollup in type_rollups.items():
+        count = rollup['count']
+        parts = [f"{type_key}: {count}"]
+        for name, label in (('state', 'by state'), ('type', 'by type'), ('vpc', 'by VPC'), ('region', 'by region')):
+            if rollup[name]:
+                parts.append(f"{label}: {_format_counts(rollup[name])}")
+        resource_types[type_key] = {
+            'count': count,
+            'by_state': dict(rollup['state']),
+            'by_type': dict(rollup['type']),
+            'by_vpc': dict(rollup['vpc']),
+            'by_region': dict(rollup['region']),
+            'text': " | ".join(parts)
+        }
+
+    vpcs = OrderedDict()
+    for vpc, type_counts in vpc_rollups.items():
+        parts = []
+        for type_key, states in type_counts.items():
+            total = sum(states.values())
+            state_text = _format_counts(Counter({s: c for s, c in states.items() if s}))
+            parts.append(f"{total} {type_key}" + (f" ({state_text})" if state_text else ""))
+        vpcs[vpc] = {
+            'resource_counts': {type_key: sum(states.values()) for type_key, states in type_counts.items()},
+            'text': f"VPC {vpc}: " + "; ".join(parts)
+        }
+
+    total = sum(services.values())
+    overview = [f"Account overview: {total} resources across {len(services)} services"]
+    if regions:
+        overview.append(f"Regions: {_format_counts(regions)}")
+    overview.append("Resources per service: " + _format_counts(services))
+    overview.extend(errors)
+
+    return {
+        'version': compute_inventory_version(chunks),
+        'overview': "\n".join(overview),
+        'resource_types': resource_types,
+        'vpcs': vpcs
+    }
+
+
+def get_inventory_summary(chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Summary of an inventory snapshot, built once per snapshot version"""
+    version = compute_inventory_version(chunks)
+    summary = _summaries.get(version)
+    if summary is None:
+        summary = build_inventory_summary(chunks)
+        _summaries[version] = summary
+        while len(_summaries) > _MAX_CACHED_SUMMARIES:
+            _summaries.popitem(last=False)
+    else:
+        _summaries.move_to_end(version)
+    return summary
+
+
+def summary_levels(summary: Dict[str, Any]) -> List[str]:
+    """Summary texts from most to least detailed: overview + types + VPCs, overview + types, overview"""
+    types_text = "Resource types:\n" + "\n".join(entry['text'] for entry in summary['resource_types'].values())
+    vpcs_text = "VPCs:\n" + "\n".join(entry['text'] for entry in summary['vpcs'].values())
+    levels = []
+    if summary['vpcs']:
+        levels.append("\n\n".join([summary['overview'], types_text, vpcs_text]))
+    if summary['resource_types']:
+        levels.append("\n\n".join([summary['overview'], types_text]))
+    levels.append(summary['overview'])
+    return levels
@@ -0,0 +1,141 @@
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from langchain.embeddings.base import Embeddings
+
+
+OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434")
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_MAX_WORKERS = min(8, os.cpu_count() or 1)
+# Identifies the vectors this class returns in embedding cache keys; vectors cached before they were
+# L2-normalised (langchain's OllamaEmbeddings, /api/embeddings) have a different scale and are not reused
+EMBEDDING_FORMAT = 'l2'
+
+
+def l2_normalize(vectors: List[List[float]]) -> List[List[float]]:
+    array = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(array, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (array / norms).tolist()
+
+
+class BatchedOllamaEmbeddings(Embeddings):
+    """Ollama embeddings that send batched requests to /api/embed over pooled keep-alive connections.
+
+    Batches are dispatched concurrently, so index builds are bounded by the Ollama server's
+    parallelism (OLLAMA_NUM_PARALLEL) rather than by one HTTP round-trip per chunk. /api/embed returns
+    unit-length vectors and the legacy /api/embeddings does not, so both are L2-normalised here.
+    """
+
+    def __init__(self, model: str = 'nomic-embed-text', base_url: str = OLLAMA_BASE_URL,
+                 batch_size: int = DEFAULT_BATCH_SIZE, max_workers: int = DEFAULT_MAX_WORKERS,
+                 timeout: float = 120, embed_instruction: str = 'passage: ', query_instruction: str = 'query: '):
+        self.model = model
+        self.base_url = base_url.rstrip('/')
+        self.batch_size = max(1, batch_size)
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+        # Same prefixes as langchain's OllamaEmbeddings
+        self.embed_instruction = embed_instruction
+        self.query_instruction = query_instruction
+        self._use_legacy_endpoint = False
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        if not self._use_legacy_endpoint:
+            response = self.session.post(
+                f"{self.base_url}/api/embed",
+                json={'model': self.model, 'input': texts},
+                timeout=self.timeout
+            )
+            if response.status_code != 404:
+                response.raise_for_status()
+                return l2_normalize(response.json()['embeddings'])
+            # Ollama releases before 0.3 only have the single-prompt endpoint
+            self._use_legacy_endpoint = True
+
+        embeddings = []
+        for text in texts:
+            response = self.session.post(
+                f"{self.base_url}/api/embeddings",
+                json={'model': self.model, 'prompt': text},
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            embeddings.append(response.json()['embedding'])
+        return l2_normalize(embeddings)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        texts = [f"{self.embed_instruction}{text}" for text in texts]
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) <= 1 or self.max_workers == 1:
+            results = [self._embed_batch(batch) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as executor:
+                results = list(executor.map(self._embed_batch, batches))
+        return [vector for batch in results for vector in batch]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_batch([f"{self.query_instruction}{text}"])[0]
+
+
+def benchmark_embeddings(texts: List[str], model: str = 'nomic-embed-text', base_url: str = OLLAMA_BASE_URL,
+                         batch_sizes: Optional[List[int]] = None,
+                         worker_counts: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+    """Measure embedding throughput for each batch size / concurrency combination"""
+    results = []
+    for batch_size in batch_sizes or [1, 16, DEFAULT_BATCH_SIZE]:
+        for max_workers in worker_counts or [1, DEFAULT_MAX_WORKERS]:
+            embeddings = BatchedOllamaEmbeddings(model=model, base_url=base_url,
+                                                 batch_size=batch_size, max_workers=max_workers)
+            embeddings.embed_query("warm up")  # Load the model before timing
+            start = time.perf_counter()
+            embeddings.embed_documents(texts)
+            elapsed = time.perf_counter() - start
+            results.append({
+                'batch_size': batch_size,
+                'max_workers': max_workers,
+                'texts': len(texts),
+                'seconds': elapsed,
+                'texts_per_second': len(texts) / elapsed if elapsed else 0.0
+            })
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark Ollama embedding throughput")
+    parser.add_argument('--model', default='nomic-embed-text')
+    parser.add_argument('--base-url', default=OLLAMA_BASE_URL)
+    parser.add_argument('--texts', type=int, default=512, help="Number of synthetic chunks to embed")
+    parser.add_argument('--inventory', help="Collected AWS data (JSON) to embed instead of synthetic chunks")
+    parser.add_argument('--batch-sizes', default='1,16,64')
+    parser.add_argument('--workers', default=f"1,{DEFAULT_MAX_WORKERS}")
+    args = parser.parse_args()
+
+    if args.inventory:
+        import json
+        from modules.resource_chunker import chunk_aws_data
+        with open(args.inventory) as f:
+            sample_texts = [chunk['text'] for chunk in chunk_aws_data(json.load(f))]
+    else:
+        sample_texts = [
+            f"EC2 instances i-{i:017x} | region: us-east-1 | State: running, InstanceType: t3.micro, VpcId: vpc-{i % 7:08x}"
+            for i in range(args.texts)
+        ]
+
+    print(f"Embedding {len(sample_texts)} chunks with '{args.model}'")
+    for row in benchmark_embeddings(sample_texts, args.model, args.base_url,
+                                    [int(b) for b in args.batch_sizes.split(',')],
+                                    [int(w) for w in args.workers.split(',')]):
+        print(f"   batch={row['batch_size']:>4} workers={row['max_workers']:>2}  "
+              f"{row['seconds']:7.2f}s  {row['texts_per_second']:8.1f} texts/s")
@@ -0,0 +1,133 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Any, Optional
+
+
+# Per-call LLM metrics are kept in this SQLite file
+QUERY_METRICS_DB = os.environ.get(
+    "QUERY_METRICS_DB",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".query_metrics.db")
+)
+MAX_STORED_QUERY_CHARS = 200
+
+_COLUMNS = [
+    ('timestamp', 'REAL NOT NULL'),
+    ('provider', 'TEXT NOT NULL'),
+    ('model_id', 'TEXT NOT NULL'),
+    ('operation', 'TEXT NOT NULL'),          # query, stream, map, reduce, batch
+    ('query', 'TEXT'),
+    ('prepare_seconds', 'REAL'),             # Context preparation / retrieval before the model call
+    ('first_token_seconds', 'REAL'),         # Streaming calls only
+    ('latency_seconds', 'REAL'),
+    ('input_tokens', 'INTEGER'),
+    ('output_tokens', 'INTEGER'),
+    ('cache_read_tokens', 'INTEGER'),
+    ('cache_write_tokens', 'INTEGER'),
+    ('token_source', 'TEXT'),                # reported (by the provider) or estimated
+    ('cost_usd', 'REAL'),
+    ('success', 'INTEGER NOT NULL'),
+    ('error', 'TEXT'),
+]
+COLUMN_NAMES = [name for name, _ in _COLUMNS]
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Linearly interpolated percentile (0-100) of values, or None when there are none"""
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    position = (len(values) - 1) * pct / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class QueryMetricsStore:
+    """SQLite store of latency, token and cost metrics for every LLM call"""
+
+    def __init__(self, path: str = QUERY_METRICS_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.row_factory = sqlite3.Row
+            columns = ", ".join(f"{name} {definition}" for name, definition in _COLUMNS)
+            self._connection.execute(f"CREATE TABLE IF NOT EXISTS llm_calls (id INTEGER PRIMARY KEY, {columns})")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS llm_calls_timestamp ON llm_calls (timestamp)")
+        return self._connection
+
+    def record(self, provider: str, model_id: str, operation: str, **metrics):
+        """Store one call; unknown metrics are ignored and a failed write never breaks the query"""
+        row = {name: metrics.get(name) for name in COLUMN_NAMES}
+        row.update(timestamp=metrics.get('timestamp') or time.time(), provider=provider, model_id=model_id,
+                   operation=operation, success=int(metrics.get('success', True)))
+        if row['query']:
+            row['query'] = row['query'][:MAX_STORED_QUERY_CHARS]
+        try:
+            with self._lock:
+                connection = self._connect()
+                connection.execute(
+                    f"INSERT INTO llm_calls ({', '.join(COLUMN_NAMES)}) VALUES ({', '.join('?' for _ in COLUMN_NAMES)})",
+                    [row[name] for name in COLUMN_NAMES]
+                )
+                connection.commit()
+        except sqlite3.Error:
+            pass
+
+    def calls(self, since: Optional[float] = None, provider: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Stored calls, newest first, optionally since a Unix timestamp and for one provider"""
+        conditions, parameters = [], []
+        if since is not None:
+            conditions.append("timestamp >= ?")
+            parameters.append(since)
+        if provider:
+            conditions.append("provider = ?")
+            parameters.append(provider)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            rows = self._connect().execute(
+                f"SELECT * FROM llm_calls {where} ORDER BY timestamp DESC", parameters
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def summary(self, since: Optional[float] = None, provider: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Per provider, model and operation: call and error counts, latency percentiles, tokens and cost"""
+        groups: Dict[tuple, List[Dict[str, Any]]] = {}
+        for call in self.calls(since, provider):
+            groups.setdefault((call['provider'], call['model_id'], call['operation']), []).append(call)
+
+        summaries = []
+        for (provider_name, model_id, operation), calls in groups.items():
+            latencies = [call['latency_seconds'] for call in calls if call['success']]
+            first_tokens = [call['first_token_seconds'] for call in calls if call['success']]
+            summaries.append({
+                'provider': provider_name,
+                'model_id': model_id,
+                'operation': operation,
+                'calls': len(calls),
+                'errors': sum(1 for call in calls if not call['success']),
+                'latency_p50': percentile(latencies, 50),
+                'latency_p90': percentile(latencies, 90),
+                'latency_p99': percentile(latencies, 99),
+                'first_token_p50': percentile(first_tokens, 50),
+                'first_token_p90': percentile(first_tokens, 90),
+                'input_tokens': sum(call['input_tokens'] or 0 for call in calls),
+                'output_tokens': sum(call['output_tokens'] or 0 for call in calls),
+                'cost_usd': sum(call['cost_usd'] or 0.0 for call in calls)
+            })
+        return sorted(summaries, key=lambda summary: summary['calls'], reverse=True)
+
+    def clear(self):
+        with self._lock:
+            connection = self._connect()
+            connection.execute("DELETE FROM llm_calls")
+            connection.commit()
+
+
+# Global instance
+query_metrics = QueryMetricsStore()
@@ -0,0 +1,275 @@
+import re
+from collections import Counter
+from typing import Dict, List, Any, Optional, Tuple
+
+from modules.complex_query_processor import complex_query_processor
+from modules.resource_chunker import KEY_FIELDS, get_resource_id, iter_resources
+
+
+FAST_PATH_MIN_CONFIDENCE = 0.8  # Below this the question goes to the LLM
+UNKNOWN_WORD_PENALTY = 0.25     # Confidence lost per word the router could not account for
+MAX_DISPLAY_ROWS = 200
+MAX_EXTRA_COLUMNS = 5
+
+# Phrase -> (service, resource types); longest phrases are matched first
+RESOURCE_ALIASES = {
+    'ec2 instance': ('EC2', ['instances']),
+    'instance': ('EC2', ['instances']),
+    'server': ('EC2', ['instances']),
+    'vm': ('EC2', ['instances']),
+    'ec2': ('EC2', ['instances']),
+    'security group': ('EC2', ['security_groups']),
+    'volume': ('EC2', ['volumes']),
+    'ebs volume': ('EC2', ['volumes']),
+    'vpc': ('EC2', ['vpcs']),
+    'subnet': ('EC2', ['subnets']),
+    'route table': ('EC2', ['route_tables']),
+    'network acl': ('EC2', ['network_acls']),
+    'availability zone': ('EC2', ['availability_zones']),
+    's3 bucket': ('S3', ['buckets']),
+    'bucket': ('S3', ['buckets']),
+    'lambda function': ('Lambda', ['functions']),
+    'lambda': ('Lambda', ['functions']),
+    'function': ('Lambda', ['functions']),
+    'iam user': ('IAM', ['users']),
+    'user': ('IAM', ['users']),
+    'iam role': ('IAM', ['roles']),
+    'role': ('IAM', ['roles']),
+    'policy': ('IAM', ['policies']),
+    'policies': ('IAM', ['policies']),
+    'iam group': ('IAM', ['groups']),
+    'instance profile': ('IAM', ['instance_profiles']),
+    'rds instance': ('RDS', ['instances', 'db_instances']),
+    'database': ('RDS', ['instances', 'db_instances']),
+    'database instance': ('RDS', ['instances', 'db_instances']),
+    'db instance': ('RDS', ['instances', 'db_instances']),
+    'db cluster': ('RDS', ['db_clusters']),
+    'load balancer': ('ELB', ['load_balancers']),
+    'target group': ('ELB', ['target_groups']),
+    'eks cluster': ('EKS', ['clusters']),
+    'ecs cluster': ('ECS', ['clusters']),
+    'hosted zone': ('Route53', ['hosted_zones']),
+    'stack': ('CloudFormation', ['stacks']),
+    'cloudformation stack': ('CloudFormation', ['stacks']),
+    'dynamodb table': ('DynamoDB', ['tables']),
+    'table': ('DynamoDB', ['tables']),
+    'alarm': ('CloudWatch', ['alarms']),
+    'log group': ('CloudWatch', ['log_groups']),
+    'api': ('API Gateway', ['apis']),
+    'codebuild project': ('CodeBuild', ['projects']),
+    'pipeline': ('CodePipeline', ['pipelines']),
+}
+
+# State words and the status values they match: every word of a value must be a whole word of the status
+# (split on '_' and spaces, case-insensitive), so 'active' matches ACTIVE but not inactive
+STATE_FILTERS = {
+    'running': ['running'],
+    'stopped': ['stopped'],
+    'stopping': ['stopping'],
+    'pending': ['pending'],
+    'terminated': ['terminated'],
+    'available': ['available'],
+    'active': ['active'],
+    'inactive': ['inactive'],
+    'failed': ['failed'],
+    'deleted': ['deleted'],
+    'attached': ['in-use'],
+    'unattached': ['available'],
+    'in alarm': ['alarm'],
+    'alarming': ['alarm'],
+    'rolled back': ['rollback_complete'],
+}
+STATUS_FIELDS = ['State', 'Status', 'StackStatus', 'DBInstanceStatus', 'StateValue', 'status']
+
+COUNT_PHRASES = ['how many', 'number of', 'count', 'total']
+LIST_WORDS = {
+    'list', 'show', 'display', 'get', 'give', 'find', 'what', 'which', 'enumerate', 'all', 'my', 'me', 'are',
+    'is', 'there', 'do', 'does', 'i', 'we', 'have', 'the', 'of', 'in', 'a', 'an', 'any', 'currently', 'now',
+    'that', 'aws', 'account', 'with', 'exist', 'existing', 'please', 'and', 'their', 'names', 'ids'
+}
+# Questions that ask for judgement or prose always go to the LLM
+NARRATIVE_PATTERN = re.compile(
+    r'\b(why|explain|recommend\w*|should|suggest\w*|improve|optimi[sz]\w*|risk\w*|best practice\w*|summar\w*|'
+    r'analy[sz]\w*|describe|compare|difference|wrong|issue\w*|problem\w*|help|plan|how (can|do|should|to)|'
+    r'secure|safe|concern\w*|insight\w*|advice|review)\b'
+)
+INSTANCE_TYPE_PATTERN = re.compile(r'\b((?:db|cache)\.)?[a-z]\d[a-z0-9-]*\.\d*[a-z]+\b')
+
+
+def _status(resource: Any) -> Optional[str]:
+    if not isinstance(resource, dict):
+        return None
+    for field in STATUS_FIELDS:
+        value = resource.get(field)
+        if isinstance(value, dict):
+            value = value.get('Name', value.get('Code'))
+        if isinstance(value, str):
+            return value
+    return None
+
+
+def _status_words(status: str) -> set:
+    return set(re.split(r'[\s_]+', status.lower())) - {''}
+
+
+def _name_tag(resource: Any) -> Optional[str]:
+    if isinstance(resource, dict):
+        for tag in resource.get('Tags') or []:
+            if isinstance(tag, dict) and tag.get('Key') == 'Name':
+                return tag.get('Value')
+    return None
+
+
+def _cell(value: Any) -> str:
+    if isinstance(value, dict):
+        value = value.get('Name', value.get('Code', ''))
+    return str(value).replace('|', '\\|').replace('\n', ' ')
+
+
+class QueryRouter:
+    """Answers list, count and filter questions straight from the collected data when it is confident
+    the data fully answers them, and sends everything else to the LLM"""
+
+    def __init__(self, min_confidence: float = FAST_PATH_MIN_CONFIDENCE):
+        self.min_confidence = min_confidence
+        self._aliases = sorted(RESOURCE_ALIASES, key=len, reverse=True)
+        self._states = sorted(STATE_FILTERS, key=len, reverse=True)
+
+    def parse(self, query: str) -> Dict[str, Any]:
+        """Intent, resource, filters and confidence of a list/count question"""
+        # Keep dots inside words (t3.micro), drop sentence punctuation
+        text = ' ' + re.sub(r'[^\w\s.-]|\.(?=\s|$)', ' ', query.lower()) + ' '
+        parsed = {'intent': 'list', 'resource': None, 'states': [], 'instance_type': None,
+                  'unknown_words': [], 'narrative': bool(NARRATIVE_PATTERN.search(query.lower()))}
+
+        for phrase in COUNT_PHRASES:
+            if f' {phrase} ' in text:
+                parsed['intent'] = 'count'
+                text = text.replace(f' {phrase} ', ' ')
+
+        match = INSTANCE_TYPE_PATTERN.search(text)
+        if match:
+            parsed['instance_type'] = match.group(0)
+            text = text.replace(match.group(0), ' ')
+
+        for state in self._states:
+            if re.search(rf' {state} ', text):
+                parsed['states'].append(state)
+                text = re.sub(rf' {state} ', ' ', text)
+
+        for alias in self._aliases:
+            # Plurals: instances, policies, ...
+            found = re.search(rf' {alias}(s|es)? ', text)
+            if found:
+                parsed['resource'] = alias
+                text = text.replace(found.group(0), ' ')
+                break
+
+        parsed['unknown_words'] = [word for word in text.split() if word not in LIST_WORDS]
+        confidence = 0.0
+        if parsed['resource'] and not parsed['narrative']:
+            confidence = max(0.0, 1.0 - UNKNOWN_WORD_PENALTY * len(parsed['unknown_words']))
+        parsed['confidence'] = confidence
+        return parsed
+
+    def _matches(self, resource: Any, parsed: Dict[str, Any]) -> bool:
+        if parsed['states']:
+            status = _status_words(_status(resource) or '')
+            if not any(_status_words(value) <= status for state in parsed['states'] for value in STATE_FILTERS[state]):
+                return False
+        if parsed['instance_type']:
+            if not isinstance(resource, dict) or parsed['instance_type'] not in (
+                    str(resource.get('InstanceType', '')).lower(), str(resource.get('DBInstanceClass', '')).lower()):
+                return False
+        return True
+
+    def list_resources(self, parsed: Dict[str, Any], aws_data: Dict) -> Optional[Dict[str, Any]]:
+        """Matching resources as a structured result, or None when the data for that resource was not collected"""
+        service, resource_types = RESOURCE_ALIASES[parsed['resource']]
+        service_data = aws_data.get(service)
+        if not isinstance(service_data, dict) or 'error' in service_data or \
+                not any(resource_type in service_data for resource_type in resource_types):
+            return None
+        collected = [record['resource'] for record in iter_resources({service: service_data})
+                     if record['resource_type'] in resource_types]
+
+        matches = [resource for resource in collected if self._matches(resource, parsed)]
+        statuses = Counter(status.lower() for status in map(_status, collected) if status)
+        label = ' '.join(parsed['states'] + [f"{service} {resource_types[0].replace('_', ' ')}"])
+        if parsed['instance_type']:
+            label += f" of type {parsed['instance_type']}"
+        return {
+            'type': 'resource_list',
+            'intent': parsed['intent'],
+            'title': label,
+            'data': matches,
+            'summary': dict([('matching', len(matches)), ('collected', len(collected))] + statuses.most_common(3))
+        }
+
+    def route(self, query: str, aws_data: Dict) -> Dict[str, Any]:
+        """Where to answer a query from: 'fast_path' (list/count), 'structured' (complex query processors) or 'llm'"""
+        parsed = self.parse(query)
+        if parsed['narrative']:
+            return {'route': 'llm', 'confidence': 0.0, 'reason': "asks for explanation or judgement", 'results': None}
+
+        if parsed['confidence'] >= self.min_confidence:
+            results = self.list_resources(parsed, aws_data)
+            if results is not None:
+                return {'route': 'fast_path', 'confidence': parsed['confidence'], 'reason': "list/count of collected resources",
+                        'results': results}
+
+        query_type = complex_query_processor.detect_query_type(query)
+        if query_type:
+            # The processors match keywords and report no confidence of their own
+            return {'route': 'structured', 'reason': f"matches the {query_type} processor",
+                    'results': complex_query_processor.process_complex_query(query, aws_data)}
+
+        if not parsed['resource']:
+            reason = "no resource type recognized"
+        elif parsed['unknown_words']:
+            reason = f"unrecognized words: {', '.join(parsed['unknown_words'][:5])}"
+        else:
+            reason = f"{RESOURCE_ALIASES[parsed['resource']][0]} data was not collected"
+        return {'route': 'llm', 'confidence': parsed['confidence'], 'reason': reason, 'results': None}
+
+    def answers_from_data(self, route: Optional[Dict[str, Any]]) -> bool:
+        """Whether a route is answered from the collected data rather than by the LLM"""
+        return route is not None and route['route'] != 'llm'
+
+    def format_results_for_display(self, results: Dict[str, Any]) -> str:
+        """Markdown for a fast-path result; other result types are formatted by the complex query processor"""
+        if results['type'] != 'resource_list':
+            return complex_query_processor.format_results_for_display(results)
+
+        resources = results['data']
+        output = [f"**{len(resources)}** {results['title']}"]
+        if not resources or results['intent'] == 'count' and len(resources) > 20:
+            return '\n'.join(output)
+
+        rows: List[Tuple[str, Optional[str], Optional[str], Dict[str, Any]]] = []
+        extra_columns: List[str] = []
+        for resource in resources[:MAX_DISPLAY_ROWS]:
+            fields = {field: resource[field] for field in KEY_FIELDS
+                      if isinstance(resource, dict) and field in resource and field not in STATUS_FIELDS
+                      and isinstance(resource[field], (str, int, float, bool, dict))}
+            extra_columns.extend(field for field in fields if field not in extra_columns)
+            rows.append((get_resource_id(resource) or '', _name_tag(resource), _status(resource), fields))
+        extra_columns = extra_columns[:MAX_EXTRA_COLUMNS]
+        show_names = any(name for _, name, _, _ in rows)
+        show_status = any(status for _, _, status, _ in rows)
+
+        header = ['ID'] + (['Name'] if show_names else []) + (['Status'] if show_status else []) + extra_columns
+        output.append('')
+        output.append('| ' + ' | '.join(header) + ' |')
+        output.append('|' + '---|' * len(header))
+        for resource_id, name, status, fields in rows:
+            cells = [resource_id] + ([name or ''] if show_names else []) + ([status or ''] if show_status else [])
+            cells += [fields.get(column, '') for column in extra_columns]
+            output.append('| ' + ' | '.join(_cell(cell) for cell in cells) + ' |')
+        if len(resources) > MAX_DISPLAY_ROWS:
+            output.append(f"\n_Showing the first {MAX_DISPLAY_ROWS} of {len(resources)}._")
+        return '\n'.join(output)
+
+
+# Global instance
+query_router = QueryRouter()
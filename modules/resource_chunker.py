@@ -0,0 +1,157 @@
+import json
+import re
+from typing import Dict, List, Any, Optional
+
+
+# Fields that identify a resource, in order of preference (VpcId/SubnetId last: many resources carry them)
+RESOURCE_ID_FIELDS = [
+    'AllocationId', 'NetworkInterfaceId', 'InstanceId', 'GroupId', 'VolumeId', 'RouteTableId', 'NetworkAclId',
+    'NatGatewayId', 'InternetGatewayId', 'DBInstanceIdentifier', 'DBClusterIdentifier', 'FunctionName',
+    'LoadBalancerName', 'TargetGroupName', 'StackName', 'UserName', 'RoleName', 'PolicyName', 'GroupName',
+    'InstanceProfileName', 'ZoneName', 'TableName', 'AlarmName', 'logGroupName', 'clusterName',
+    'SubnetId', 'VpcId', 'name', 'Name', 'Id', 'id'
+]
+
+# Fields worth surfacing as metadata and in the document header
+KEY_FIELDS = [
+    'State', 'Status', 'StackStatus', 'DBInstanceStatus', 'InstanceType', 'DBInstanceClass', 'Engine',
+    'Runtime', 'MemorySize', 'VolumeType', 'Size', 'CidrBlock', 'VpcId', 'SubnetId', 'GroupName',
+    'AvailabilityZone', 'Type', 'Scheme', 'IsDefault', 'PublicIpAddress', 'Encrypted'
+]
+
+_ARN_REGION = re.compile(r'^arn:aws[\w-]*:[\w-]+:([a-z]{2}(?:-gov)?-[a-z]+-\d):')
+_AZ_REGION = re.compile(r'^([a-z]{2}(?:-gov)?-[a-z]+-\d)[a-z]$')
+
+
+def _drop_empty(value: Any) -> Any:
+    """Recursively remove null and empty values"""
+    if isinstance(value, dict):
+        cleaned = {k: _drop_empty(v) for k, v in value.items()}
+        return {k: v for k, v in cleaned.items() if v not in (None, '', [], {})}
+    if isinstance(value, list):
+        cleaned = [_drop_empty(v) for v in value]
+        return [v for v in cleaned if v not in (None, '', [], {})]
+    return value
+
+
+def _scalar(value: Any) -> Optional[Any]:
+    """Reduce a field to a metadata-friendly scalar (e.g. State: {'Name': 'running'} -> 'running')"""
+    if isinstance(value, dict):
+        value = value.get('Name', value.get('Code'))
+    if isinstance(value, (str, int, float, bool)):
+        return value
+    return None
+
+
+def get_resource_id(resource: Any) -> Optional[str]:
+    """Best identifier for a resource (plain strings are their own ID)"""
+    if isinstance(resource, str):
+        return resource
+    if not isinstance(resource, dict):
+        return None
+    field = get_resource_id_field(resource)
+    return str(resource[field]) if field else None
+
+
+def get_resource_id_field(resource: Dict[str, Any]) -> Optional[str]:
+    """Field get_resource_id takes a dict resource's identifier from"""
+    for field in RESOURCE_ID_FIELDS:
+        if isinstance(resource.get(field), (str, int)) and resource.get(field) != '':
+            return field
+    return None
+
+
+def get_resource_region(resource: Any) -> Optional[str]:
+    """Derive the region from an ARN or availability zone when the API response carries one"""
+    if not isinstance(resource, dict):
+        return None
+    for key, value in resource.items():
+        if isinstance(value, str) and key.endswith('Arn'):
+            match = _ARN_REGION.match(value)
+            if match:
+                return match.group(1)
+    zone = resource.get('AvailabilityZone') or resource.get('Placement', {}).get('AvailabilityZone')
+    if isinstance(zone, str):
+        match = _AZ_REGION.match(zone)
+        if match:
+            return match.group(1)
+    return None
+
+
+def iter_resources(aws_data: Dict) -> List[Dict[str, Any]]:
+    """Flatten collected AWS data into (service, resource_type, resource) records"""
+    records = []
+    for service, service_data in aws_data.items():
+        if not isinstance(service_data, dict):
+            continue
+        for resource_type, resources in service_data.items():
+            if resource_type == 'error':
+                continue
+            if not isinstance(resources, list):
+                resources = [resources]
+            for resource in resources:
+                # describe_instances returns reservations that wrap the actual instances
+                if isinstance(resource, dict) and isinstance(resource.get('Instances'), list) and 'ReservationId' in resource:
+                    for instance in resource['Instances']:
+                        instance = dict(instance)
+                        instance.setdefault('OwnerId', resource.get('OwnerId'))
+                        records.append({'service': service, 'resource_type': resource_type, 'resource': instance})
+                else:
+                    records.append({'service': service, 'resource_type': resource_type, 'resource': resource})
+    return records
+
+
+def chunk_resource(service: str, resource_type: str, resource: Any, position: int = 0) -> Dict[str, Any]:
+    """Build one compact, self-contained document for a single resource"""
+    resource_id = get_resource_id(resource) or f"{resource_type}[{position}]"
+    region = get_resource_region(resource)
+
+    metadata = {
+        'service': service,
+        'resource_type': resource_type,
+        'resource_id': f"{service}/{resource_type}/{resource_id}",
+        'name': resource_id,
+        'region': region
+    }
+    key_values = []
+    if isinstance(resource, dict):
+        for field in KEY_FIELDS:
+            value = _scalar(resource.get(field))
+            if value is not None and value != '':
+                metadata[field] = value
+                key_values.append(f"{field}: {value}")
+
+    header = f"{service} {resource_type} {resource_id}"
+    if region:
+        header += f" | region: {region}"
+    if key_values:
+        header += " | " + ", ".join(key_values)
+
+    if isinstance(resource, dict):
+        body = json.dumps(_drop_empty(resource), separators=(',', ':'), default=str)
+        text = f"{header}\n{body}"
+    else:
+        text = header
+
+    return {'text': text, 'metadata': metadata}
+
+
+def chunk_aws_data(aws_data: Dict) -> List[Dict[str, Any]]:
+    """Emit one compact document per resource, with resource type, ID, region and key fields as metadata"""
+    chunks = []
+    positions = {}
+    for record in iter_resources(aws_data):
+        type_key = (record['service'], record['resource_type'])
+        position = positions.get(type_key, 0)
+        positions[type_key] = position + 1
+        chunks.append(chunk_resource(record['service'], record['resource_type'], record['resource'], position))
+
+    # Collection errors are still useful context ("no access to IAM")
+    for service, service_data in aws_data.items():
+        if isinstance(service_data, dict) and 'error' in service_data:
+            chunks.append({
+                'text': f"{service} collection error: {service_data['error']}",
+                'metadata': {'service': service, 'resource_type': 'error', 'resource_id': f"{service}/error",
+                             'name': 'error', 'region': None}
+            })
+    return chunks
@@ -0,0 +1,128 @@
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional
+
+from modules.resource_chunker import get_resource_id_field
+
+
+MISSING = '(missing)'
+MAX_DIFF_PATHS = 200  # Differences listed in a comparison before the rest are summarized
+
+# Fields identifying an element of a nested list (never VpcId/SubnetId, which siblings share)
+LIST_ITEM_KEY_FIELDS = [
+    'NetworkInterfaceId', 'AttachmentId', 'AllocationId', 'AssociationId', 'GroupId', 'InstanceId', 'VolumeId',
+    'DeviceName', 'Key'
+]
+
+
+def _list_item_key(item: Dict[str, Any]) -> Optional[str]:
+    """Identifier field of a list element that carries one, so reordering isn't a difference"""
+    for field in LIST_ITEM_KEY_FIELDS:
+        if isinstance(item.get(field), (str, int)) and item.get(field) != '':
+            return field
+    return None
+
+
+def flatten_paths(resource: Any, prefix: str = '', out: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Every leaf value of a resource by dotted path.
+
+    Tags become Tags.<key>, list elements with an identifier are keyed by it (SecurityGroups[sg-1].GroupName),
+    other elements by position, and lists of scalars are compared as sorted sets.
+    """
+    if out is None:
+        out = OrderedDict()
+    if isinstance(resource, dict):
+        if not resource and prefix:
+            out[prefix] = {}
+        for key, value in resource.items():
+            flatten_paths(value, f"{prefix}.{key}" if prefix else str(key), out)
+    elif isinstance(resource, list):
+        if all(isinstance(item, dict) and set(item) == {'Key', 'Value'} for item in resource) and resource:
+            for item in resource:
+                out[f"{prefix}.{item['Key']}"] = item['Value']
+        elif all(not isinstance(item, (dict, list)) for item in resource):
+            out[prefix] = ', '.join(sorted(str(item) for item in resource))
+        else:
+            for position, item in enumerate(resource):
+                key_field = _list_item_key(item) if isinstance(item, dict) else None
+                if key_field is None:
+                    flatten_paths(item, f"{prefix}[{position}]", out)
+                    continue
+                # The identifier is already in the path; an element with nothing else is recorded by presence
+                item_prefix = f"{prefix}[{item[key_field]}]"
+                rest = {field: value for field, value in item.items() if field != key_field}
+                if rest:
+                    flatten_paths(rest, item_prefix, out)
+                else:
+                    out[item_prefix] = 'present'
+    else:
+        out[prefix or 'value'] = resource
+    return out
+
+
+def diff_resources(old: Any, new: Any) -> Dict[str, Any]:
+    """Paths added in new, removed from old and changed between them, plus the count of identical paths"""
+    old_paths, new_paths = flatten_paths(old), flatten_paths(new)
+    return {
+        'added': OrderedDict((path, value) for path, value in new_paths.items() if path not in old_paths),
+        'removed': OrderedDict((path, value) for path, value in old_paths.items() if path not in new_paths),
+        'changed': OrderedDict((path, (old_paths[path], value)) for path, value in new_paths.items()
+                               if path in old_paths and old_paths[path] != value),
+        'identical': sum(1 for path, value in new_paths.items() if path in old_paths and old_paths[path] == value)
+    }
+
+
+def diff_many(resources: List[Any]) -> Dict[str, Any]:
+    """Paths whose value differs across any of the resources (MISSING where a resource lacks the path)"""
+    flattened = [flatten_paths(resource) for resource in resources]
+    all_paths = list(OrderedDict.fromkeys(path for paths in flattened for path in paths))
+    varying = OrderedDict()
+    identical = 0
+    for path in all_paths:
+        values = [paths.get(path, MISSING) for paths in flattened]
+        if all(value == values[0] for value in values):
+            identical += 1
+        else:
+            varying[path] = values
+    return {'varying': varying, 'identical': identical}
+
+
+def _value(value: Any) -> str:
+    return str(value).replace('\n', ' ')
+
+
+def render_diff(resources: List[Any], labels: Optional[List[str]] = None, max_paths: int = MAX_DIFF_PATHS) -> str:
+    """Compact text of what differs between resources: added/removed/changed for two, a value per resource for more"""
+    labels = labels or [f"R{i + 1}" for i in range(len(resources))]
+    # Each resource's own identifier always differs and is already named in its label
+    id_paths = {get_resource_id_field(resource) for resource in resources if isinstance(resource, dict)}
+    lines = []
+    if len(resources) == 2:
+        diff = diff_resources(resources[0], resources[1])
+        sections = [
+            (f"Only in {labels[1]}", [f"{path}: {_value(value)}" for path, value in diff['added'].items()]),
+            (f"Only in {labels[0]}", [f"{path}: {_value(value)}" for path, value in diff['removed'].items()]),
+            (f"Changed ({labels[0]} -> {labels[1]})",
+             [f"{path}: {_value(old)} -> {_value(new)}" for path, (old, new) in diff['changed'].items() if path not in id_paths]),
+        ]
+        identical = diff['identical']
+    else:
+        diff = diff_many(resources)
+        sections = [(f"Differences ({' | '.join(labels)})",
+                     [f"{path}: {' | '.join(_value(value) for value in values)}"
+                      for path, values in diff['varying'].items() if path not in id_paths])]
+        identical = diff['identical']
+
+    listed = 0
+    for title, entries in sections:
+        if not entries:
+            continue
+        shown = entries[:max(0, max_paths - listed)]
+        listed += len(shown)
+        lines.append(f"{title}:")
+        lines.extend(f"  {entry}" for entry in shown)
+        if len(shown) < len(entries):
+            lines.append(f"  ... {len(entries) - len(shown)} more")
+    if not lines:
+        lines.append("No differences: the resources are configured identically.")
+    lines.append(f"{identical} fields are identical across all resources and omitted.")
+    return '\n'.join(lines)
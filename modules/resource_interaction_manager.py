@@ -1,8 +1,49 @@
-import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import streamlit as st
-from typing import Dict, List, Any, Optional, Tuple
-from modules.bedrock_query_engine import query_bedrock_model
-from qa_engine import query_aws_knowledgebase
+from typing import Dict, Iterator, List, Any, Optional, Tuple
+from botocore.exceptions import ClientError
+from modules.bedrock_models import get_model_adapter
+from modules.bedrock_query_engine import (
+    create_bedrock_runtime, estimate_tokens, invoke_bedrock_prompt, query_bedrock_model, truncate_context_aggressively
+)
+from modules.compact_renderer import render_resource
+from modules.resource_diff import render_diff
+from qa_engine import (
+    DIRECT_PROMPT_RESPONSE_TOKENS, OLLAMA_NUM_CTX, fits_ollama_context, query_aws_knowledgebase, query_ollama_direct
+)
+
+
+FAN_OUT_CONCURRENCY = int(os.environ.get("RESOURCE_FAN_OUT_CONCURRENCY", "4"))  # Resource groups analyzed at once
+FAN_OUT_AUTO_THRESHOLD = 5  # Fan-out is preselected above this many selected resources
+
+RESOURCE_PROMPT = """You are an AWS infrastructure expert. I'm asking about specific AWS resources.
+
+Selected AWS Resources:
+{context}
+
+Question: {query}
+
+Please provide detailed information about these specific resources, including:
+- Current configuration and status
+- Security implications
+- Cost optimization suggestions
+- Best practices recommendations
+- Potential issues or risks
+
+Focus your response on the selected resources only."""
+
+COMPARISON_QUESTION = "Please analyze the differences between these resources and provide recommendations."
+
+SYNTHESIS_PROMPT = """You are an AWS infrastructure expert. Each of the {count} findings below answers the question for one resource or a small group of resources.
+
+Question: {query}
+
+Findings:
+{findings}
+
+Combine the findings into one answer: state the overall picture, call out patterns shared across resources, and list the most important issues first, naming the resources they affect."""
 
 
 class ResourceInteractionManager:
@@ -103,7 +144,7 @@ class ResourceInteractionManager:
         """Format a single resource for AI interaction"""
         formatted_parts = [
             f"=== {service} {resource_type.title()} ===",
-            json.dumps(resource, indent=2, default=str)
+            render_resource(resource)
         ]
         return '\n'.join(formatted_parts)
     
@@ -134,28 +175,17 @@ class ResourceInteractionManager:
             return "No valid resources selected for querying."
         
         # Create a focused prompt for resource interaction
-        focused_prompt = f"""You are an AWS infrastructure expert. I'm asking about specific AWS resources.
-
-Selected AWS Resources:
-{context}
-
-Question: {query}
-
-Please provide detailed information about these specific resources, including:
-- Current configuration and status
-- Security implications
-- Cost optimization suggestions
-- Best practices recommendations
-- Potential issues or risks
-
-Focus your response on the selected resources only."""
+        focused_prompt = RESOURCE_PROMPT.format(context=context, query=query)
         
         try:
-            if llm_provider == "Ollama":
+            if llm_provider == "Ollama" and fits_ollama_context(focused_prompt):
+                # The prompt already holds the selected resources, so there is nothing to retrieve
+                response = query_ollama_direct(focused_prompt, llm_model=model_config.get('model_name'), query=query)
+            elif llm_provider == "Ollama":
                 response = query_aws_knowledgebase(
                     focused_prompt,
                     [context],
-                    embed_model='nomic-embed-text',
+                    embed_model=model_config.get('embed_model', 'nomic-embed-text'),
                     llm_model=model_config.get('model_name')
                 )
             elif llm_provider == "Bedrock":
@@ -178,6 +208,99 @@ Focus your response on the selected resources only."""
         except Exception as e:
             return f"Error querying resources: {str(e)}"
     
+    def group_selected_resources(self, selected_resources: List[Tuple[str, str, int]],
+                                 group_size: int = 1) -> List[List[Tuple[str, str, int]]]:
+        """Selected resources in groups of at most group_size, never mixing resource types"""
+        by_type: Dict[Tuple[str, str], List[Tuple[str, str, int]]] = {}
+        for selection in selected_resources:
+            by_type.setdefault(selection[:2], []).append(selection)
+        groups = []
+        for selections in by_type.values():
+            groups.extend(selections[start:start + group_size] for start in range(0, len(selections), group_size))
+        return groups
+    
+    def _invoke_prompt(self, prompt: str, documents: List[str], llm_provider: str, model_config: Dict,
+                       bedrock_runtime=None, query: Optional[str] = None, operation: str = 'fan-out') -> str:
+        """Answer a self-contained prompt without writing to the page, so it can run in worker threads; raises on errors"""
+        if llm_provider == "Ollama":
+            if fits_ollama_context(prompt):
+                return query_ollama_direct(prompt, llm_model=model_config.get('model_name'), query=query)
+            return query_aws_knowledgebase(
+                prompt,
+                documents,
+                embed_model=model_config.get('embed_model', 'nomic-embed-text'),
+                llm_model=model_config.get('model_name'),
+                persist=False  # Each group retrieves only from its own resources
+            )
+        return invoke_bedrock_prompt(bedrock_runtime, model_config.get('model_id'), prompt, operation=operation, query=query)
+    
+    def _create_runtime(self, llm_provider: str, model_config: Dict):
+        if llm_provider == "Bedrock":
+            return create_bedrock_runtime(
+                model_config.get('aws_access_key'),
+                model_config.get('aws_secret_key'),
+                model_config.get('aws_region'),
+                model_config.get('use_cli_creds', False),
+                model_config.get('aws_profile'),
+                model_config.get('regions')
+            )
+        if llm_provider != "Ollama":
+            raise ValueError(f"Unsupported LLM provider: {llm_provider}")
+        return None
+    
+    def analyze_resources_concurrently(self, query: str, selected_resources: List[Tuple[str, str, int]],
+                                       aws_data: Dict, llm_provider: str, model_config: Dict,
+                                       group_size: int = 1, max_workers: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """Analyze each group of selected resources in its own LLM call, at most max_workers at a time.
+        
+        Yields one result per group as soon as it completes, with the resource labels, answer or error and latency.
+        """
+        resources = self.extract_individual_resources(aws_data)
+        bedrock_runtime = self._create_runtime(llm_provider, model_config)
+        groups = self.group_selected_resources(selected_resources, group_size)
+        
+        def analyze(group_id):
+            start_time = time.time()
+            result = {
+                'group': group_id,
+                'labels': [self.get_resource_summary(resources[service][resource_type][index], resource_type)
+                           for service, resource_type, index in groups[group_id]],
+                'answer': None,
+                'error': None
+            }
+            context = self.create_resource_context(groups[group_id], aws_data)
+            try:
+                result['answer'] = self._invoke_prompt(RESOURCE_PROMPT.format(context=context, query=query), [context],
+                                                       llm_provider, model_config, bedrock_runtime, query)
+            except ClientError as e:
+                result['error'] = e.response.get('Error', {}).get('Message', str(e))
+            except Exception as e:
+                result['error'] = str(e)
+            result['seconds'] = time.time() - start_time
+            return result
+        
+        workers = max(1, min(max_workers or FAN_OUT_CONCURRENCY, len(groups)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in as_completed([executor.submit(analyze, group_id) for group_id in range(len(groups))]):
+                yield future.result()
+    
+    def synthesize_resource_analyses(self, query: str, results: List[Dict[str, Any]], llm_provider: str,
+                                     model_config: Dict) -> str:
+        """One combined answer from the per-group results of analyze_resources_concurrently"""
+        findings = [f"### {', '.join(result['labels'])}\n{result['answer']}"
+                    for result in sorted(results, key=lambda result: result['group']) if result['answer']]
+        if not findings:
+            return "None of the resource analyses succeeded, so there is nothing to combine."
+        
+        # Keep the combined findings inside the window, so the prompt never needs retrieval
+        model_id = model_config.get('model_id') if llm_provider == "Bedrock" else None
+        window = get_model_adapter(model_id).input_token_budget if model_id else OLLAMA_NUM_CTX - DIRECT_PROMPT_RESPONSE_TOKENS
+        frame_tokens = estimate_tokens(SYNTHESIS_PROMPT.format(count=len(findings), query=query, findings=''), model_id)
+        findings_text = truncate_context_aggressively('\n\n'.join(findings), window - frame_tokens, model_id)
+        prompt = SYNTHESIS_PROMPT.format(count=len(findings), query=query, findings=findings_text)
+        return self._invoke_prompt(prompt, findings, llm_provider, model_config,
+                                   self._create_runtime(llm_provider, model_config), query, 'synthesis')
+    
     def get_resource_actions(self, resource_type: str) -> List[str]:
         """Get suggested actions for a resource type"""
         actions = {
@@ -265,17 +388,28 @@ Focus your response on the selected resources only."""
     
     def compare_resources(self, resource1: Dict, resource2: Dict, resource_type: str) -> str:
         """Compare two resources of the same type"""
-        comparison_parts = [
-            f"=== Comparing {resource_type.title()} ===",
-            "",
-            "Resource 1:",
-            json.dumps(resource1, indent=2, default=str),
+        return self.compare_resource_set([resource1, resource2], resource_type)
+    
+    def compare_resource_set(self, resources: List[Dict], resource_type: str) -> str:
+        """Comparison prompt for resources of one type: who they are, then only the fields that differ"""
+        # describe_instances reservations wrap the instance being compared
+        resources = [
+            resource['Instances'][0]
+            if 'ReservationId' in resource and isinstance(resource.get('Instances'), list) and len(resource['Instances']) == 1
+            else resource
+            for resource in resources
+        ]
+        labels = [f"R{i + 1}" for i in range(len(resources))]
+        comparison_parts = [f"=== Comparing {len(resources)} {resource_type.title()} ===", ""]
+        comparison_parts.extend(
+            f"{label}: {self.get_resource_summary(resource, resource_type)}" for label, resource in zip(labels, resources)
+        )
+        comparison_parts.extend([
             "",
-            "Resource 2:",
-            json.dumps(resource2, indent=2, default=str),
+            render_diff(resources, labels),
             "",
-            "Please analyze the differences between these resources and provide recommendations."
-        ]
+            COMPARISON_QUESTION
+        ])
         return '\n'.join(comparison_parts)
     
     def get_resource_relationships(self, resource: Dict, resource_type: str, all_resources: Dict) -> List[str]:
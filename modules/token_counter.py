@@ -0,0 +1,159 @@
+import hashlib
+import logging
+import math
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+from modules.bedrock_models import get_model_adapter
+
+
+logger = logging.getLogger(__name__)
+
+# 'auto' (bpe when tiktoken is available), 'approx', 'bpe' (cl100k counts scaled per model family, an
+# estimate of the model's own tokenizer) or 'exact' (a tokenizer registered for the family)
+TOKEN_COUNT_MODE = os.environ.get("TOKEN_COUNT_MODE", "auto")
+
+# Word (camelCase parts), digit and punctuation runs; single spaces merge into the next piece like BPE tokenizers do
+_PIECE_PATTERN = re.compile(r'[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+|[^\sA-Za-z\d]+|\n[\n ]*| {2,}')
+
+# Token counts relative to cl100k_base for each model family's own tokenizer
+FAMILY_TOKEN_SCALE = {
+    'anthropic': 1.10,
+    'amazon-titan': 1.10,
+    'amazon-nova': 1.10,
+    'ai21-jurassic': 0.95,
+    'cohere-command': 1.05,
+    'cohere-command-r': 1.00,
+    'meta-llama': 1.00,
+    'mistral': 1.15,
+    'generic': 1.10,
+}
+
+
+class ApproximateTokenCounter:
+    """Fast BPE-like estimate: words, digit groups and punctuation runs are costed separately"""
+
+    mode = 'approx'
+
+    def __init__(self, scale: float = 1.0):
+        self.scale = scale
+
+    def _raw_count(self, text: str) -> int:
+        tokens = 0
+        for piece in _PIECE_PATTERN.findall(text):
+            first = piece[0]
+            if first.isalpha():
+                tokens += math.ceil(len(piece) / 7)  # Common words are one token, long rare ones split
+            elif first.isdigit():
+                tokens += math.ceil(len(piece) / 3)  # BPE vocabularies group up to three digits
+            elif first in '\n ':
+                tokens += 1
+            else:
+                tokens += math.ceil(len(piece) / 2)  # JSON punctuation pairs like '":' usually merge
+        return tokens
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        return math.ceil(self._raw_count(text) * self.scale)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Longest prefix of text that fits in max_tokens"""
+        tokens = self.count(text)
+        if tokens <= max_tokens:
+            return text
+        # Counts are close to proportional to length, so a couple of proportional cuts converge
+        end = int(len(text) * max_tokens / tokens)
+        while end > 0 and self.count(text[:end]) > max_tokens:
+            end = int(end * 0.98)
+        return text[:end]
+
+
+class TiktokenCounter(ApproximateTokenCounter):
+    """cl100k BPE token counts from tiktoken times the family's scale, with an LRU cache of counts keyed by text hash.
+
+    Closer than the approximation, but still an estimate for models whose tokenizer isn't cl100k.
+    """
+
+    mode = 'bpe'
+
+    def __init__(self, encoding, scale: float = 1.0, cache_size: int = 4096):
+        super().__init__(scale)
+        self.encoding = encoding
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[bytes, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _raw_count(self, text: str) -> int:
+        key = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        count = len(self.encoding.encode(text, disallowed_special=()))
+        with self._lock:
+            self._cache[key] = count
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return count
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if self.count(text) <= max_tokens:
+            return text
+        tokens = self.encoding.encode(text, disallowed_special=())
+        return self.encoding.decode(tokens[:int(max_tokens / self.scale)])
+
+
+def _load_tiktoken_encoding(name: str = 'cl100k_base'):
+    """The tiktoken encoding, or None when tiktoken or its encoding files are unavailable"""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(name)
+    except Exception:
+        # Not installed, or the encoding can't be downloaded (offline)
+        return None
+
+
+_encoding = None
+_encoding_loaded = False
+_counters: Dict[tuple, ApproximateTokenCounter] = {}
+# Extra counter factories by model family, taking the family's scale
+_counter_factories: Dict[str, Callable[[float], ApproximateTokenCounter]] = {}
+
+
+def register_token_counter(family: str, factory: Callable[[float], ApproximateTokenCounter]):
+    """Use a custom counter (e.g. a provider tokenizer, with mode 'exact') for a model family in every mode but approx"""
+    _counter_factories[family] = factory
+    for key in [key for key in _counters if key[0] == family]:
+        del _counters[key]
+
+
+def get_token_counter(model_id: Optional[str] = None, mode: Optional[str] = None) -> ApproximateTokenCounter:
+    """Token counter for a model's family; bpe and exact modes fall back (with a warning) to what is available"""
+    global _encoding, _encoding_loaded
+    family = get_model_adapter(model_id).family if model_id else 'generic'
+    mode = mode or TOKEN_COUNT_MODE
+    key = (family, mode)
+    counter = _counters.get(key)
+    if counter is not None:
+        return counter
+
+    scale = FAMILY_TOKEN_SCALE.get(family, FAMILY_TOKEN_SCALE['generic'])
+    if mode != 'approx' and family in _counter_factories:
+        counter = _counter_factories[family](scale)
+    elif mode != 'approx':
+        if not _encoding_loaded:
+            _encoding = _load_tiktoken_encoding()
+            _encoding_loaded = True
+        counter = TiktokenCounter(_encoding, scale) if _encoding is not None else None
+        if mode == 'exact' or (mode == 'bpe' and counter is None):
+            logger.warning("TOKEN_COUNT_MODE=%s is unavailable for %s models (%s); using %s token counts", mode, family,
+                           'no tokenizer registered' if mode == 'exact' else 'tiktoken is not installed',
+                           counter.mode if counter else 'approx')
+    if counter is None:
+        counter = ApproximateTokenCounter(scale)
+    _counters[key] = counter
+    return counter
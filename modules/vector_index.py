@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import pickle
+import uuid
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+
+from modules.faiss_index_factory import (
+    DEFAULT_INDEX_TYPE, DEFAULT_QUANTIZATION, FLAT_INDEX_MAX_VECTORS,
+    build_faiss_index, choose_index_spec, is_flat_index, is_ivf_index, read_index, write_index
+)
+
+
+def get_resource_key(document: Document) -> str:
+    """Stable identity of the resource a document describes"""
+    resource_id = document.metadata.get('resource_id')
+    if resource_id:
+        return str(resource_id)
+    # Legacy text documents: identify them by their header line
+    return document.page_content.split('\n', 1)[0].strip()
+
+
+class IncrementalVectorIndex:
+    """FAISS vectorstore kept in sync with the inventory one resource at a time.
+
+    Each resource key maps to the docstore IDs of its chunks, so a changed or deleted
+    resource is removed and re-added in place instead of rebuilding the whole index.
+    Above ``flat_max_vectors`` the store switches to an IVF/HNSW index with optional
+    quantization; those index types cannot delete vectors in place, so changes that remove
+    vectors rebuild them from the (cached) embeddings instead.
+    """
+
+    def __init__(self, embeddings: Embeddings, index_dir: str, index_type: str = DEFAULT_INDEX_TYPE,
+                 quantization: str = DEFAULT_QUANTIZATION, flat_max_vectors: int = FLAT_INDEX_MAX_VECTORS):
+        self.embeddings = embeddings
+        self.index_dir = index_dir
+        self.index_type = index_type
+        self.quantization = quantization
+        self.flat_max_vectors = flat_max_vectors
+        self.manifest_path = os.path.join(index_dir, 'manifest.json')
+        self.index_path = os.path.join(index_dir, 'index.faiss')
+        self.docstore_path = os.path.join(index_dir, 'index.pkl')
+        self.vectorstore: Optional[FAISS] = None
+        self.version: Optional[str] = None
+        self.index_spec: Optional[str] = None
+        self.resource_vectors: Dict[str, List[str]] = {}
+        self.resource_hashes: Dict[str, str] = {}
+        self._mmapped = False
+        self._load()
+
+    def _load(self):
+        if not all(os.path.exists(path) for path in (self.manifest_path, self.index_path, self.docstore_path)):
+            return
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            index, self._mmapped = read_index(self.index_path, mmap=True)
+            with open(self.docstore_path, 'rb') as f:
+                docstore, index_to_docstore_id = pickle.load(f)
+            self.vectorstore = FAISS(self.embeddings, index, docstore, index_to_docstore_id)
+            self.version = manifest.get('version')
+            self.index_spec = manifest.get('index_spec', 'Flat')
+            self.resource_vectors = manifest.get('resource_vectors', {})
+            self.resource_hashes = manifest.get('resource_hashes', {})
+        except (OSError, ValueError, RuntimeError, pickle.UnpicklingError):
+            self.vectorstore, self.version, self.index_spec = None, None, None
+            self.resource_vectors, self.resource_hashes = {}, {}
+
+    def save(self):
+        """Persist the FAISS index, its docstore and the resource-to-vector mapping"""
+        if self.vectorstore is None:
+            return
+        os.makedirs(self.index_dir, exist_ok=True)
+        write_index(self.vectorstore.index, self.index_path)
+        # Same (docstore, id map) layout as FAISS.save_local, written atomically
+        with open(self.docstore_path + '.tmp', 'wb') as f:
+            pickle.dump((self.vectorstore.docstore, self.vectorstore.index_to_docstore_id), f)
+        os.replace(self.docstore_path + '.tmp', self.docstore_path)
+        with open(self.manifest_path + '.tmp', 'w') as f:
+            json.dump({
+                'version': self.version,
+                'index_spec': self.index_spec,
+                'resource_vectors': self.resource_vectors,
+                'resource_hashes': self.resource_hashes
+            }, f)
+        os.replace(self.manifest_path + '.tmp', self.manifest_path)
+
+    def _ensure_writable(self):
+        """Memory-mapped indexes are read-only; load a private copy before modifying"""
+        if self._mmapped and self.vectorstore is not None:
+            self.vectorstore.index, self._mmapped = read_index(self.index_path, mmap=False)
+
+    def _rebuild(self, documents: List[Document], ids: List[str], vectors: Optional[np.ndarray] = None):
+        """Build a fresh index of the type suited to this corpus size"""
+        if vectors is None:
+            vectors = np.asarray(self.embeddings.embed_documents([doc.page_content for doc in documents]),
+                                 dtype=np.float32)
+        self.index_spec = choose_index_spec(len(documents), vectors.shape[1], self.index_type,
+                                            self.quantization, self.flat_max_vectors)
+        index = build_faiss_index(vectors, self.index_spec)
+        docstore = InMemoryDocstore(dict(zip(ids, documents)))
+        self.vectorstore = FAISS(self.embeddings, index, docstore, dict(enumerate(ids)))
+        self._mmapped = False
+
+    def _needs_rebuild(self, total_vectors: int, removing: bool) -> bool:
+        if self.vectorstore is None:
+            return True
+        index = self.vectorstore.index
+        wanted = choose_index_spec(total_vectors, index.d, self.index_type, self.quantization, self.flat_max_vectors)
+        if is_flat_index(index):
+            return wanted != 'Flat'
+        # Leave IVF/HNSW only once the corpus has shrunk well below the threshold (avoids flapping)
+        if self.index_type == 'auto' and total_vectors <= self.flat_max_vectors // 2:
+            return True
+        # A corpus too small to train IVF starts on SQ8; move to IVF once it has grown enough
+        if wanted.startswith('IVF') and not is_ivf_index(index):
+            return True
+        return removing
+
+    def sync(self, documents: List[Document], split_fn: Optional[Callable[[List[Document]], List[Document]]] = None,
+             version: Optional[str] = None) -> Dict[str, int]:
+        """Bring the index in line with ``documents``, touching only resources that changed"""
+        current = {}
+        for doc in documents:
+            key = get_resource_key(doc)
+            suffix = 1
+            unique_key = key
+            while unique_key in current:
+                suffix += 1
+                unique_key = f"{key}#{suffix}"
+            current[unique_key] = doc
+
+        current_hashes = {
+            key: hashlib.sha256(doc.page_content.encode('utf-8')).hexdigest()
+            for key, doc in current.items()
+        }
+        removed = [key for key in self.resource_hashes if key not in current]
+        changed = [key for key, h in current_hashes.items() if key in self.resource_hashes and self.resource_hashes[key] != h]
+        added = [key for key in current if key not in self.resource_hashes]
+
+        stale_ids = set(vector_id for key in removed + changed for vector_id in self.resource_vectors.get(key, []))
+        for key in removed:
+            self.resource_vectors.pop(key, None)
+            self.resource_hashes.pop(key, None)
+
+        # Split only the new and changed resources
+        new_chunks, new_ids = [], []
+        for key in changed + added:
+            source = current[key]
+            source.metadata.setdefault('resource_id', key)
+            chunks = split_fn([source]) if split_fn else [source]
+            ids = [uuid.uuid4().hex for _ in chunks]
+            self.resource_vectors[key] = ids
+            self.resource_hashes[key] = current_hashes[key]
+            new_chunks.extend(chunks)
+            new_ids.extend(ids)
+
+        existing = len(self.vectorstore.index_to_docstore_id) if self.vectorstore is not None else 0
+        total_vectors = existing - len(stale_ids) + len(new_chunks)
+
+        if (stale_ids or new_chunks) and self._needs_rebuild(total_vectors, bool(stale_ids)):
+            kept_ids, kept_docs, kept_vectors = [], [], None
+            if self.vectorstore is not None:
+                positions = [pos for pos, doc_id in sorted(self.vectorstore.index_to_docstore_id.items())
+                             if doc_id not in stale_ids]
+                kept_ids = [self.vectorstore.index_to_docstore_id[pos] for pos in positions]
+                kept_docs = [self.vectorstore.docstore.search(doc_id) for doc_id in kept_ids]
+                if is_flat_index(self.vectorstore.index) and positions:
+                    # Exact vectors can be read back from a flat index without re-embedding
+                    kept_vectors = self.vectorstore.index.reconstruct_n(0, self.vectorstore.index.ntotal)[positions]
+            if new_chunks or kept_docs:
+                all_docs = kept_docs + new_chunks
+                vectors = None
+                if kept_vectors is not None or not kept_docs:
+                    vectors = kept_vectors
+                    if new_chunks:
+                        new_vectors = np.asarray(self.embeddings.embed_documents([c.page_content for c in new_chunks]),
+                                                 dtype=np.float32).reshape(len(new_chunks), -1)
+                        vectors = new_vectors if kept_vectors is None else np.vstack([kept_vectors, new_vectors])
+                self._rebuild(all_docs, kept_ids + new_ids, vectors)
+            else:
+                self.vectorstore, self.index_spec = None, None
+        else:
+            if stale_ids or new_chunks:
+                self._ensure_writable()
+            if stale_ids:
+                self.vectorstore.delete(list(stale_ids))
+            if new_chunks:
+                self.vectorstore.add_documents(new_chunks, ids=new_ids)
+
+        version_changed = version != self.version
+        self.version = version
+        if removed or changed or added or version_changed:
+            self.save()
+
+        return {
+            'added': len(added),
+            'changed': len(changed),
+            'removed': len(removed),
+            'unchanged': len(current) - len(added) - len(changed),
+            'embedded_chunks': len(new_chunks),
+            'index_spec': self.index_spec
+        }
@@ -1,42 +1,295 @@
 from langchain_community.vectorstores import FAISS
-from langchain.embeddings.ollama import OllamaEmbeddings
 from langchain.llms import Ollama
 from langchain.chains import RetrievalQA
+from langchain.chains.question_answering.stuff_prompt import PROMPT as STUFF_PROMPT
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.docstore.document import Document
+from langchain.callbacks.base import BaseCallbackHandler
+from modules.embedding_cache import CachedEmbeddings
+from modules.ollama_embeddings import BatchedOllamaEmbeddings, EMBEDDING_FORMAT
+from modules.hashing_embeddings import HashingEmbeddings, HASHING_EMBED_MODEL
+from modules.vector_index import IncrementalVectorIndex
+from modules.hybrid_retriever import BM25Index, HybridRetriever, get_vectorstore_documents
+from modules.query_metrics import query_metrics
+from modules.token_counter import get_token_counter
+import hashlib
 import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
 
-# Step 1: Convert AWS data (strings) into LangChain Documents
+# Vector indexes are persisted here, one folder per embedding model and inventory version
+VECTORSTORE_CACHE_DIR = os.environ.get(
+    "VECTORSTORE_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".vectorstore_cache")
+)
+VECTORSTORE_MAX_INDEXES = int(os.environ.get("VECTORSTORE_MAX_INDEXES", "8"))  # Versions kept per model, in memory and on disk
+MAX_RESOURCE_CHUNK_CHARS = 4000  # Resource documents above this size are split
+OLLAMA_NUM_CTX = int(os.environ.get("OLLAMA_NUM_CTX", "4096"))  # Context window requested for direct prompts
+DIRECT_PROMPT_RESPONSE_TOKENS = 1024  # Room left in the window for the answer
+
+_vector_indexes = OrderedDict()  # (cache_dir, model, version) -> index, least recently used first
+_vector_index_locks = [threading.Lock() for _ in range(32)]  # Striped by version, so the set stays bounded
+_vector_indexes_lock = threading.Lock()
+_building_index_dirs = set()
+_lexical_indexes = {}
+_embeddings_by_model = {}
+
+# Step 1: Convert AWS data (strings, or resource chunks with metadata) into LangChain Documents
 def create_documents(text_chunks):
-    return [Document(page_content=chunk) for chunk in text_chunks]
+    documents = []
+    for chunk in text_chunks:
+        if isinstance(chunk, dict):
+            documents.append(Document(page_content=chunk['text'], metadata=dict(chunk.get('metadata', {}))))
+        else:
+            documents.append(Document(page_content=chunk))
+    return documents
 
-# Step 2: Split into chunks
+# Step 2: Split into chunks (per-resource documents are only split when unusually large)
 def split_documents(documents):
     splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-    return splitter.split_documents(documents)
+    resource_splitter = RecursiveCharacterTextSplitter(chunk_size=MAX_RESOURCE_CHUNK_CHARS, chunk_overlap=200)
+    chunks = []
+    for doc in documents:
+        if 'resource_type' in doc.metadata:
+            chunks.extend(resource_splitter.split_documents([doc]))
+        else:
+            chunks.extend(splitter.split_documents([doc]))
+    return chunks
+
+# Step 2b: Embeddings backed by the content-addressed cache, shared per model
+def get_embeddings(model_name='nomic-embed-text'):
+    if model_name not in _embeddings_by_model:
+        if model_name == HASHING_EMBED_MODEL:
+            # Computed in-process, cheaper than a cache lookup
+            _embeddings_by_model[model_name] = HashingEmbeddings()
+        else:
+            _embeddings_by_model[model_name] = CachedEmbeddings(BatchedOllamaEmbeddings(model=model_name), model_name,
+                                                                cache_key=get_embedding_key(model_name))
+    return _embeddings_by_model[model_name]
+
+def get_embedding_key(model_name='nomic-embed-text'):
+    """Model plus vector format, so cached vectors and indexes from an older format are never mixed in"""
+    return model_name if model_name == HASHING_EMBED_MODEL else f"{model_name}.{EMBEDDING_FORMAT}"
+
+def get_embedding_cache_stats(model_name='nomic-embed-text'):
+    if not isinstance(_embeddings_by_model.get(model_name), CachedEmbeddings):
+        return None
+    return _embeddings_by_model[model_name].get_stats()
 
 # Step 3: Build FAISS vectorstore
 def build_vectorstore(chunks, model_name='nomic-embed-text'):
-    embeddings = OllamaEmbeddings(model=model_name)
+    embeddings = get_embeddings(model_name)
     return FAISS.from_documents(chunks, embeddings)
 
-# Step 4: Setup Retrieval QA
-def setup_qa_chain(vectorstore, ollama_model='qwen:0.5b'):
+# Step 3b: Identify an inventory version by hashing its documents and the embedding model
+def compute_documents_hash(text_documents, model_name='nomic-embed-text'):
+    hasher = hashlib.sha256(get_embedding_key(model_name).encode('utf-8'))
+    for doc in text_documents:
+        hasher.update(b'\0')
+        hasher.update((doc['text'] if isinstance(doc, dict) else doc).encode('utf-8'))
+    return hasher.hexdigest()[:32]
+
+# Step 3c: One index per embedding model and document set (inventory version). An index never changes
+# once built, so sessions and tabs asking about different documents never re-sync or search each
+# other's vectors. A new version starts from a copy of the most recently used one, so its sync only
+# splits, embeds and indexes the resources that changed.
+def _prune_index_dirs(model_dir, keep):
+    """Delete persisted versions beyond VECTORSTORE_MAX_INDEXES, least recently used first"""
+    try:
+        version_dirs = [os.path.join(model_dir, name) for name in os.listdir(model_dir)]
+    except OSError:
+        return
+    version_dirs = sorted((path for path in version_dirs if os.path.isdir(path) and path not in keep),
+                          key=os.path.getmtime, reverse=True)
+    for path in version_dirs[max(0, VECTORSTORE_MAX_INDEXES - len(keep)):]:
+        shutil.rmtree(path, ignore_errors=True)
+
+def _seed_index_dir(model_dir, index_dir):
+    """Copy the newest complete index of the same model into index_dir; False if there is none"""
+    with _vector_indexes_lock:
+        busy = set(_building_index_dirs)
+    try:
+        sources = [os.path.join(model_dir, name) for name in os.listdir(model_dir)]
+    except OSError:
+        return False
+    sources = sorted((path for path in sources if path != index_dir and path not in busy
+                      and os.path.exists(os.path.join(path, 'manifest.json'))),
+                     key=os.path.getmtime, reverse=True)
+    for source in sources:
+        # Registered as in use, so pruning by another request doesn't delete it mid-copy
+        with _vector_indexes_lock:
+            _building_index_dirs.add(source)
+        try:
+            shutil.copytree(source, index_dir, dirs_exist_ok=True)
+            return True
+        except OSError:
+            shutil.rmtree(index_dir, ignore_errors=True)
+        finally:
+            with _vector_indexes_lock:
+                _building_index_dirs.discard(source)
+    return False
+
+def get_vector_index(text_documents, model_name='nomic-embed-text', cache_dir=VECTORSTORE_CACHE_DIR):
+    version = compute_documents_hash(text_documents, model_name)
+    model_dir = os.path.join(cache_dir, re.sub(r'[^A-Za-z0-9_.-]', '_', model_name))
+    index_key = (cache_dir, model_name, version)
+    index_dir = os.path.join(model_dir, version)
+
+    # Concurrent requests for the same version wait for one build instead of racing on it
+    with _vector_index_locks[int(version, 16) % len(_vector_index_locks)]:
+        with _vector_indexes_lock:
+            index = _vector_indexes.get(index_key)
+            _building_index_dirs.add(index_dir)
+        try:
+            if index is None:
+                if not os.path.exists(os.path.join(index_dir, 'manifest.json')):
+                    _seed_index_dir(model_dir, index_dir)
+                index = IncrementalVectorIndex(get_embeddings(model_name), index_dir)
+            if index.version != version or index.vectorstore is None:
+                index.sync(create_documents(text_documents), split_fn=split_documents, version=version)
+            elif os.path.isdir(index_dir):
+                os.utime(index_dir)  # Mark as recently used for pruning
+        finally:
+            with _vector_indexes_lock:
+                _building_index_dirs.discard(index_dir)
+
+    with _vector_indexes_lock:
+        _vector_indexes[index_key] = index
+        _vector_indexes.move_to_end(index_key)
+        same_model = [key for key in _vector_indexes if key[:2] == index_key[:2]]
+        for key in same_model[:max(0, len(same_model) - VECTORSTORE_MAX_INDEXES)]:
+            _lexical_indexes.pop(_vector_indexes.pop(key).index_dir, None)
+        kept_dirs = {_vector_indexes[key].index_dir for key in _vector_indexes if key[:2] == index_key[:2]}
+        kept_dirs |= _building_index_dirs
+    _prune_index_dirs(model_dir, kept_dirs)
+    return index
+
+def get_vectorstore(text_documents, model_name='nomic-embed-text', cache_dir=VECTORSTORE_CACHE_DIR):
+    return get_vector_index(text_documents, model_name, cache_dir).vectorstore
+
+# Step 3d: BM25 inverted index over the same chunks, rebuilt only when the inventory version changes
+def get_lexical_index(vector_index):
+    cached = _lexical_indexes.get(vector_index.index_dir)
+    if cached and cached[0] == vector_index.version:
+        return cached[1]
+    lexical_index = BM25Index(get_vectorstore_documents(vector_index.vectorstore))
+    _lexical_indexes[vector_index.index_dir] = (vector_index.version, lexical_index)
+    return lexical_index
+
+# Step 4: Setup Retrieval QA (hybrid BM25 + vector retrieval when a lexical index is available)
+def setup_retriever(vectorstore, lexical_index=None):
+    if lexical_index is not None:
+        return HybridRetriever(vectorstore=vectorstore, lexical_index=lexical_index)
+    return vectorstore.as_retriever()
+
+# Step 4b: Throwaway in-memory index for a small document set, kept out of the shared version cache
+def build_private_index(text_documents, model_name='nomic-embed-text'):
+    vectorstore = build_vectorstore(split_documents(create_documents(text_documents)), model_name)
+    return vectorstore, BM25Index(get_vectorstore_documents(vectorstore))
+
+def setup_qa_chain(vectorstore, ollama_model='qwen:0.5b', lexical_index=None):
     llm = Ollama(model=ollama_model)
-    return RetrievalQA.from_chain_type(llm=llm, retriever=vectorstore.as_retriever())
+    return RetrievalQA.from_chain_type(llm=llm, retriever=setup_retriever(vectorstore, lexical_index))
+
+# Per-call metrics: Ollama reports prompt_eval_count / eval_count with its final response
+class OllamaMetricsCallback(BaseCallbackHandler):
+    def __init__(self):
+        self.start_time = time.time()
+        self.first_token_seconds = None
+        self.prompts = []
+        self.answer = ''
+        self.generation_info = {}
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.start_time = time.time()
+        self.prompts = prompts
+
+    def on_llm_new_token(self, token, **kwargs):
+        if self.first_token_seconds is None:
+            self.first_token_seconds = time.time() - self.start_time
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                self.answer += generation.text
+                self.generation_info.update(generation.generation_info or {})
+
+    def record(self, llm_model, operation, query, prepare_seconds, error=None):
+        counter = get_token_counter()
+        reported = 'prompt_eval_count' in self.generation_info
+        query_metrics.record(
+            'Ollama', llm_model, operation,
+            query=query,
+            prepare_seconds=prepare_seconds,
+            first_token_seconds=self.first_token_seconds,
+            latency_seconds=time.time() - self.start_time,
+            input_tokens=self.generation_info['prompt_eval_count'] if reported else sum(counter.count(prompt) for prompt in self.prompts),
+            output_tokens=self.generation_info.get('eval_count', 0) if reported else counter.count(self.answer),
+            token_source='reported' if reported else 'estimated',
+            cost_usd=0.0,
+            success=error is None,
+            error=error
+        )
 
 # Step 5: Run query
 
-def query_aws_knowledgebase(query, text_documents, embed_model='nomic-embed-text', llm_model='qwen:0.5b'):
-    docs = create_documents(text_documents)
-    chunks = split_documents(docs)
-    vs = build_vectorstore(chunks, model_name=embed_model)
-    qa_chain = setup_qa_chain(vs, ollama_model=llm_model)
-    return qa_chain.run(query)
+def query_aws_knowledgebase(query, text_documents, embed_model='nomic-embed-text', llm_model='qwen:0.5b', persist=True):
+    start_time = time.time()
+    if persist:
+        index = get_vector_index(text_documents, model_name=embed_model)
+        vectorstore, lexical_index = index.vectorstore, get_lexical_index(index)
+    else:
+        vectorstore, lexical_index = build_private_index(text_documents, model_name=embed_model)
+    qa_chain = setup_qa_chain(vectorstore, ollama_model=llm_model, lexical_index=lexical_index)
+    metrics = OllamaMetricsCallback()
+    prepare_seconds = time.time() - start_time
+    try:
+        answer = qa_chain.run(query, callbacks=[metrics])
+    except Exception as e:
+        metrics.record(llm_model, 'query', query, prepare_seconds, error=str(e))
+        raise
+    # Retrieval inside the chain happens before the LLM starts, so count it as preparation
+    metrics.record(llm_model, 'query', query, metrics.start_time - start_time)
+    return answer
+
+# Step 5b: Stream the answer token by token (same retrieval and prompt as the RetrievalQA "stuff" chain)
+def stream_aws_knowledgebase(query, text_documents, embed_model='nomic-embed-text', llm_model='qwen:0.5b'):
+    start_time = time.time()
+    index = get_vector_index(text_documents, model_name=embed_model)
+    retriever = setup_retriever(index.vectorstore, lexical_index=get_lexical_index(index))
+    context = "\n\n".join(doc.page_content for doc in retriever.get_relevant_documents(query))
+    prompt = STUFF_PROMPT.format(context=context, question=query)
+    metrics = OllamaMetricsCallback()
+    prepare_seconds = time.time() - start_time
+    try:
+        for token in Ollama(model=llm_model).stream(prompt, config={'callbacks': [metrics]}):
+            yield token
+    except Exception as e:
+        metrics.record(llm_model, 'stream', query, prepare_seconds, error=str(e))
+        raise
+    metrics.record(llm_model, 'stream', query, prepare_seconds)
+
+# Step 5c: Answer a prompt that already holds all of its context, skipping chunking, embedding and retrieval
+def fits_ollama_context(prompt, num_ctx=OLLAMA_NUM_CTX):
+    return get_token_counter().count(prompt) + DIRECT_PROMPT_RESPONSE_TOKENS <= num_ctx
+
+def query_ollama_direct(prompt, llm_model='qwen:0.5b', query=None):
+    metrics = OllamaMetricsCallback()
+    try:
+        answer = Ollama(model=llm_model, num_ctx=OLLAMA_NUM_CTX).invoke(prompt, config={'callbacks': [metrics]})
+    except Exception as e:
+        metrics.record(llm_model, 'direct', query or prompt, 0.0, error=str(e))
+        raise
+    metrics.record(llm_model, 'direct', query or prompt, 0.0)
+    return answer
 
 # Example usage:
-# from aws_collector import collect_selected_services, format_data_for_llm
+# from aws_collector import collect_selected_services
+# from modules.resource_chunker import chunk_aws_data
 # services = ['EC2', 'IAM']
 # data = collect_selected_services(services)
-# docs = format_data_for_llm(data)
+# docs = chunk_aws_data(data)
 # print(query_aws_knowledgebase("How many EC2 instances are running?", docs))
@@ -3,6 +3,8 @@ import plotly.express as px
 import json
 import os
 import tempfile
+import time
+from itertools import chain
 from pathlib import Path
 from datetime import datetime
 
@@ -26,11 +28,21 @@ from modules.aws_data_manager import collect_aws_data, get_aws_services_list, ge
 from modules.bedrock_manager import get_available_bedrock_models, get_aws_cli_region, check_aws_cli_available, get_aws_profiles, test_aws_profile_connection
 from modules.ollama_manager import get_ollama_models, is_ollama_available
 from modules.theme_manager import apply_theme
-from modules.bedrock_query_engine import query_bedrock_model, test_bedrock_connection
-from modules.resource_interaction_manager import resource_manager
+from modules.bedrock_query_engine import query_bedrock_model, stream_bedrock_model, test_bedrock_connection, estimate_tokens, create_bedrock_runtime
+from modules.batch_questions import DEFAULT_REPORT_QUESTIONS, run_question_batch, format_report
+from modules.bedrock_models import get_model_adapter
+from modules.bedrock_invoker import bedrock_invoker
+from modules.bedrock_router import region_balancer
+from modules.query_metrics import query_metrics
+from modules.resource_interaction_manager import resource_manager, FAN_OUT_AUTO_THRESHOLD, COMPARISON_QUESTION
 from modules.complex_query_processor import complex_query_processor
+from modules.query_router import query_router
 from modules.dynamic_query_engine import dynamic_query_engine
-from qa_engine import query_aws_knowledgebase
+from modules.resource_chunker import chunk_aws_data
+from qa_engine import query_aws_knowledgebase, stream_aws_knowledgebase, get_embedding_cache_stats, fits_ollama_context, query_ollama_direct
+from modules.answer_cache import answer_cache, compute_inventory_version
+from modules.inventory_summary import get_inventory_summary, summary_levels
+from modules.hashing_embeddings import HASHING_EMBED_MODEL
 
 # Page configuration
 st.set_page_config(page_title="AI Infra Explainer", layout="wide")
@@ -46,6 +58,7 @@ llm_provider = st.sidebar.radio("Select LLM Provider", ["Ollama", "Bedrock"])
 
 # --- Ollama Configuration ---
 ollama_model = None
+ollama_embed_model = 'nomic-embed-text'
 if llm_provider == "Ollama":
     with st.sidebar.expander("🔧 Ollama Configuration"):
         if is_ollama_available():
@@ -58,6 +71,28 @@ if llm_provider == "Ollama":
         else:
             st.warning("Ollama not found. Please install Ollama first.")
             ollama_model = st.text_input("Enter Model Name", key="custom_ollama")
+        
+        # Embedding backend used to index the inventory
+        embed_options = ["nomic-embed-text", HASHING_EMBED_MODEL, "Other"]
+        selected_embed_model = st.selectbox(
+            "Select Embedding Model",
+            embed_options,
+            key="ollama_embed_model",
+            help=f"'{HASHING_EMBED_MODEL}' computes embeddings in-process with no model server - fastest for large inventories."
+        )
+        if selected_embed_model == "Other":
+            ollama_embed_model = st.text_input("Enter Embedding Model Name", value="nomic-embed-text", key="custom_ollama_embed")
+        else:
+            ollama_embed_model = selected_embed_model
+        
+        # Embedding cache effectiveness for the current session
+        embed_cache_stats = get_embedding_cache_stats(ollama_embed_model)
+        if embed_cache_stats and embed_cache_stats['hits'] + embed_cache_stats['misses']:
+            st.caption(
+                f"🗄️ Embedding cache: {embed_cache_stats['hit_rate']:.0%} hit rate "
+                f"({embed_cache_stats['hits']:,} reused / {embed_cache_stats['misses']:,} embedded), "
+                f"~{embed_cache_stats['estimated_seconds_saved']:.1f}s saved"
+            )
 
 # --- Bedrock Configuration ---
 bedrock_model = None
@@ -146,10 +181,27 @@ if llm_provider == "Bedrock":
                 value=False,
                 help="Shows debug information for Bedrock responses"
             )
+            map_reduce = st.checkbox(
+                "Analyze the whole inventory (map-reduce)",
+                value=False,
+                help="When the collected data exceeds the model's context window, query it in batches "
+                     "concurrently and merge the partial answers instead of sending only the most relevant resources"
+            )
+            bedrock_failover_targets = st.text_input(
+                "Additional regions / inference profiles",
+                value="",
+                placeholder="us-west-2, eu-central-1",
+                help="Comma-separated regions or inference profile IDs/ARNs. Requests are balanced across these and "
+                     "the region above by measured latency and free capacity, and fail over when one is throttled"
+            )
         
         # Store these in session state to make them available outside the expander
         st.session_state["skip_access_verification"] = skip_access_verification
         st.session_state["debug_mode"] = debug_mode
+        st.session_state["map_reduce"] = map_reduce
+        st.session_state["bedrock_regions"] = [
+            entry.strip() for entry in bedrock_failover_targets.split(',') if entry.strip()
+        ]
         
         # Information about inference profiles
         st.info("💡 **Tip**: Some newer models (like Claude 3.5 Sonnet) require inference profiles instead of direct model IDs. Enable 'Skip Access Verification' if you have issues.")
@@ -232,7 +284,14 @@ if llm_provider == "Bedrock":
                 bedrock_model = st.text_input("Enter Bedrock Model ID", key="custom_bedrock_default")
             else:
                 bedrock_model = selected_model
-        
+
+        if bedrock_model:
+            model_adapter = get_model_adapter(bedrock_model)
+            st.caption(f"Context window: {model_adapter.context_window:,} tokens · "
+                       f"max output: {model_adapter.max_output_tokens:,} · "
+                       f"${model_adapter.input_price_per_1k:g} / ${model_adapter.output_price_per_1k:g} per 1K input/output tokens"
+                       + (" · prompt caching" if model_adapter.prompt_caching else ""))
+
         # Test Bedrock connection
         if bedrock_model and st.button("🔧 Test Bedrock Connection", key="test_bedrock"):
             with st.spinner("Testing Bedrock connection..."):
@@ -278,12 +337,149 @@ with st.sidebar.expander("🔧 Advanced: Collect All Data"):
         else:
             st.error("Please select at least one AWS service")
 
+# --- Response Options ---
+st.session_state["stream_responses"] = st.sidebar.checkbox(
+    "Stream AI responses", value=True,
+    help="Show the answer as it is generated instead of waiting for the complete response"
+)
+
+with st.sidebar.expander("⚡ Answer Cache"):
+    st.session_state["answer_cache_enabled"] = st.checkbox(
+        "Reuse answers to repeated questions", value=True,
+        help="Answers are keyed by question, provider, model and the collected data they were generated from"
+    )
+    st.session_state["answer_cache_similar"] = st.checkbox(
+        "Match similar questions", value=False,
+        help="Also reuse an answer when a question differs only in word order or filler words"
+    )
+    cache_stats = answer_cache.stats
+    st.caption(f"{len(answer_cache)} answers cached · {cache_stats['hits']} exact / "
+               f"{cache_stats['similar_hits']} similar hits · {cache_stats['misses']} misses")
+    prompt_cache_stats = st.session_state.get("prompt_cache_stats")
+    if prompt_cache_stats:
+        st.caption(f"Bedrock prompt cache: {prompt_cache_stats['hits']} hits / {prompt_cache_stats['misses']} misses · "
+                   f"{prompt_cache_stats['cache_read_tokens']:,} tokens read from cache "
+                   f"(~${prompt_cache_stats['saved_usd']:.4f} saved)")
+    if st.button("🗑️ Clear Answer Cache", key="clear_answer_cache"):
+        answer_cache.clear()
+        st.success("Answer cache cleared")
+
+if llm_provider == "Bedrock":
+    with st.sidebar.expander("🚦 Bedrock Throughput"):
+        invoker_stats = bedrock_invoker.stats
+        if not invoker_stats:
+            st.caption("No Bedrock requests yet")
+        for model_id, model_stats in invoker_stats.items():
+            st.caption(f"**{model_id}**: {model_stats['in_flight']}/{model_stats['limit']} in flight · "
+                       f"{model_stats['waiting']} queued · {model_stats['requests']} requests, "
+                       f"{model_stats['throttled']} throttled · queue wait avg {model_stats['avg_queue_wait']:.2f}s "
+                       f"/ max {model_stats['max_queue_wait']:.1f}s")
+        for target_key, target_stats in region_balancer.stats.items():
+            latency = f"{target_stats['latency']:.1f}s" if target_stats['latency'] is not None else "not measured"
+            cooldown = f" · cooling down {target_stats['cooldown_seconds']:.0f}s" if target_stats['cooldown_seconds'] else ""
+            st.caption(f"🌍 {target_key}: latency {latency}{cooldown}")
+
+
+def ask_llm(query, text_documents, resource_documents=None, heading="### 🎯 AI Analysis Results"):
+    """Answer a query with the configured LLM provider and render it under heading.
+
+    Ollama retrieves from resource_documents (per-resource chunks) when given; Bedrock packs the
+    compact table documents in text_documents and uses the chunks for the inventory summary.
+    Repeated questions are served from the answer cache; otherwise the answer is streamed as it
+    is generated when streaming is enabled.
+    """
+    if llm_provider == "Ollama" and ollama_model:
+        documents = resource_documents if resource_documents is not None else text_documents
+        model_key = f"{ollama_model}|{ollama_embed_model}"
+    elif llm_provider == "Bedrock" and bedrock_model:
+        documents = text_documents
+        model_key = f"{bedrock_model}|map-reduce" if st.session_state.get("map_reduce", False) else bedrock_model
+    else:
+        st.error("Please configure your LLM provider first")
+        return None
+
+    use_cache = st.session_state.get("answer_cache_enabled", True)
+    inventory_version = compute_inventory_version(documents)
+    if use_cache:
+        cached = answer_cache.get(query, llm_provider, model_key, inventory_version,
+                                  allow_similar=st.session_state.get("answer_cache_similar", False))
+        if cached:
+            match = "same question" if cached['match'] == 'exact' else f"similar question: \"{cached['query']}\""
+            st.markdown(heading)
+            st.caption(f"⚡ Cached answer ({match}, {int(cached['age_seconds'])}s old)")
+            st.write(cached['answer'])
+            return cached['answer']
+
+    if llm_provider == "Ollama":
+        llm_function = stream_aws_knowledgebase if st.session_state.get("stream_responses", True) else query_aws_knowledgebase
+        result = llm_function(
+            query,
+            documents,
+            embed_model=ollama_embed_model,
+            llm_model=ollama_model
+        )
+    else:
+        llm_function = stream_bedrock_model if st.session_state.get("stream_responses", True) else query_bedrock_model
+        result = llm_function(
+            query=query,
+            text_documents=documents,
+            model_id=bedrock_model,
+            aws_access_key=aws_access_key,
+            aws_secret_key=aws_secret_key,
+            aws_region=aws_region,
+            use_cli_creds=use_cli_creds,
+            debug=st.session_state.get("debug_mode", False),
+            aws_profile=aws_profile,
+            inventory_summary=get_inventory_summary(resource_documents) if resource_documents else None,
+            map_reduce=st.session_state.get("map_reduce", False),
+            regions=st.session_state.get("bedrock_regions")
+        )
+
+    if isinstance(result, str) or result is None:
+        response = result
+        if response:
+            st.markdown(heading)
+            st.write(response)
+    else:
+        # Wait for the first fragment so errors are reported without an empty results section
+        start_time = time.time()
+        first_token = next(result, None)
+        if first_token is None:
+            return None
+        first_token_seconds = time.time() - start_time
+        st.markdown(heading)
+        response = st.write_stream(chain([first_token], result))
+        st.caption(f"First token after {first_token_seconds:.1f}s · complete after {time.time() - start_time:.1f}s")
+
+    if llm_provider == "Bedrock" and bedrock_invoker.last_queue_wait() >= 0.5:
+        st.caption(f"🚦 Waited {bedrock_invoker.last_queue_wait():.1f}s in the Bedrock queue")
+
+    if use_cache and response:
+        answer_cache.put(query, llm_provider, model_key, inventory_version, response)
+    return response
+
+def show_routed_answer(route, seconds):
+    """Render an answer the query router produced from the data, without calling the LLM"""
+    st.markdown("### 📋 Structured Results")
+    confidence = f", confidence {route['confidence']:.2f}" if 'confidence' in route else ''
+    st.caption(f"⚡ Answered directly from the collected data in {seconds * 1000:.0f} ms ({route['reason']}{confidence}). "
+               f"Tick \"Always ask the AI\" for a narrative answer.")
+    st.markdown(query_router.format_results_for_display(route['results']))
+    
+    summary = route['results'].get('summary')
+    if isinstance(summary, dict) and summary:
+        st.markdown("### 📈 Summary")
+        summary_cols = st.columns(len(summary))
+        for i, (key, value) in enumerate(summary.items()):
+            with summary_cols[i]:
+                st.metric(key.replace('_', ' ').title(), value)
+
 # --- Main Content Area ---
 col1, col2 = st.columns([2, 1])
 
 with col1:
     # Add tabs for different interaction modes
-    tab1, tab2, tab3, tab4 = st.tabs(["🧠 Smart Query", "🔍 General Query", "📊 Complex Queries", "🎯 Resource Interaction"])
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["🧠 Smart Query", "🔍 General Query", "📊 Complex Queries", "🎯 Resource Interaction", "📈 Metrics"])
     
     with tab1:
         st.markdown("### 🧠 Smart Query Engine")
@@ -346,6 +542,9 @@ with col1:
                             st.session_state["smart_query"] = suggestion
                             st.rerun()
         
+        smart_force_llm = st.checkbox("🤖 Always ask the AI", key="smart_force_llm",
+                                      help="Skip answering list/count questions directly from the data")
+        
         # Query execution buttons
         col_smart1, col_smart2 = st.columns([1, 1])
         
@@ -360,23 +559,12 @@ with col1:
                             # Collect only required data
                             targeted_data = dynamic_query_engine.collect_targeted_data(smart_query, query_aws_profile)
                             
-                            # First try complex query processing
-                            complex_results = complex_query_processor.process_complex_query(smart_query, targeted_data)
+                            # Answer list/count and structured questions from the data; the LLM handles the rest
+                            route_start = time.time()
+                            route = query_router.route(smart_query, targeted_data) if not smart_force_llm else None
                             
-                            if complex_results['type'] != 'general':
-                                st.markdown("### 📋 Structured Results")
-                                formatted_results = complex_query_processor.format_results_for_display(complex_results)
-                                st.markdown(formatted_results)
-                                
-                                # Show summary
-                                if 'summary' in complex_results:
-                                    st.markdown("### 📈 Summary")
-                                    summary = complex_results['summary']
-                                    if isinstance(summary, dict):
-                                        summary_cols = st.columns(len(summary))
-                                        for i, (key, value) in enumerate(summary.items()):
-                                            with summary_cols[i]:
-                                                st.metric(key.replace('_', ' ').title(), value)
+                            if query_router.answers_from_data(route):
+                                show_routed_answer(route, time.time() - route_start)
                             else:
                                 # Fall back to AI analysis
                                 from aws_collector import format_data_for_llm
@@ -388,45 +576,14 @@ with col1:
                                 
                                 with st.expander("🔍 Context Preview (First 1000 chars)"):
                                     for i, doc in enumerate(text_documents[:1]):  # Show first document only
-                                        st.code(doc[:1000] + "..." if len(doc) > 1000 else doc, language="json")
+                                        st.code(doc[:1000] + "..." if len(doc) > 1000 else doc, language="text")
                                 
                                 # Query AI
-                                if llm_provider == "Ollama" and ollama_model:
-                                    response = query_aws_knowledgebase(
-                                        smart_query,
-                                        text_documents,
-                                        embed_model='nomic-embed-text',
-                                        llm_model=ollama_model
-                                    )
-                                elif llm_provider == "Bedrock" and bedrock_model:
-                                    if use_cli_creds:
-                                        response = query_bedrock_model(
-                                            query=smart_query,
-                                            text_documents=text_documents,
-                                            model_id=bedrock_model,
-                                            aws_region=aws_region,
-                                            use_cli_creds=True,
-                                            debug=st.session_state.get("debug_mode", False),
-                                            aws_profile=aws_profile
-                                        )
-                                    else:
-                                        response = query_bedrock_model(
-                                            query=smart_query,
-                                            text_documents=text_documents,
-                                            model_id=bedrock_model,
-                                            aws_access_key=aws_access_key,
-                                            aws_secret_key=aws_secret_key,
-                                            aws_region=aws_region,
-                                            use_cli_creds=False,
-                                            debug=st.session_state.get("debug_mode", False),
-                                            aws_profile=aws_profile
-                                        )
-                                else:
-                                    response = "Please configure your LLM provider first"
-                                
-                                if response:
-                                    st.markdown("### 🎯 AI Analysis Results")
-                                    st.write(response)
+                                ask_llm(
+                                    smart_query,
+                                    text_documents,
+                                    resource_documents=chunk_aws_data(targeted_data)
+                                )
                             
                             # Show collected data summary
                             with st.expander("📊 Data Collection Summary"):
@@ -471,6 +628,7 @@ with col1:
             - **Analyzes your question** to determine which AWS services are needed
             - **Fetches only relevant data** (no context overload!)
             - **Processes queries faster** with smaller datasets
+            - **Answers list/count questions instantly** from the data, without waiting for the AI
             - **Reduces API calls** and improves performance
             - **Works without pre-collecting data**
             
@@ -497,17 +655,17 @@ with col1:
                 from aws_collector import format_data_for_llm
                 text_documents = format_data_for_llm(st.session_state["aws_raw_data"])
                 
-                # Estimate context size
-                total_chars = sum(len(doc) for doc in text_documents)
-                estimated_tokens = total_chars // 4  # Rough estimation
-            
-            if estimated_tokens > 10000:
-                st.warning(f"⚠️ **Large context detected** (~{estimated_tokens:,} tokens). If you get 'Input too long' errors, try:")
-                st.info("• Ask more specific questions • Enable debug mode • Use fewer AWS services")
-            elif estimated_tokens > 5000:
-                st.info(f"📊 Context size: ~{estimated_tokens:,} tokens (moderate)")
-            else:
-                st.success(f"📊 Context size: ~{estimated_tokens:,} tokens (small)")
+                # Estimate context size against the selected model's input budget
+                estimated_tokens = sum(estimate_tokens(doc, bedrock_model) for doc in text_documents)
+                input_budget = get_model_adapter(bedrock_model or "").input_token_budget
+                
+                if estimated_tokens > input_budget:
+                    st.warning(f"⚠️ **Large context detected** (~{estimated_tokens:,} tokens, model budget {input_budget:,}). Only part of it will be sent; for complete answers try:")
+                    st.info("• Ask more specific questions • Enable debug mode • Use fewer AWS services")
+                elif estimated_tokens > input_budget // 2:
+                    st.info(f"📊 Context size: ~{estimated_tokens:,} of {input_budget:,} tokens (moderate)")
+                else:
+                    st.success(f"📊 Context size: ~{estimated_tokens:,} of {input_budget:,} tokens (small)")
         
         query = st.text_area(
             "Ask a question about your AWS infrastructure:",
@@ -520,71 +678,47 @@ with col1:
             col_query, col_test = st.columns([3, 1])
             with col_test:
                 if st.button("🔍 Test Context", help="Check if your query will fit within model limits"):
-                    from modules.bedrock_query_engine import estimate_tokens
-                    
                     # Get fresh text documents
                     from aws_collector import format_data_for_llm
                     text_documents = format_data_for_llm(st.session_state["aws_raw_data"])
                     
                     # Estimate tokens
-                    context_tokens = sum(estimate_tokens(doc) for doc in text_documents)
-                    query_tokens = estimate_tokens(query)
+                    context_tokens = sum(estimate_tokens(doc, bedrock_model) for doc in text_documents)
+                    query_tokens = estimate_tokens(query, bedrock_model)
                     total_tokens = context_tokens + query_tokens + 1000  # Buffer
+                    input_budget = get_model_adapter(bedrock_model or "").input_token_budget
                     
-                    if total_tokens > 8000:
+                    if total_tokens > input_budget:
                         st.error(f"❌ Likely too large ({total_tokens:,} tokens). Try a shorter query or fewer services.")
                     else:
                         st.success(f"✅ Should fit ({total_tokens:,} tokens estimated)")
         
+        general_force_llm = st.checkbox("🤖 Always ask the AI", key="general_force_llm",
+                                        help="Skip answering list/count questions directly from the data")
+        
         if st.button("🤖 Get AI Analysis"):
             if query:
-                with st.spinner("Analyzing your infrastructure..."):
-                    try:
-                        # Format data for LLM
-                        from aws_collector import format_data_for_llm
-                        text_documents = format_data_for_llm(st.session_state["aws_raw_data"])
-                        
-                        # Query the knowledge base
-                        if llm_provider == "Ollama" and ollama_model:
-                            response = query_aws_knowledgebase(
-                                query, 
-                                text_documents, 
-                                embed_model='nomic-embed-text',
-                                llm_model=ollama_model
+                route_start = time.time()
+                route = None
+                if not general_force_llm and "aws_raw_data" in st.session_state:
+                    route = query_router.route(query, st.session_state["aws_raw_data"])
+                if query_router.answers_from_data(route):
+                    show_routed_answer(route, time.time() - route_start)
+                else:
+                    with st.spinner("Analyzing your infrastructure..."):
+                        try:
+                            # Format data for LLM
+                            from aws_collector import format_data_for_llm
+                            text_documents = format_data_for_llm(st.session_state["aws_raw_data"])
+                            
+                            # Query the knowledge base
+                            ask_llm(
+                                query,
+                                text_documents,
+                                resource_documents=chunk_aws_data(st.session_state["aws_raw_data"])
                             )
-                        elif llm_provider == "Bedrock" and bedrock_model:
-                            # Use Bedrock for querying
-                            if use_cli_creds:
-                                response = query_bedrock_model(
-                                    query=query,
-                                    text_documents=text_documents,
-                                    model_id=bedrock_model,
-                                    aws_region=aws_region,
-                                    use_cli_creds=True,
-                                    debug=st.session_state.get("debug_mode", False),
-                                    aws_profile=aws_profile
-                                )
-                            else:
-                                response = query_bedrock_model(
-                                    query=query,
-                                    text_documents=text_documents,
-                                    model_id=bedrock_model,
-                                    aws_access_key=aws_access_key,
-                                    aws_secret_key=aws_secret_key,
-                                    aws_region=aws_region,
-                                    use_cli_creds=False,
-                                    debug=st.session_state.get("debug_mode", False),
-                                    aws_profile=aws_profile
-                                )
-                        else:
-                            st.error("Please configure your LLM provider first")
-                            response = None
-                        
-                        if response:
-                            st.markdown("### 🎯 AI Analysis Results")
-                            st.write(response)                            
-                    except Exception as e:
-                        st.error(f"Error during analysis: {str(e)}")
+                        except Exception as e:
+                            st.error(f"Error during analysis: {str(e)}")
             else:
                 st.error("Please enter a query")
         else:
@@ -800,43 +934,13 @@ Please provide additional insights, recommendations, and explanations about thes
 4. Best practices related to these findings"""
                                     
                                     # Query AI with structured results
-                                    if llm_provider == "Ollama" and ollama_model:
-                                        ai_response = query_aws_knowledgebase(
-                                            ai_prompt,
-                                            [formatted_results],
-                                            embed_model='nomic-embed-text',
-                                            llm_model=ollama_model
-                                        )
-                                    elif llm_provider == "Bedrock" and bedrock_model:
-                                        if use_cli_creds:
-                                            ai_response = query_bedrock_model(
-                                                query=ai_prompt,
-                                                text_documents=[formatted_results],
-                                                model_id=bedrock_model,
-                                                aws_region=aws_region,
-                                                use_cli_creds=True,
-                                                debug=st.session_state.get("debug_mode", False),
-                                                aws_profile=aws_profile
-                                            )
-                                        else:
-                                            ai_response = query_bedrock_model(
-                                                query=ai_prompt,
-                                                text_documents=[formatted_results],
-                                                model_id=bedrock_model,
-                                                aws_access_key=aws_access_key,
-                                                aws_secret_key=aws_secret_key,
-                                                aws_region=aws_region,
-                                                use_cli_creds=False,
-                                                debug=st.session_state.get("debug_mode", False),
-                                                aws_profile=aws_profile
-                                            )
-                                    else:
-                                        ai_response = "Please configure your LLM provider first"
+                                    ai_response = ask_llm(
+                                        ai_prompt,
+                                        [formatted_results],
+                                        heading="### 🎯 AI Analysis & Recommendations"
+                                    )
                                     
                                     if ai_response:
-                                        st.markdown("### 🎯 AI Analysis & Recommendations")
-                                        st.write(ai_response)
-                                        
                                         # Also show structured results
                                         with st.expander("📋 Structured Data"):
                                             st.markdown(formatted_results)
@@ -845,42 +949,11 @@ Please provide additional insights, recommendations, and explanations about thes
                                     from aws_collector import format_data_for_llm
                                     text_documents = format_data_for_llm(st.session_state["aws_raw_data"])
                                     
-                                    if llm_provider == "Ollama" and ollama_model:
-                                        ai_response = query_aws_knowledgebase(
-                                            complex_query,
-                                            text_documents,
-                                            embed_model='nomic-embed-text',
-                                            llm_model=ollama_model
-                                        )
-                                    elif llm_provider == "Bedrock" and bedrock_model:
-                                        if use_cli_creds:
-                                            ai_response = query_bedrock_model(
-                                                query=complex_query,
-                                                text_documents=text_documents,
-                                                model_id=bedrock_model,
-                                                aws_region=aws_region,
-                                                use_cli_creds=True,
-                                                debug=st.session_state.get("debug_mode", False),
-                                                aws_profile=aws_profile
-                                            )
-                                        else:
-                                            ai_response = query_bedrock_model(
-                                                query=complex_query,
-                                                text_documents=text_documents,
-                                                model_id=bedrock_model,
-                                                aws_access_key=aws_access_key,
-                                                aws_secret_key=aws_secret_key,
-                                                aws_region=aws_region,
-                                                use_cli_creds=False,
-                                                debug=st.session_state.get("debug_mode", False),
-                                                aws_profile=aws_profile
-                                            )
-                                    else:
-                                        ai_response = "Please configure your LLM provider first"
-                                    
-                                    if ai_response:
-                                        st.markdown("### 🎯 AI Analysis Results")
-                                        st.write(ai_response)
+                                    ask_llm(
+                                        complex_query,
+                                        text_documents,
+                                        resource_documents=chunk_aws_data(st.session_state["aws_raw_data"])
+                                    )
                                         
                             except Exception as e:
                                 st.error(f"Error during AI analysis: {str(e)}")
@@ -1031,6 +1104,20 @@ Please provide additional insights, recommendations, and explanations about thes
                     # Update session state
                     st.session_state["resource_query"] = resource_query
                     
+                    # Large selections are analyzed per resource (or small group) in parallel calls
+                    fan_out = st.checkbox(
+                        "🔀 Analyze each resource separately",
+                        value=len(selected_resources) > FAN_OUT_AUTO_THRESHOLD,
+                        help="One LLM call per resource group, run in parallel, instead of one prompt with every resource"
+                    )
+                    if fan_out:
+                        col_group, col_synth = st.columns(2)
+                        with col_group:
+                            fan_out_group_size = st.number_input("Resources per call", min_value=1, max_value=10, value=1)
+                        with col_synth:
+                            fan_out_synthesis = st.checkbox("🧩 Combine into one summary", value=True,
+                                                            help="One final call that merges the per-resource findings")
+                    
                     # Query button
                     col_analyze, col_compare = st.columns([1, 1])
                     
@@ -1042,37 +1129,74 @@ Please provide additional insights, recommendations, and explanations about thes
                                         # Prepare model configuration
                                         model_config = {
                                             'model_name': ollama_model,
+                                            'embed_model': ollama_embed_model,
                                             'model_id': bedrock_model,
                                             'aws_region': aws_region,
                                             'aws_access_key': aws_access_key,
                                             'aws_secret_key': aws_secret_key,
                                             'use_cli_creds': use_cli_creds if llm_provider == "Bedrock" else False,
                                             'debug': st.session_state.get("debug_mode", False),
-                                            'aws_profile': aws_profile if llm_provider == "Bedrock" else None
+                                            'aws_profile': aws_profile if llm_provider == "Bedrock" else None,
+                                            'regions': st.session_state.get("bedrock_regions") if llm_provider == "Bedrock" else None
                                         }
                                         
-                                        # Query selected resources
-                                        response = resource_manager.query_resources(
-                                            resource_query,
-                                            selected_resources,
-                                            st.session_state["aws_raw_data"],
-                                            llm_provider,
-                                            model_config
-                                        )
-                                        
-                                        if response:
+                                        if fan_out:
+                                            groups = resource_manager.group_selected_resources(selected_resources, fan_out_group_size)
                                             st.markdown("### 🎯 Resource Analysis Results")
-                                            st.write(response)
+                                            fan_out_progress = st.progress(0.0, text=f"Analyzing {len(groups)} resource groups...")
+                                            fan_out_results = []
+                                            for result in resource_manager.analyze_resources_concurrently(
+                                                resource_query,
+                                                selected_resources,
+                                                st.session_state["aws_raw_data"],
+                                                llm_provider,
+                                                model_config,
+                                                group_size=fan_out_group_size
+                                            ):
+                                                fan_out_results.append(result)
+                                                fan_out_progress.progress(len(fan_out_results) / len(groups),
+                                                                          text=f"Analyzed {len(fan_out_results)} of {len(groups)} resource groups")
+                                                status = "✅" if result['answer'] else "❌"
+                                                with st.expander(f"{status} {', '.join(result['labels'])} ({result['seconds']:.1f}s)",
+                                                                 expanded=len(groups) <= 3):
+                                                    if result['answer']:
+                                                        st.write(result['answer'])
+                                                    else:
+                                                        st.error(f"Analysis failed: {result['error']}")
+                                            fan_out_progress.empty()
+                                            failed = sum(1 for result in fan_out_results if not result['answer'])
+                                            if failed:
+                                                st.warning(f"{failed} of {len(groups)} resource groups could not be analyzed")
                                             
-                                            # Show selected resources context
-                                            with st.expander("📋 Selected Resources Context"):
-                                                context = resource_manager.create_resource_context(
-                                                    selected_resources, 
-                                                    st.session_state["aws_raw_data"]
-                                                )
-                                                st.code(context, language="json")
+                                            if fan_out_synthesis and len(groups) > 1 and failed < len(groups):
+                                                with st.spinner("Combining the findings..."):
+                                                    st.markdown("### 🧩 Combined Analysis")
+                                                    st.write(resource_manager.synthesize_resource_analyses(
+                                                        resource_query, fan_out_results, llm_provider, model_config
+                                                    ))
                                         else:
-                                            st.error("No response received from AI model")
+                                            # Query selected resources
+                                            response = resource_manager.query_resources(
+                                                resource_query,
+                                                selected_resources,
+                                                st.session_state["aws_raw_data"],
+                                                llm_provider,
+                                                model_config
+                                            )
+                                        
+                                            if response:
+                                                st.markdown("### 🎯 Resource Analysis Results")
+                                                st.write(response)
+                                            
+                                                # Show selected resources context
+                                                with st.expander("📋 Selected Resources Context"):
+                                                    context = resource_manager.create_resource_context(
+                                                        selected_resources, 
+                                                        st.session_state["aws_raw_data"]
+                                                    )
+                                                    st.code(context, language="text")
+                                            else:
+                                                st.error("No response received from AI model")
                                             
                                     except Exception as e:
                                         st.error(f"Error during resource analysis: {str(e)}")
@@ -1080,23 +1204,29 @@ Please provide additional insights, recommendations, and explanations about thes
                                 st.error("Please enter a question about the selected resources")
                     
                     with col_compare:
-                        if st.button("⚖️ Compare Resources") and len(selected_resources) == 2:
-                            # Compare exactly 2 resources
-                            service1, resource_type1, index1 = selected_resources[0]
-                            service2, resource_type2, index2 = selected_resources[1]
+                        if st.button("⚖️ Compare Resources") and len(selected_resources) >= 2:
+                            # Compare two or more resources of one type
+                            compare_types = {(service, resource_type) for service, resource_type, _ in selected_resources}
                             
-                            if resource_type1 == resource_type2:
+                            if len(compare_types) == 1:
                                 with st.spinner("Comparing resources..."):
                                     try:
                                         resources_data = resource_manager.extract_individual_resources(st.session_state["aws_raw_data"])
-                                        resource1 = resources_data[service1][resource_type1][index1]
-                                        resource2 = resources_data[service2][resource_type2][index2]
+                                        compared = [resources_data[service][resource_type][index]
+                                                    for service, resource_type, index in selected_resources]
+                                        resource_type1 = selected_resources[0][1]
                                         
-                                        comparison_context = resource_manager.compare_resources(resource1, resource2, resource_type1)
+                                        # Only the differing fields go to the model
+                                        comparison_context = resource_manager.compare_resource_set(compared, resource_type1)
+                                        full_tokens = estimate_tokens(json.dumps(compared, indent=2, default=str), bedrock_model)
+                                        diff_tokens = estimate_tokens(comparison_context, bedrock_model)
+                                        with st.expander(f"🧮 Structured Diff (~{diff_tokens:,} tokens instead of ~{full_tokens:,})"):
+                                            st.code(comparison_context, language="text")
                                         
                                         # Prepare model configuration
                                         model_config = {
                                             'model_name': ollama_model,
+                                            'embed_model': ollama_embed_model,
                                             'model_id': bedrock_model,
                                             'aws_region': aws_region,
                                             'aws_access_key': aws_access_key,
@@ -1107,16 +1237,18 @@ Please provide additional insights, recommendations, and explanations about thes
                                         }
                                         
                                         # Query for comparison
-                                        if llm_provider == "Ollama":
+                                        if llm_provider == "Ollama" and fits_ollama_context(comparison_context):
+                                            response = query_ollama_direct(comparison_context, llm_model=model_config.get('model_name'))
+                                        elif llm_provider == "Ollama":
                                             response = query_aws_knowledgebase(
-                                                comparison_context,
+                                                COMPARISON_QUESTION,
                                                 [comparison_context],
-                                                embed_model='nomic-embed-text',
+                                                embed_model=ollama_embed_model,
                                                 llm_model=model_config.get('model_name')
                                             )
                                         elif llm_provider == "Bedrock":
                                             response = query_bedrock_model(
-                                                query=comparison_context,
+                                                query=COMPARISON_QUESTION,
                                                 text_documents=[comparison_context],
                                                 model_id=model_config.get('model_id'),
                                                 aws_region=model_config.get('aws_region'),
@@ -1137,14 +1269,74 @@ Please provide additional insights, recommendations, and explanations about thes
                                         st.error(f"Error during comparison: {str(e)}")
                             else:
                                 st.error("Resources must be of the same type to compare")
-                        elif len(selected_resources) != 2:
-                            st.info("Select exactly 2 resources to compare")
+                        elif len(selected_resources) < 2:
+                            st.info("Select 2 or more resources of one type to compare")
                 else:
                     st.info("👆 Select resources above to interact with them")
             else:
                 st.info("No resources found in collected data")
         else:
             st.info("👆 Please collect AWS data first to interact with resources")
+    
+    with tab5:
+        st.markdown("### 📈 LLM Call Metrics")
+        st.markdown("Latency, token usage and cost of every model call, to see where query time and spend go.")
+        
+        metrics_windows = {"Last hour": 3600, "Last 24 hours": 86400, "Last 7 days": 7 * 86400, "All time": None}
+        col_window, col_provider = st.columns(2)
+        with col_window:
+            metrics_window = st.selectbox("Time window", list(metrics_windows), index=1)
+        with col_provider:
+            metrics_provider = st.selectbox("Provider", ["All", "Bedrock", "Ollama"])
+        window_seconds = metrics_windows[metrics_window]
+        metrics_since = time.time() - window_seconds if window_seconds else None
+        metrics_provider = None if metrics_provider == "All" else metrics_provider
+        
+        metrics_calls = query_metrics.calls(metrics_since, metrics_provider)
+        if metrics_calls:
+            import pandas as pd
+            successful_calls = [call for call in metrics_calls if call['success']]
+            col_m1, col_m2, col_m3, col_m4 = st.columns(4)
+            col_m1.metric("Calls", len(metrics_calls), f"{len(metrics_calls) - len(successful_calls)} errors", delta_color="off")
+            col_m2.metric("Total cost", f"${sum(call['cost_usd'] or 0.0 for call in metrics_calls):.4f}")
+            col_m3.metric("Input tokens", f"{sum(call['input_tokens'] or 0 for call in metrics_calls):,}")
+            col_m4.metric("Output tokens", f"{sum(call['output_tokens'] or 0 for call in metrics_calls):,}")
+            
+            st.markdown("#### Latency by model and operation")
+            summary_rows = [{
+                'Provider': row['provider'],
+                'Model': row['model_id'],
+                'Operation': row['operation'],
+                'Calls': row['calls'],
+                'Errors': row['errors'],
+                'p50 (s)': row['latency_p50'],
+                'p90 (s)': row['latency_p90'],
+                'p99 (s)': row['latency_p99'],
+                'First token p50 (s)': row['first_token_p50'],
+                'Input tokens': row['input_tokens'],
+                'Output tokens': row['output_tokens'],
+                'Cost ($)': row['cost_usd']
+            } for row in query_metrics.summary(metrics_since, metrics_provider)]
+            st.dataframe(pd.DataFrame(summary_rows).round(3), use_container_width=True, hide_index=True)
+            
+            if successful_calls:
+                calls_frame = pd.DataFrame(successful_calls)
+                calls_frame['time'] = pd.to_datetime(calls_frame['timestamp'], unit='s')
+                fig = px.scatter(calls_frame, x='time', y='latency_seconds', color='model_id', symbol='operation',
+                                 hover_data=['query', 'input_tokens', 'output_tokens', 'cost_usd'],
+                                 title="Call latency over time", labels={'latency_seconds': 'Latency (s)'})
+                st.plotly_chart(fig, use_container_width=True)
+            
+            with st.expander(f"🧾 Recent calls ({min(len(metrics_calls), 100)} of {len(metrics_calls)})"):
+                recent_frame = pd.DataFrame(metrics_calls[:100])
+                recent_frame['timestamp'] = pd.to_datetime(recent_frame['timestamp'], unit='s')
+                st.dataframe(recent_frame.drop(columns=['id']), use_container_width=True, hide_index=True)
+            
+            if st.button("🗑️ Clear Metrics"):
+                query_metrics.clear()
+                st.rerun()
+        else:
+            st.info("No model calls recorded in this window yet")
 
 with col2:
     st.markdown("### 📊 Infrastructure Overview")
@@ -1169,6 +1361,21 @@ with col2:
             for service, count in resource_counts.items():
                 st.metric(f"{service} Resources", count)
         
+        # Precomputed rollups for this snapshot
+        if "aws_inventory_summary" in st.session_state:
+            with st.expander("🧾 Inventory Summary"):
+                st.text(summary_levels(st.session_state["aws_inventory_summary"])[0])
+
+        if st.session_state.get("aws_context_savings"):
+            with st.expander("📉 Context Compression"):
+                savings = st.session_state["aws_context_savings"]
+                total_json = sum(row['json_tokens'] for row in savings)
+                total_table = sum(row['table_tokens'] for row in savings)
+                st.caption(f"Tables use ~{total_table:,} tokens instead of ~{total_json:,} as JSON "
+                           f"({total_json / max(total_table, 1):.1f}x smaller)")
+                for row in savings:
+                    st.text(f"{row['resource_type']}: {row['json_tokens']:,} → {row['table_tokens']:,} ({row['ratio']:.1f}x)")
+        
         # Show raw data in expandable section
         with st.expander("🔍 Raw Data"):
             safe_json_display(aws_data)
@@ -1185,12 +1392,44 @@ with col1:
 
 with col2:
     if st.button("📊 Generate Report"):
-        st.success("Report generation coming soon!")
+        if "aws_raw_data" not in st.session_state:
+            st.error("Please collect AWS data first")
+        elif llm_provider != "Bedrock" or not bedrock_model:
+            st.error("Report generation needs a configured Bedrock model")
+        else:
+            from aws_collector import format_data_for_llm
+            report_progress = st.progress(0.0, text=f"Answering {len(DEFAULT_REPORT_QUESTIONS)} report questions...")
+            report_results = run_question_batch(
+                DEFAULT_REPORT_QUESTIONS,
+                format_data_for_llm(st.session_state["aws_raw_data"]),
+                bedrock_model,
+                create_bedrock_runtime(aws_access_key, aws_secret_key, aws_region, use_cli_creds, aws_profile,
+                                       st.session_state.get("bedrock_regions")),
+                inventory_summary=st.session_state.get("aws_inventory_summary"),
+                progress_callback=lambda done, total: report_progress.progress(
+                    done / total, text=f"Answered {done} of {total} questions")
+            )
+            report_progress.empty()
+            st.session_state["report_markdown"] = format_report(report_results, bedrock_model)
+            failed = sum(1 for result in report_results if result['error'])
+            if failed:
+                st.warning(f"{failed} of {len(report_results)} questions could not be answered")
+    if st.session_state.get("report_markdown"):
+        st.download_button(
+            "⬇️ Download Report",
+            st.session_state["report_markdown"],
+            file_name=f"aws-infrastructure-report-{datetime.now().strftime('%Y%m%d')}.md",
+            mime="text/markdown"
+        )
 
 with col3:
     if st.button("🔄 Refresh Data"):
         if "aws_raw_data" in st.session_state:
             del st.session_state["aws_raw_data"]
+        if "aws_inventory_summary" in st.session_state:
+            del st.session_state["aws_inventory_summary"]
+        if "aws_context_savings" in st.session_state:
+            del st.session_state["aws_context_savings"]
         if "bedrock_models" in st.session_state:
             del st.session_state["bedrock_models"]
         st.success("Data cleared! Please collect AWS data again.")